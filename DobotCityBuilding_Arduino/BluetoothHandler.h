@@ -16,6 +16,16 @@
 
 // EVERY PARAMETER IS PASSED AS AN HEXADECIMAL INTEGER
 
+// Binary Frame Format (negotiated with CMD_NEGOTIATE, the parser recognizes both formats at any time) :
+// A5 - Length - Seq - Command ID - Data - CRC16
+// Length (1 byte) counts the Seq, Command ID and Data bytes
+// CRC16 (2 bytes, big endian) is a CRC-16/CCITT computed from the Length byte up to the end of the Data
+// Binary frames are always sequenced and acknowledged with a binary CMD_SEQ_ACK frame
+// CMD_REMOVE_BLOCK data is a list of ids (1 byte each)
+// CMD_UPDATE_BLOCK data is a list of compounds (7 bytes each) :
+//   id (1 byte), xPos and yPos (2 bytes each, multiplied by 100), rot (12 bits, multiplied by 40) then type (4 bits)
+// CMD_SET_MODE data is the mode (1 byte), other commands have no data
+
 #include "SerialInterface.h"
 #include "DobotCityUtils.h"
 #include "CityMapHandler.h"
@@ -33,6 +43,17 @@
 // Example : AA10A5C0473013316AA
 #define CMD_SET_BLOCK 1
 
+// Parameters : id (2 bytes)
+// Remove the compound registered with the given id
+// Example : AA3013AA
+#define CMD_REMOVE_BLOCK 3
+
+// Parameters : id (2 bytes), xPos (4bytes), yPos (4bytes), rot(4bytes), type(1byte)
+// Register a compound with the given id, or move it if the id is already registered
+// Same encoding as CMD_SET_BLOCK
+// Example : AA4003ab64e2a04e213AA
+#define CMD_UPDATE_BLOCK 4
+
 // Parameters : mode (1 byte)
 // Set the mode to operate
 // Example : AA212AA
@@ -46,6 +67,34 @@
 // Example : AA62AA
 #define CMD_CONFIRM_CALIBRATION 6
 
+// Parameters : seq (2 bytes), then the payload of any other packet (command ID and parameters)
+// Sequenced packets are acknowledged with CMD_SEQ_ACK instead of CMD_ACK, so that several of them can be in flight
+// Packets received out of order are kept until the missing ones arrive, duplicates are acknowledged but not processed
+// Example : AA700215AA (Sequence number 0, Set Mode 1)
+#define CMD_SEQUENCED 7
+
+// Parameters : next expected seq (2 bytes), bitmap of the packets received after it (2 bytes)
+// Sent by the Arduino only. Bit i of the bitmap is set if packet (next expected seq + 1 + i) was received
+// Example : AA805035AA (Every packet up to 4 was processed, 6 and 7 were received)
+#define CMD_SEQ_ACK 8
+
+// Parameters : None
+// Restart the sequence numbers from 0, acknowledged with CMD_ACK
+// Example : AA92AA
+#define CMD_SEQ_RESET 9
+
+// Parameters : format (1 byte), 0 for ASCII, 1 for binary
+// Check that a wire format is supported and restart the sequence numbers from 0, acknowledged with CMD_ACK
+// Example : AAa13AA
+#define CMD_NEGOTIATE 10
+
+// Parameters : None, ASCII only
+// Answered with the state of the Arduino instead of an acknowledgment :
+// boot id (4 bytes), compounds in storage (2 bytes) and mode (1 byte)
+// The boot id is drawn at random on startup, so that the control interface can tell whether the Arduino restarted
+// Example : AAb3AA, answered with AAb3f0c0514AA (Boot 3f0c, 5 compounds, mode 1)
+#define CMD_STATE 11
+
 // Parameters : None
 // Example : AAE3AA
 #define CMD_RESET 14
@@ -54,10 +103,17 @@
 // Example : AAF15AA
 #define CMD_ACK 15
 
-#define MAX_PAYLOAD_LENGTH 14
+#define MAX_PAYLOAD_LENGTH 19
 #define MIN_PAYLOAD_SIZE 6
-#define MAX_PACKET_LENGTH 20
+#define MAX_PACKET_LENGTH 64 // Largest binary frame, the size of the software serial buffer
 #define MAX_PACKET_UNIQUE_IDS 16 // 0 to F <=> 0 to 15
+#define SEQ_WINDOW 8 // How many sequenced packets can be held while waiting for a missing one
+
+#define FORMAT_ASCII 0
+#define FORMAT_BINARY 1
+#define BINARY_SYNC 0xA5
+#define BINARY_COMPOUND_SIZE 7
+#define BINARY_ROT_STEPS 40.0f // Rotation steps per degree
 
 typedef bool(*BluetoothHandlerFunc)(const char*, uint8_t);
 
@@ -86,6 +142,31 @@ bool Handle_SetBlock(const char payload[MAX_PACKET_LENGTH], uint8_t payload_leng
 	return CityMapHandler::instance->CreateCompound(xf, yf, rotf, type);
 }
 
+bool Handle_RemoveBlock(const char payload[MAX_PACKET_LENGTH], uint8_t payload_length)
+{
+	int id;
+	if(payload_length != 8 || !ReadHexInt(payload, 3, 2, payload_length, &id)) return false;
+	CityMapHandler::instance->RemoveCompound(id);
+	return true;
+}
+bool Handle_UpdateBlock(const char payload[MAX_PACKET_LENGTH], uint8_t payload_length)
+{
+	int id, x, y, rot, type;
+	if(
+			payload_length != 21 ||
+			!ReadHexInt(payload, 3, 2, payload_length, &id) ||
+			!ReadHexInt(payload, 5, 4, payload_length, &x) ||
+			!ReadHexInt(payload, 9, 4, payload_length, &y) ||
+			!ReadHexInt(payload, 13, 4, payload_length, &rot) ||
+			!ReadHexInt(payload, 17, 1, payload_length, &type)
+			) return false;
+
+	float xf = (float) x / 100.0f;
+	float yf = (float) y / 100.0f;
+	float rotf = (float) rot / 100.0f;
+	return CityMapHandler::instance->UpsertCompound(id, xf, yf, rotf, type);
+}
+
 bool Handle_SetMode(const char payload[MAX_PACKET_LENGTH], uint8_t payload_length)
 {
 	int mode;
@@ -156,15 +237,29 @@ public:
 	bool IsPayloadComplete();
 	void ClearPayload();
 	bool ValidateChecksum();
+	bool IsBinaryPayload();
+	bool ProcessPayload(const char* packet, uint8_t packet_length);
+	bool ProcessBinaryPayload(const char* packet, uint8_t packet_length);
+
+	// Sequenced packets
+	void ProcessSequenced();
+	void ProcessBinary();
+	void ReceiveSequenced(uint8_t seq);
+	void ResetSequence();
+	bool Negotiate();
 
 	// Communication
 	void Acknowledge(bool valid);
+	void AcknowledgeSequence();
+	void SendState();
+	void WriteBinaryFrame(uint8_t cmd, const uint8_t* data, uint8_t data_length);
 
 	// Handler function management
 	BluetoothHandlerFunc GetHandler(uint8_t pid);
 	void SetHandler(uint8_t pid, BluetoothHandlerFunc handler);
 
 	unsigned long last_rcv_ts = 0; // Last time we received data through bluetooth
+	uint16_t boot_id = 0; // Drawn at random on startup, reported by CMD_STATE
 private:
 	void ThrowPayloadError(const char* Str);
 
@@ -172,6 +267,13 @@ private:
 	char payload[MAX_PACKET_LENGTH] = {};
 	uint8_t payload_length = 0;
 
+	// Sequenced packets received ahead of the next expected one, indexed by seq % SEQ_WINDOW
+	char window[SEQ_WINDOW][MAX_PACKET_LENGTH] = {};
+	uint8_t window_length[SEQ_WINDOW] = {}; // 0 when the slot is empty
+	uint8_t expected_seq = 0;
+
+	bool binary_mode = false; // Whether the last packet was a binary frame, acknowledgments are sent in the same format
+
 	BluetoothHandlerFunc handlers[MAX_PACKET_UNIQUE_IDS] = {};
 };
 
@@ -185,7 +287,8 @@ void BluetoothHandler::Init(SerialInterface *_serial)
 	// Register Handlers
 	this->SetHandler(CMD_RESET_BLOCKS, &Handle_ResetBlocks);
 	this->SetHandler(CMD_SET_BLOCK, &Handle_SetBlock);
-	// ...
+	this->SetHandler(CMD_REMOVE_BLOCK, &Handle_RemoveBlock);
+	this->SetHandler(CMD_UPDATE_BLOCK, &Handle_UpdateBlock);
 	this->SetHandler(CMD_SET_MODE, &Handle_SetMode);
 	this->SetHandler(CMD_REQUEST_CALIBRATION, &Handle_CalibRequest);
 	this->SetHandler(CMD_CONFIRM_CALIBRATION, &Handle_CalibConfirm);
@@ -193,7 +296,11 @@ void BluetoothHandler::Init(SerialInterface *_serial)
 	this->SetHandler(CMD_RESET, &Handle_Reset);
 	this->SetHandler(CMD_ACK, &Handle_Ack);
 
+	randomSeed(analogRead(A0) ^ micros());
+	this->boot_id = random(1, 0x10000);
+
 	this->ClearPayload();
+	this->ResetSequence();
 }
 
 SerialInterface* BluetoothHandler::GetSerialPort()
@@ -215,20 +322,40 @@ void BluetoothHandler::Tick()
 		}
 		//Serial.print("\n");
 
-		if(this->payload_length >= MAX_PACKET_LENGTH) return this->ThrowPayloadError("Invalid Payload");
+		if(this->payload_length >= MAX_PACKET_LENGTH && !this->IsPayloadComplete()) return this->ThrowPayloadError("Invalid Payload");
 
 		if(!this->IsPayloadComplete()) return;
 
+		this->binary_mode = this->IsBinaryPayload();
+		if(this->binary_mode)
+		{
+			this->ProcessBinary();
+			continue;
+		}
+
 		if(!this->ValidateChecksum()) return this->ThrowPayloadError("Invalid Checksum");
 
 		// Process payload
 		int pid = Hex2Int(this->payload[2]);
 
-		if(pid < 0 || pid >= MAX_PACKET_UNIQUE_IDS) return this->ThrowPayloadError("Invalid Packet Id");
-
-		if(this->handlers[pid] == nullptr) return this->ThrowPayloadError("Unhandled Packet Id");
-
-		if(!this->handlers[pid](this->payload, this->payload_length)) return this->ThrowPayloadError("Failed to process packet");
+		if(pid == CMD_SEQUENCED)
+		{
+			this->ProcessSequenced();
+			continue;
+		}
+		if(pid == CMD_STATE)
+		{
+			this->last_rcv_ts = millis();
+			this->SendState();
+			this->ClearPayload();
+			continue;
+		}
+		if(pid == CMD_SEQ_RESET) this->ResetSequence();
+		else if(pid == CMD_NEGOTIATE)
+		{
+			if(!this->Negotiate()) return this->ThrowPayloadError("Unsupported Format");
+		}
+		else if(!this->ProcessPayload(this->payload, this->payload_length)) return this->ThrowPayloadError("Failed to process packet");
 
 		this->last_rcv_ts = millis();
 		this->Acknowledge(true);
@@ -236,8 +363,179 @@ void BluetoothHandler::Tick()
 	}
 }
 
+/**
+ * Call the handler registered for a packet
+ * @param packet Packet, including its header, checksum and footer
+ * @param packet_length
+ * @return Whether the packet was processed successfully
+ */
+bool BluetoothHandler::ProcessPayload(const char* packet, uint8_t packet_length)
+{
+	if((uint8_t) packet[0] == BINARY_SYNC) return this->ProcessBinaryPayload(packet, packet_length);
+
+	int pid = Hex2Int(packet[2]);
+
+	if(pid < 0 || pid >= MAX_PACKET_UNIQUE_IDS || this->handlers[pid] == nullptr)
+	{
+		Serial.println("Invalid or Unhandled Packet Id");
+		return false;
+	}
+	return this->handlers[pid](packet, packet_length);
+}
+
+/**
+ * Call the command held in a binary frame
+ * @param packet Binary frame, including its sync byte and CRC
+ * @param packet_length
+ * @return Whether the frame was processed successfully
+ */
+bool BluetoothHandler::ProcessBinaryPayload(const char* packet, uint8_t packet_length)
+{
+	auto frame = reinterpret_cast<const uint8_t*>(packet);
+	uint8_t cmd = frame[3];
+	const uint8_t* data = frame + 4;
+	uint8_t data_length = frame[1] - 2;
+
+	switch(cmd)
+	{
+		case CMD_SET_MODE:
+			if(data_length != 1) return false;
+			CityMapHandler::instance->mode = data[0];
+			printf("\n\nSet mode to %d\n\n", data[0]);
+			return true;
+		case CMD_REMOVE_BLOCK:
+			for(uint8_t i = 0; i < data_length; ++i)
+				CityMapHandler::instance->RemoveCompound(data[i]);
+			return true;
+		case CMD_UPDATE_BLOCK:
+		{
+			if(data_length % BINARY_COMPOUND_SIZE != 0) return false;
+			bool success = true;
+			for(uint8_t i = 0; i < data_length; i += BINARY_COMPOUND_SIZE)
+			{
+				uint16_t x = (data[i + 1] << 8) | data[i + 2];
+				uint16_t y = (data[i + 3] << 8) | data[i + 4];
+				uint16_t rt = (data[i + 5] << 8) | data[i + 6];
+				success &= CityMapHandler::instance->UpsertCompound(
+					data[i], (float) x / 100.0f, (float) y / 100.0f, (float) (rt >> 4) / BINARY_ROT_STEPS, rt & 0x0F
+				);
+			}
+			return success;
+		}
+		case CMD_SET_BLOCK:
+			return false; // CMD_UPDATE_BLOCK replaces it in binary format
+		default:
+			// Every other command ignores its parameters
+			if(cmd >= MAX_PACKET_UNIQUE_IDS || this->handlers[cmd] == nullptr)
+			{
+				Serial.println("Invalid or Unhandled Packet Id");
+				return false;
+			}
+			return this->handlers[cmd](packet, packet_length);
+	}
+}
+
+/**
+ * Unwrap the sequenced ASCII packet held in the payload and process it
+ */
+void BluetoothHandler::ProcessSequenced()
+{
+	int seq;
+	if(this->payload_length < MIN_PAYLOAD_SIZE + 3 || !ReadHexInt(this->payload, 3, 2, this->payload_length, &seq))
+		return this->ThrowPayloadError("Invalid Sequenced Packet");
+
+	// Unwrap the packet : AA7ssXXXXcAA becomes AAXXXXcAA
+	for(uint8_t i = 5; i < this->payload_length; ++i)
+		this->payload[i - 3] = this->payload[i];
+	for(uint8_t i = this->payload_length - 3; i < this->payload_length; ++i)
+		this->payload[i] = '\0';
+	this->payload_length -= 3;
+
+	this->ReceiveSequenced(seq);
+}
+
+/**
+ * Validate the binary frame held in the payload and process it
+ */
+void BluetoothHandler::ProcessBinary()
+{
+	auto frame = reinterpret_cast<const uint8_t*>(this->payload);
+	uint8_t length = frame[1];
+	uint16_t crc = (frame[length + 2] << 8) | frame[length + 3];
+	if(length < 2 || ComputeCRC16(frame + 1, length + 1) != crc) return this->ThrowPayloadError("Invalid CRC");
+
+	this->ReceiveSequenced(frame[2]);
+}
+
+/**
+ * Store the sequenced packet held in the payload, process every packet that is now in order,
+ * then acknowledge what was received so far
+ * @param seq Sequence number of the packet
+ */
+void BluetoothHandler::ReceiveSequenced(uint8_t seq)
+{
+	uint8_t offset = seq - this->expected_seq; // Distance in the circular sequence space
+	uint8_t slot = seq % SEQ_WINDOW;
+	if(offset < SEQ_WINDOW && this->window_length[slot] == 0)
+	{
+		for(uint8_t i = 0; i < this->payload_length; ++i)
+			this->window[slot][i] = this->payload[i];
+		this->window_length[slot] = this->payload_length;
+	}
+	this->ClearPayload();
+
+	// Process every packet that is now in order
+	while(this->window_length[this->expected_seq % SEQ_WINDOW] != 0)
+	{
+		slot = this->expected_seq % SEQ_WINDOW;
+		// A packet that can't be processed is skipped, otherwise every following packet would be stuck behind it
+		if(!this->ProcessPayload(this->window[slot], this->window_length[slot]))
+			Serial.println("Failed to process sequenced packet");
+		this->window_length[slot] = 0;
+		++this->expected_seq;
+	}
+
+	this->last_rcv_ts = millis();
+	this->AcknowledgeSequence();
+}
+
+void BluetoothHandler::ResetSequence()
+{
+	this->expected_seq = 0;
+	for(auto & length : this->window_length) length = 0;
+}
+
+/**
+ * Check the wire format requested in the payload, and restart the sequence numbers
+ * @return Whether the format is supported
+ */
+bool BluetoothHandler::Negotiate()
+{
+	int format;
+	if(this->payload_length != 7 || !ReadHexInt(this->payload, 3, 1, this->payload_length, &format)) return false;
+	if(format != FORMAT_ASCII && format != FORMAT_BINARY) return false;
+	this->ResetSequence();
+	return true;
+}
+
+bool BluetoothHandler::IsBinaryPayload()
+{
+	return this->payload_length >= 1 && (uint8_t) this->payload[0] == BINARY_SYNC;
+}
+
 bool BluetoothHandler::IsPayloadComplete()
 {
+	if(this->IsBinaryPayload())
+	{
+		if(this->payload_length < 2) return false;
+		uint8_t length = this->payload[1];
+		if(length < 2 || length > MAX_PACKET_LENGTH - 4)
+		{
+			this->ClearPayload();
+			return false;
+		}
+		return this->payload_length >= length + 4;
+	}
 
 	if(this->payload_length < MIN_PAYLOAD_SIZE)  // 4 embed bytes AA - AA, 1 for packet id, 1 for checksum
 	{
@@ -263,24 +561,81 @@ void BluetoothHandler::ClearPayload()
 
 bool BluetoothHandler::ValidateChecksum()
 {
-	uint8_t checksum = 0;
-	for(uint8_t i = 2; i < this->payload_length - 3; ++i)
-	{
-		uint8_t chr = Hex2Int(this->payload[i]);
-		for(uint8_t bit_n = 0; bit_n < 8; ++bit_n)
-			checksum += (chr >> bit_n) & 0x01;
-	}
-	return (checksum % 10) == (this->payload[this->payload_length - 3] - '0');
+	return ComputeChecksum(this->payload + 2, this->payload_length - 5) == (this->payload[this->payload_length - 3] - '0');
 }
 
 void BluetoothHandler::Acknowledge(bool valid)
 {
+	if(this->binary_mode)
+	{
+		uint8_t data = valid ? 1 : 0;
+		return this->WriteBinaryFrame(CMD_ACK, &data, 1);
+	}
 	this->serialPort->write(valid ? "AAF15AA" : "AAF04AA");
 }
 
+void BluetoothHandler::AcknowledgeSequence()
+{
+	uint8_t bitmap = 0;
+	for(uint8_t i = 0; i < SEQ_WINDOW - 1; ++i)
+	{
+		if(this->window_length[(uint8_t) (this->expected_seq + 1 + i) % SEQ_WINDOW] != 0)
+			bitmap |= 1 << i;
+	}
+
+	if(this->binary_mode)
+	{
+		uint8_t data[2] = {this->expected_seq, bitmap};
+		return this->WriteBinaryFrame(CMD_SEQ_ACK, data, 2);
+	}
+
+	char ack[11];
+	snprintf(ack, sizeof(ack), "AA%x%02x%02x", CMD_SEQ_ACK, this->expected_seq, bitmap);
+	ack[7] = (char) ('0' + ComputeChecksum(ack + 2, 5));
+	ack[8] = 'A';
+	ack[9] = 'A';
+	ack[10] = '\0';
+	this->serialPort->write(ack);
+}
+
+/**
+ * Answer a CMD_STATE packet, so that the control interface only sends again what the Arduino lost
+ */
+void BluetoothHandler::SendState()
+{
+	char state[16];
+	snprintf(
+		state, sizeof(state), "AA%x%04x%02x%x",
+		CMD_STATE, this->boot_id, CityMapHandler::instance->GetCompoundCount(), CityMapHandler::instance->mode & 0xF
+	);
+	state[10] = (char) ('0' + ComputeChecksum(state + 2, 8));
+	state[11] = 'A';
+	state[12] = 'A';
+	state[13] = '\0';
+	this->serialPort->write(state);
+}
+
+void BluetoothHandler::WriteBinaryFrame(uint8_t cmd, const uint8_t* data, uint8_t data_length)
+{
+	uint8_t frame[MAX_PACKET_LENGTH];
+	frame[0] = BINARY_SYNC;
+	frame[1] = data_length + 2;
+	frame[2] = 0; // Frames sent by the Arduino aren't sequenced
+	frame[3] = cmd;
+	for(uint8_t i = 0; i < data_length; ++i)
+		frame[4 + i] = data[i];
+	uint16_t crc = ComputeCRC16(frame + 1, data_length + 3);
+	frame[data_length + 4] = crc >> 8;
+	frame[data_length + 5] = crc & 0xFF;
+
+	for(uint8_t i = 0; i < data_length + 6; ++i)
+		this->serialPort->write(frame[i]);
+}
+
 void BluetoothHandler::ThrowPayloadError(const char* Str)
 {
 	Serial.println(Str);
+	this->binary_mode = this->IsBinaryPayload();
 	this->ClearPayload();
 	this->Acknowledge(false);
 }
@@ -15,6 +15,8 @@
 #define T_CAR 2
 #define T_TREE 3
 
+#define COMPOUND_NO_ID 0xFF
+
 /**
  * Represents a slot to be built in the city
  * The xPos and yPos coordinates are in R1'
@@ -87,6 +89,7 @@ typedef struct tagBuildingSlot
 typedef struct tagBuildingCompound
 {
 	float xPos = .0f; float yPos = .0f; float rot = 0; int8_t type = T_NONE;
+	uint8_t id = COMPOUND_NO_ID; // Id given by the control interface
 
 	void GetRealPosition(float* oX, float* oY, float* oRot) const
 	{
@@ -27,6 +27,9 @@ public:
 
 	void ResetCompounds();
 	bool CreateCompound(float xPos, float yPos, float rot, uint8_t type);
+	bool UpsertCompound(uint8_t id, float xPos, float yPos, float rot, uint8_t type);
+	void RemoveCompound(uint8_t id);
+	uint8_t GetCompoundCount();
 
 	void GetBuildingState(int* progress, int* citySize);
 	void Reset();
@@ -142,6 +145,7 @@ bool CityMapHandler::CreateCompound(float xPos, float yPos, float rot, uint8_t t
 	this->_compounds[this->_compoundCount].yPos = yPos;
 	this->_compounds[this->_compoundCount].rot = rot;
 	this->_compounds[this->_compoundCount].type = type;
+	this->_compounds[this->_compoundCount].id = COMPOUND_NO_ID;
 	++this->_compoundCount;
 
 	Serial.print("\n\nNew Compound registered (x=");
@@ -157,6 +161,49 @@ bool CityMapHandler::CreateCompound(float xPos, float yPos, float rot, uint8_t t
 	return true;
 }
 
+/**
+ * Register a compound with an id given by the control interface, or move it if it is already registered
+ * @param id
+ * @param xPos
+ * @param yPos
+ * @param rot
+ * @param type
+ * @return
+ */
+bool CityMapHandler::UpsertCompound(uint8_t id, float xPos, float yPos, float rot, uint8_t type)
+{
+	int i = 0;
+	while(i < this->_compoundCount && this->_compounds[i].id != id) ++i;
+	if(i >= COMPOUND_COUNT) return false;
+	if(i == this->_compoundCount) ++this->_compoundCount;
+
+	this->_compounds[i].xPos = xPos;
+	this->_compounds[i].yPos = yPos;
+	this->_compounds[i].rot = rot;
+	this->_compounds[i].type = type;
+	this->_compounds[i].id = id;
+	return true;
+}
+uint8_t CityMapHandler::GetCompoundCount()
+{
+	return this->_compoundCount;
+}
+
+/**
+ * Remove the compound registered with the given id, if any
+ * The last compound takes its place so that the list stays packed
+ * @param id
+ */
+void CityMapHandler::RemoveCompound(uint8_t id)
+{
+	for(int i = 0; i < this->_compoundCount; ++i)
+	{
+		if(this->_compounds[i].id != id) continue;
+		this->_compounds[i] = this->_compounds[--this->_compoundCount];
+		return;
+	}
+}
+
 /**
  * @return Which block we should fetch from the storage zone
  */
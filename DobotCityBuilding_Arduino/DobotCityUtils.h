@@ -41,4 +41,40 @@ bool ReadHexInt(const char* payload, uint8_t from, uint8_t length, uint8_t paylo
 	return true;
 }
 
+/**
+ * Compute the checksum of a payload : sum of all the bits of its hexadecimal characters, mod 10
+ * @param payload First character of the payload (command ID)
+ * @param length Number of characters to include
+ * @return
+ */
+uint8_t ComputeChecksum(const char* payload, uint8_t length)
+{
+	uint8_t checksum = 0;
+	for(uint8_t i = 0; i < length; ++i)
+	{
+		uint8_t chr = Hex2Int(payload[i]);
+		for(uint8_t bit_n = 0; bit_n < 8; ++bit_n)
+			checksum += (chr >> bit_n) & 0x01;
+	}
+	return checksum % 10;
+}
+
+/**
+ * Compute the CRC-16/CCITT of a binary frame (polynomial 0x1021, initial value 0xFFFF)
+ * @param data First byte to include
+ * @param length Number of bytes to include
+ * @return
+ */
+uint16_t ComputeCRC16(const uint8_t* data, uint8_t length)
+{
+	uint16_t crc = 0xFFFF;
+	for(uint8_t i = 0; i < length; ++i)
+	{
+		crc ^= (uint16_t) data[i] << 8;
+		for(uint8_t bit_n = 0; bit_n < 8; ++bit_n)
+			crc = (crc & 0x8000) ? (crc << 1) ^ 0x1021 : crc << 1;
+	}
+	return crc;
+}
+
 #endif //DOBOTCITYBUILDING_DOBOTCITYUTILS_H
@@ -0,0 +1,629 @@
+import os
+import random
+import select
+import socket
+import time
+from collections import deque
+from threading import Condition, Lock, Thread
+
+from link_protocol import *
+
+# Emulation of the Arduino side of the bluetooth link (BluetoothHandler.h and the compound storage of CityMapHandler.h)
+# so that the link can be tested and benchmarked without the HC-06 module, the Arduino and the Dobots
+# BluetoothHandler.port_url can be pointed to the url of an emulator's transport
+
+CMD_RESET_BLOCKS = 0x0
+CMD_SET_BLOCK = 0x1
+CMD_SET_MODE = 0x2
+CMD_REQUEST_CALIBRATION = 0x5
+CMD_CONFIRM_CALIBRATION = 0x6
+CMD_RESET = 0xE
+
+MAX_PACKET_LENGTH = 64
+MIN_PAYLOAD_SIZE = 6
+MAX_PACKET_UNIQUE_IDS = 16
+COMPOUND_COUNT = 28
+COMPOUND_NO_ID = 0xFF
+RX_BUFFER_SIZE = 64  # Size of the software serial buffer, bytes received while it is full are lost
+
+
+def hex2int(char: int) -> int:
+	"""
+	Hex2Int from DobotCityUtils.h, returns 255 for invalid characters
+	"""
+	try:
+		return int(chr(char), base=16)
+	except ValueError:
+		return 0xFF
+
+
+def read_hex_int(payload: bytes, start: int, length: int) -> int | None:
+	"""
+	ReadHexInt from DobotCityUtils.h
+	:return: The value, or None if the payload is too short
+	"""
+	if start + length > len(payload):
+		return None
+	value = 0
+	for char in payload[start:start + length]:
+		digit = hex2int(char)
+		if digit > 0xF:
+			break  # strtol stops at the first invalid character
+		value = value * 16 + digit
+	return value
+
+
+def compute_checksum(payload: bytes) -> int:
+	"""
+	ComputeChecksum from DobotCityUtils.h
+	"""
+	return sum(bin(hex2int(char)).count("1") for char in payload) % 10
+
+
+class EmulatedCityMap:
+	"""
+	Compound storage and mode of CityMapHandler.h
+	"""
+
+	def __init__(self):
+		# [id, x, y, rot, type] lists, packed at the start of the list like on the Arduino
+		self.compounds = []
+		self.mode = 0
+		self.calibration_requested = False
+
+	def reset_compounds(self):
+		self.compounds.clear()
+
+	def create_compound(self, x: float, y: float, rot: float, t: int) -> bool:
+		if len(self.compounds) >= COMPOUND_COUNT:
+			return False
+		self.compounds.append([COMPOUND_NO_ID, x, y, rot, t])
+		return True
+
+	def upsert_compound(self, cid: int, x: float, y: float, rot: float, t: int) -> bool:
+		for compound in self.compounds:
+			if compound[0] == cid:
+				compound[1:] = [x, y, rot, t]
+				return True
+		if len(self.compounds) >= COMPOUND_COUNT:
+			return False
+		self.compounds.append([cid, x, y, rot, t])
+		return True
+
+	def remove_compound(self, cid: int):
+		for i, compound in enumerate(self.compounds):
+			if compound[0] == cid:
+				self.compounds[i] = self.compounds[-1]
+				self.compounds.pop()
+				return
+
+	def reset(self):
+		self.mode = 0
+		self.calibration_requested = False
+		self.compounds.clear()
+
+	def matches(self, compounds, tolerance: float = 0.05) -> bool:
+		"""
+		:param compounds: Compounds sent to the Arduino, as [x, y, rot, type] lists
+		:param tolerance: Maximum difference for each value, to account for the fixed point encoding
+		:return: Whether the storage holds exactly those compounds
+		"""
+		if len(compounds) != len(self.compounds):
+			return False
+		stored = [c[1:] for c in self.compounds]
+		for x, y, rot, t in compounds:
+			for i, (sx, sy, srot, st) in enumerate(stored):
+				rot_diff = abs(rot % 90 - srot) % 90
+				if st == t and abs(sx - x) <= tolerance and abs(sy - y) <= tolerance and min(rot_diff, 90 - rot_diff) <= tolerance:
+					del stored[i]
+					break
+			else:
+				return False
+		return True
+
+
+class EmulatedBluetooth:
+	"""
+	Python port of BluetoothHandler.h : packet parser, checksum and CRC checks, handler table and receive window
+	"""
+
+	def __init__(self, write, windowed: bool = True, binary: bool = True):
+		"""
+		:param write: Called with the bytes sent back to the monitor
+		:param windowed: Whether the emulated firmware supports the sequenced packets
+		:param binary: Whether the emulated firmware supports the binary format
+		"""
+		self.write = write
+		self.windowed = windowed
+		self.binary = binary and windowed
+		# CMD_STATE came along with the windowed protocol
+		self.stateful = windowed
+		self.boot_id = random.randrange(1, 0x10000)
+		self.city = EmulatedCityMap()
+		self.rx = deque()
+		self.payload = bytearray()
+		self.window = [b""] * SEQ_WINDOW
+		self.expected_seq = 0
+		self.binary_mode = False
+		self.handlers = {
+			CMD_RESET_BLOCKS: self.handle_reset_blocks,
+			CMD_SET_BLOCK: self.handle_set_block,
+			CMD_SET_MODE: self.handle_set_mode,
+			CMD_REMOVE_BLOCK: self.handle_remove_block,
+			CMD_UPDATE_BLOCK: self.handle_update_block,
+			CMD_REQUEST_CALIBRATION: self.handle_calib_request,
+			CMD_CONFIRM_CALIBRATION: self.handle_calib_confirm,
+			CMD_RESET: self.handle_reset,
+			CMD_ACK: self.handle_ack,
+		}
+		# Statistics
+		self.processed = 0  # Commands processed (each compound of a batch counts as one)
+		self.frames = 0  # Packets and frames received and validated
+		self.errors = 0  # Packets rejected with a negative acknowledgment
+
+	# # # HANDLER FUNCTIONS # # #
+	def handle_reset_blocks(self, payload: bytes) -> bool:
+		self.city.reset_compounds()
+		return True
+
+	def handle_set_block(self, payload: bytes) -> bool:
+		values = [read_hex_int(payload, 3, 4), read_hex_int(payload, 7, 4), read_hex_int(payload, 11, 4), read_hex_int(payload, 15, 1)]
+		if len(payload) != 19 or None in values:
+			return False
+		x, y, rot, t = values
+		return self.city.create_compound(x / 100, y / 100, rot / 100, t)
+
+	def handle_remove_block(self, payload: bytes) -> bool:
+		cid = read_hex_int(payload, 3, 2)
+		if len(payload) != 8 or cid is None:
+			return False
+		self.city.remove_compound(cid)
+		return True
+
+	def handle_update_block(self, payload: bytes) -> bool:
+		values = [read_hex_int(payload, start, length) for start, length in ((3, 2), (5, 4), (9, 4), (13, 4), (17, 1))]
+		if len(payload) != 21 or None in values:
+			return False
+		cid, x, y, rot, t = values
+		return self.city.upsert_compound(cid, x / 100, y / 100, rot / 100, t)
+
+	def handle_set_mode(self, payload: bytes) -> bool:
+		mode = read_hex_int(payload, 3, 1)
+		if len(payload) != 7 or mode is None:
+			return False
+		self.city.mode = mode
+		return True
+
+	def handle_calib_request(self, payload: bytes) -> bool:
+		self.city.calibration_requested = True
+		return True
+
+	def handle_calib_confirm(self, payload: bytes) -> bool:
+		self.city.calibration_requested = False
+		return True
+
+	def handle_reset(self, payload: bytes) -> bool:
+		self.city.reset()
+		return True
+
+	def handle_ack(self, payload: bytes) -> bool:
+		return True
+
+	# # # PARSER # # #
+	def tick(self):
+		"""
+		BluetoothHandler::Tick, processes the received bytes
+		"""
+		while self.rx:
+			while self.rx and len(self.payload) < MAX_PACKET_LENGTH and not self.is_payload_complete():
+				self.payload.append(self.rx.popleft())
+
+			if len(self.payload) >= MAX_PACKET_LENGTH and not self.is_payload_complete():
+				return self.throw_payload_error()
+			if not self.is_payload_complete():
+				return
+
+			self.binary_mode = self.is_binary_payload()
+			if self.binary_mode:
+				self.process_binary()
+				continue
+
+			if not self.validate_checksum():
+				return self.throw_payload_error()
+
+			pid = hex2int(self.payload[2])
+			if pid == CMD_SEQUENCED and self.windowed:
+				self.process_sequenced()
+				continue
+			if pid == CMD_STATE and self.stateful:
+				self.frames += 1
+				self.send_state()
+				self.payload.clear()
+				continue
+			if pid == CMD_SEQ_RESET and self.windowed:
+				self.reset_sequence()
+			elif pid == CMD_NEGOTIATE and self.binary:
+				if not self.negotiate():
+					return self.throw_payload_error()
+			elif not self.process_payload(bytes(self.payload)):
+				return self.throw_payload_error()
+
+			self.frames += 1
+			self.acknowledge(True)
+			self.payload.clear()
+
+	def process_payload(self, packet: bytes) -> bool:
+		if packet[0] == BINARY_SYNC:
+			return self.process_binary_payload(packet)
+		handler = self.handlers.get(hex2int(packet[2]))
+		if handler is None:
+			return False
+		self.processed += 1
+		return handler(packet)
+
+	def process_binary_payload(self, packet: bytes) -> bool:
+		cmd, data = packet[3], packet[4:packet[1] + 2]
+		match cmd:
+			case 0x2:  # CMD_SET_MODE
+				if len(data) != 1:
+					return False
+				self.city.mode = data[0]
+				self.processed += 1
+				return True
+			case 0x3:  # CMD_REMOVE_BLOCK
+				for cid in data:
+					self.city.remove_compound(cid)
+				self.processed += len(data)
+				return True
+			case 0x4:  # CMD_UPDATE_BLOCK
+				if len(data) % COMPOUND_SIZE != 0:
+					return False
+				success = True
+				for i in range(0, len(data), COMPOUND_SIZE):
+					cid, x, y, rt = struct.unpack(">BHHH", data[i:i + COMPOUND_SIZE])
+					success &= self.city.upsert_compound(cid, x / 100, y / 100, (rt >> 4) / ROT_STEPS, rt & 0x0F)
+				self.processed += len(data) // COMPOUND_SIZE
+				return success
+			case 0x1:  # CMD_SET_BLOCK, replaced by CMD_UPDATE_BLOCK in binary format
+				return False
+			case _:
+				# Every other command ignores its parameters
+				handler = self.handlers.get(cmd)
+				if handler is None:
+					return False
+				self.processed += 1
+				return handler(packet)
+
+	def process_sequenced(self):
+		seq = read_hex_int(self.payload, 3, 2)
+		if len(self.payload) < MIN_PAYLOAD_SIZE + 3 or seq is None:
+			return self.throw_payload_error()
+		# Unwrap the packet : AA7ssXXXXcAA becomes AAXXXXcAA
+		del self.payload[2:5]
+		self.receive_sequenced(seq)
+
+	def process_binary(self):
+		length = self.payload[1]
+		crc = struct.unpack(">H", self.payload[length + 2:length + 4])[0]
+		if length < 2 or crc16(bytes(self.payload[1:length + 2])) != crc:
+			return self.throw_payload_error()
+		self.receive_sequenced(self.payload[2])
+
+	def receive_sequenced(self, seq: int):
+		self.frames += 1
+		offset = seq_distance(self.expected_seq, seq)
+		slot = seq % SEQ_WINDOW
+		if offset < SEQ_WINDOW and not self.window[slot]:
+			self.window[slot] = bytes(self.payload)
+		self.payload.clear()
+
+		# Process every packet that is now in order
+		while self.window[self.expected_seq % SEQ_WINDOW]:
+			slot = self.expected_seq % SEQ_WINDOW
+			self.process_payload(self.window[slot])
+			self.window[slot] = b""
+			self.expected_seq = (self.expected_seq + 1) % SEQ_MODULO
+
+		self.acknowledge_sequence()
+
+	def reset_sequence(self):
+		self.expected_seq = 0
+		self.window = [b""] * SEQ_WINDOW
+
+	def negotiate(self) -> bool:
+		fmt = read_hex_int(self.payload, 3, 1)
+		if len(self.payload) != 7 or fmt not in (FORMAT_ASCII, FORMAT_BINARY):
+			return False
+		self.reset_sequence()
+		return True
+
+	def is_binary_payload(self) -> bool:
+		return len(self.payload) >= 1 and self.payload[0] == BINARY_SYNC and self.binary
+
+	def is_payload_complete(self) -> bool:
+		if self.is_binary_payload():
+			if len(self.payload) < 2:
+				return False
+			length = self.payload[1]
+			if length < 2 or length > MAX_PACKET_LENGTH - 4:
+				self.payload.clear()
+				return False
+			return len(self.payload) >= length + 4
+
+		if len(self.payload) < MIN_PAYLOAD_SIZE:
+			if (len(self.payload) >= 1 and self.payload[0] != ord('A')) or (len(self.payload) >= 2 and self.payload[1] != ord('A')):
+				self.payload.clear()
+			return False
+		if self.payload[:2] != b"AA":
+			self.payload.clear()
+			return False
+		return self.payload[-2:] == b"AA"
+
+	def validate_checksum(self) -> bool:
+		return compute_checksum(self.payload[2:-3]) == self.payload[-3] - ord('0')
+
+	# # # COMMUNICATION # # #
+	def acknowledge(self, valid: bool):
+		if self.binary_mode:
+			return self.write(binary_frame(0, CMD_ACK, bytes((int(valid),))))
+		self.write(bytes(ACK_VALID if valid else ACK_INVALID, 'utf-8'))
+
+	def acknowledge_sequence(self):
+		bitmap = 0
+		for i in range(SEQ_WINDOW - 1):
+			if self.window[(self.expected_seq + 1 + i) % SEQ_WINDOW]:
+				bitmap |= 1 << i
+		if self.binary_mode:
+			return self.write(binary_frame(0, CMD_SEQ_ACK, bytes((self.expected_seq, bitmap))))
+		self.write(bytes(ascii_packet("{:x}{:02x}{:02x}".format(CMD_SEQ_ACK, self.expected_seq, bitmap)), 'utf-8'))
+
+	def send_state(self):
+		self.write(bytes(ascii_packet("{:x}{:04x}{:02x}{:x}".format(
+			CMD_STATE, self.boot_id, len(self.city.compounds), self.city.mode & 0xF
+		)), 'utf-8'))
+
+	def restart(self):
+		"""
+		Power cycle : everything in memory is lost, and a new boot id is drawn
+		"""
+		self.city = EmulatedCityMap()
+		self.rx.clear()
+		self.payload.clear()
+		self.reset_sequence()
+		self.binary_mode = False
+		self.boot_id = random.randrange(1, 0x10000)
+
+	def throw_payload_error(self):
+		self.errors += 1
+		self.binary_mode = self.is_binary_payload()
+		self.payload.clear()
+		self.acknowledge(False)
+
+
+class SerialLine:
+	"""
+	One direction of the emulated link : bytes are delivered in order, once they had time to be
+	transmitted at the configured baud rate, after the configured latency
+	"""
+
+	def __init__(self, deliver, baud: int = 9600, latency: float = 0.):
+		"""
+		:param deliver: Called with the bytes once they arrive
+		:param baud: Baud rate, 10 bits are sent per byte (None to disable the throttling)
+		:param latency: seconds, added to the transmission time of every chunk
+		"""
+		self.deliver = deliver
+		self.byte_time = 10 / baud if baud else 0.
+		self.latency = latency
+		self.pending = deque()
+		self.condition = Condition()
+		self.free_at = 0.  # Time at which the line is done transmitting what was already sent
+		self.running = True
+		self.thread = Thread(target=self.run, daemon=True)
+		self.thread.start()
+
+	def send(self, data: bytes):
+		with self.condition:
+			now = time.monotonic()
+			self.free_at = max(now, self.free_at) + len(data) * self.byte_time
+			self.pending.append((self.free_at + self.latency, data))
+			self.condition.notify()
+
+	def run(self):
+		while self.running:
+			with self.condition:
+				self.condition.wait_for(lambda: self.pending or not self.running)
+				if not self.running:
+					break
+				arrival, data = self.pending[0]
+				delay = arrival - time.monotonic()
+				if delay > 0:
+					self.condition.wait(delay)
+					continue
+				self.pending.popleft()
+			self.deliver(data)
+
+	def stop(self):
+		with self.condition:
+			self.running = False
+			self.condition.notify()
+
+
+class PtyTransport:
+	"""
+	Pseudo terminal, the monitor opens the slave side like any serial port (POSIX only)
+	"""
+
+	def __init__(self):
+		import tty
+		self.master, self.slave = os.openpty()
+		tty.setraw(self.slave)
+		self.url = os.ttyname(self.slave)
+
+	def read(self, timeout: float) -> bytes:
+		if not select.select([self.master], [], [], timeout)[0]:
+			return b""
+		try:
+			return os.read(self.master, 256)
+		except OSError:
+			return b""
+
+	def write(self, data: bytes):
+		os.write(self.master, data)
+
+	def close(self):
+		os.close(self.master)
+		os.close(self.slave)
+
+
+class SocketTransport:
+	"""
+	Local TCP server, the monitor connects to it with a socket:// url
+	Works on every platform, the connection can be closed and opened again
+	"""
+
+	def __init__(self, port: int = 0):
+		self.server = socket.create_server(("127.0.0.1", port))
+		self.url = "socket://127.0.0.1:{}".format(self.server.getsockname()[1])
+		self.client = None
+
+	def read(self, timeout: float) -> bytes:
+		if self.client is None:
+			if not select.select([self.server], [], [], timeout)[0]:
+				return b""
+			self.client, _ = self.server.accept()
+			self.client.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+			return b""
+		if not select.select([self.client], [], [], timeout)[0]:
+			return b""
+		try:
+			data = self.client.recv(256)
+		except OSError:
+			data = b""
+		if not data:
+			# The monitor closed the port
+			self.client.close()
+			self.client = None
+		return data
+
+	def write(self, data: bytes):
+		try:
+			if self.client is not None:
+				self.client.sendall(data)
+		except OSError:
+			pass
+
+	def close(self):
+		if self.client is not None:
+			self.client.close()
+		self.server.close()
+
+
+class ArduinoEmulator:
+	"""
+	Emulated Arduino behind a transport, with a throttled and lossy link
+	"""
+
+	READ_TIMEOUT = 0.05  # seconds, how long the transport reader waits for data before checking whether it should stop
+
+	def __init__(self, transport=None, baud: int = 9600, latency: float = 0., loss: float = 0., corruption: float = 0.,
+				 tick_interval: float = 0.005, windowed: bool = True, binary: bool = True, seed: int = None):
+		"""
+		:param transport: PtyTransport or SocketTransport, a SocketTransport is created by default
+		:param baud: Baud rate of the bluetooth module
+		:param latency: seconds, one way latency of the link
+		:param loss: Probability for each chunk of bytes to be lost, in both directions
+		:param corruption: Probability for each chunk of bytes to have one of its bytes altered, in both directions
+		:param tick_interval: seconds, duration of one Arduino loop iteration (BluetoothHandler::Tick is called once per loop)
+		:param windowed: Whether the emulated firmware supports the sequenced packets
+		:param binary: Whether the emulated firmware supports the binary format
+		"""
+		self.transport = transport or SocketTransport()
+		self.loss = loss
+		self.corruption = corruption
+		self.tick_interval = tick_interval
+		self.random = random.Random(seed)
+		self.lock = Lock()
+		self.bluetooth = EmulatedBluetooth(self.respond, windowed, binary)
+		self.inbound = SerialLine(self.receive, baud, latency)
+		self.outbound = SerialLine(self.transport.write, baud, latency)
+		self.overflowed = 0  # Bytes lost because the receive buffer was full
+		self.running = False
+		self.threads = []
+
+	@property
+	def url(self) -> str:
+		return self.transport.url
+
+	@property
+	def city(self) -> EmulatedCityMap:
+		return self.bluetooth.city
+
+	def holds(self, compounds) -> bool:
+		"""
+		:return: Whether the emulated storage holds exactly the given compounds
+		"""
+		with self.lock:
+			return self.city.matches(compounds)
+
+	def restart(self):
+		"""
+		Emulate a restart of the Arduino, it forgets its compounds and its mode
+		"""
+		with self.lock:
+			self.bluetooth.restart()
+
+	def start(self):
+		self.running = True
+		self.threads = [Thread(target=self.read_loop, daemon=True), Thread(target=self.tick_loop, daemon=True)]
+		for thread in self.threads:
+			thread.start()
+
+	def stop(self):
+		self.running = False
+		for thread in self.threads:
+			thread.join(1)
+		self.inbound.stop()
+		self.outbound.stop()
+		self.transport.close()
+
+	def impair(self, data: bytes) -> bytes | None:
+		"""
+		Apply the configured loss and corruption rates to a chunk of bytes
+		:return: The bytes that make it through, None if they are lost
+		"""
+		if self.loss and self.random.random() < self.loss:
+			return None
+		if self.corruption and self.random.random() < self.corruption:
+			data = bytearray(data)
+			data[self.random.randrange(len(data))] ^= 1 << self.random.randrange(8)
+			data = bytes(data)
+		return data
+
+	def read_loop(self):
+		while self.running:
+			data = self.transport.read(self.READ_TIMEOUT)
+			if data:
+				data = self.impair(data)
+				if data is not None:
+					self.inbound.send(data)
+
+	def receive(self, data: bytes):
+		"""
+		Bytes arriving in the software serial buffer
+		"""
+		with self.lock:
+			room = RX_BUFFER_SIZE - len(self.bluetooth.rx)
+			self.bluetooth.rx.extend(data[:room])
+			self.overflowed += max(0, len(data) - room)
+
+	def respond(self, data: bytes):
+		data = self.impair(data)
+		if data is not None:
+			self.outbound.send(data)
+
+	def tick_loop(self):
+		while self.running:
+			with self.lock:
+				self.bluetooth.tick()
+			time.sleep(self.tick_interval)
@@ -0,0 +1,162 @@
+import os
+import time
+from concurrent.futures import ThreadPoolExecutor
+from threading import Lock
+from typing import NamedTuple
+
+import cv2
+import numpy as np
+
+from marker_detector import MarkerDetector
+from storage_zone import StorageZone
+
+# Areas of the table delimited by Aruco markers and watched by the same camera, such as the storage and build zones
+# The markers are detected at most once per frame, for every area that has to be located again, then the areas
+# are warped and analysed concurrently : OpenCV releases the GIL, an area only adds its own warp and analysis
+
+
+class ArucoArea:
+	"""
+	Zone warped out of the frames, and the analysis run on it
+	"""
+
+	# seconds, how long an optional area that wasn't found waits before running a marker detection of its own
+	# It is still located whenever the markers are detected for another area
+	RETRY_INTERVAL = 1.
+
+	def __init__(self, name: str, zone: StorageZone, analyse, context, optional: bool = False):
+		"""
+		:param zone: Markers delimiting the area
+		:param analyse: Called with the warped area, the buffers to work with and the list to append the
+		(stage, seconds) of each stage to, returns the outcome of the area
+		:param context: Buffers of the analysis (camera_utils.PipelineContext), each area has its own
+		:param optional: Whether the area may be missing from the frames, then it isn't looked for on every frame
+		"""
+		self.name = name
+		self.zone = zone
+		self.analyse = analyse
+		self.context = context
+		self.optional = optional
+		# time.monotonic() at which the area was last looked for in vain
+		self.missed_at = -self.RETRY_INTERVAL
+
+	def found(self) -> bool:
+		return self.zone.transform is not None
+
+	def due(self, now: float) -> bool:
+		"""
+		:return: Whether the markers have to be detected for this area, once its cached transform doesn't hold
+		"""
+		return not self.optional or self.found() or now - self.missed_at >= self.RETRY_INTERVAL
+
+
+class AreaResult(NamedTuple):
+	"""
+	Outcome of one area for one frame
+	"""
+	image: np.ndarray  # Warped area, with the annotations of the analysis, see AreaRegistry.process
+	outcome: object  # Returned by the analysis
+	timings: tuple  # (stage, seconds) of the warp and of each stage of the analysis
+
+
+class AreaRegistry:
+	"""
+	Areas of the frames of a camera, located from a shared marker detection
+	"""
+
+	# Threads analysing the areas, shared by every registry of the process
+	executor: ThreadPoolExecutor = None
+	executor_lock = Lock()
+
+	def __init__(self, detector: MarkerDetector):
+		"""
+		:param detector: Detector of the markers of every area
+		"""
+		self.detector = detector
+		# Name => ArucoArea, in registration order, the first one being analysed on the calling thread
+		self.areas: dict[str, ArucoArea] = {}
+		# Grey conversion of the frame, reused by every detection
+		self.grey = None
+		# Invalidation requests taken into account, see camera_utils.Calibration.invalidate_storage_zone
+		self.generation = 0
+		# Number of marker detections run, for all the areas at once
+		self.detections = 0
+
+	def add(self, area: ArucoArea) -> ArucoArea:
+		if area.name in self.areas:
+			raise ValueError("Area {} is registered twice".format(area.name))
+		self.areas[area.name] = area
+		return area
+
+	def remove(self, name: str):
+		self.areas.pop(name, None)
+
+	def get(self, name: str) -> ArucoArea | None:
+		return self.areas.get(name, None)
+
+	def invalidate(self):
+		"""
+		Detect the markers of every area again on the next frame
+		"""
+		for area in self.areas.values():
+			area.zone.invalidate()
+			area.missed_at = -ArucoArea.RETRY_INTERVAL
+
+	def locate(self, image: np.ndarray):
+		"""
+		Locate every area in a frame, the areas whose cached transform still holds aren't looked for
+		Markers are detected once for all the other ones
+		"""
+		now = time.monotonic()
+		stale = [area for area in self.areas.values() if not area.zone.reuse(image)]
+		if not any(area.due(now) for area in stale):
+			return
+		self.grey = cv2.cvtColor(image, cv2.COLOR_BGR2GRAY, dst=self.grey)
+		(_corners, _ids) = self.detector.detect(self.grey)
+		self.detections += 1
+		for area in stale:
+			if not area.zone.locate(_corners, _ids, self.grey):
+				area.missed_at = now
+
+	def process(self, image: np.ndarray, buffers: dict = None) -> dict[str, AreaResult]:
+		"""
+		Warp and analyse every area found by the last call to locate, concurrently
+		:param image: Frame the areas were located in, it is only read
+		:param buffers: Area name => (context, output) to use instead of the buffers of the area
+		:return: Area name => AreaResult, for the areas that were found
+		The image of an area without an output of its own is overwritten on the next frame, it must not be kept
+		"""
+		buffers = buffers or {}
+		found = [area for area in self.areas.values() if area.found()]
+		if not found:
+			return {}
+		jobs = [
+			(area, self.shared_executor().submit(self.run, area, image, *buffers.get(area.name, (None, None))))
+			for area in found[1:]
+		]
+		results = {found[0].name: self.run(found[0], image, *buffers.get(found[0].name, (None, None)))}
+		for area, job in jobs:
+			results[area.name] = job.result()
+		return results
+
+	@staticmethod
+	def run(area: ArucoArea, image: np.ndarray, context=None, output: np.ndarray = None) -> AreaResult:
+		if context is None:
+			context = area.context
+		if output is None:
+			output = context.warp_buffer(area.zone.shape())
+		start = time.perf_counter()
+		warped = area.zone.warp(image, output)
+		timings = [("warp", time.perf_counter() - start)]
+		outcome = area.analyse(warped, context, timings)
+		return AreaResult(warped, outcome, tuple(timings))
+
+	@classmethod
+	def shared_executor(cls) -> ThreadPoolExecutor:
+		"""
+		:return: The threads analysing the areas, started on first use
+		"""
+		with cls.executor_lock:
+			if cls.executor is None:
+				cls.executor = ThreadPoolExecutor(os.cpu_count(), thread_name_prefix="ArucoArea")
+			return cls.executor
@@ -0,0 +1,322 @@
+import asyncio
+import concurrent.futures
+
+from async_serial import LinkLoop, open_stream
+from bluetooth_handler import *
+
+# Same link as BluetoothHandler, driven by coroutines on a shared event loop instead of a thread of its own :
+# a reader coroutine parses the acknowledgments and answers as they come while a writer coroutine sends the
+# queued packets, so that writes never wait behind reads, and the loop sleeps until there is something to do
+# The send_* methods are still called from the Tk and vision threads, the outbound queue wakes the writer up
+
+
+class WakingOutboundQueue(OutboundQueue):
+	"""
+	Outbound queue that also sets an asyncio event whenever an item is queued, from any thread
+	"""
+
+	def __init__(self, link_loop: LinkLoop, event: asyncio.Event):
+		super().__init__()
+		self.link_loop = link_loop
+		self.event = event
+
+	def put(self, item, priority: Priority, key: str = None):
+		super().put(item, priority, key)
+		self.link_loop.call(self.event.set)
+
+	def push_front(self, items: list, priority: Priority):
+		super().push_front(items, priority)
+		self.link_loop.call(self.event.set)
+
+	def wake(self):
+		super().wake()
+		self.link_loop.call(self.event.set)
+
+
+class AsyncBluetoothHandler(BluetoothHandler):
+	"""
+	Takes care of handling the bluetooth connection, on the event loop shared by every link
+	"""
+
+	# Loop running this link
+	link_loop: LinkLoop = None
+	# concurrent.futures.Future of the coroutine running this link
+	task = None
+	# Set when the writer has something to do : packets queued, acknowledgments received, or the reader stopped
+	wakeup: asyncio.Event = None
+	# Streams of the current connection, and the reader coroutine
+	reader: asyncio.StreamReader = None
+	writer = None
+	reader_task: asyncio.Task = None
+	# Resolved with the next frame that isn't a sequenced acknowledgment, while waiting for an answer
+	answer: asyncio.Future = None
+	# time.monotonic() of the last bytes received
+	last_received = 0.
+
+	def init(self):
+		super().init()
+		self.link_loop = LinkLoop.shared()
+		self.wakeup = asyncio.Event()
+		self.outbound = WakingOutboundQueue(self.link_loop, self.wakeup)
+		self.reader = self.writer = self.reader_task = self.answer = None
+
+	def start(self):
+		self.running = True
+		self.task = self.link_loop.submit(self.run())
+		self.task.add_done_callback(self.run_done)
+
+	def run_done(self, task: concurrent.futures.Future):
+		"""
+		Report an error that stopped the link, nothing else waits on the task while the handler runs
+		"""
+		if not task.cancelled() and task.exception() is not None:
+			print("[Bluetooth] Link stopped by an unexpected error : {!r}".format(task.exception()))
+			self.online = False
+			self.link_loop.call(self.close_stream)
+
+	def update(self):
+		"""
+		Wait until the link stops, it runs on the shared loop rather than in this thread
+		"""
+		self.task.result()
+
+	def stop(self):
+		self.running = False
+		self.outbound.wake()
+		try:
+			self.task.result(1)
+		except concurrent.futures.TimeoutError:
+			self.task.cancel()
+		except Exception:
+			pass  # Already reported by run_done
+		self.stop_actions()
+
+	async def run(self):
+		while self.running:
+			# Try reconnecting if the connection broke
+			if not self.online:
+				if not await self.reconnect_async():
+					await self.wait(max(self.UPDATE_DELAY / 1000, self.next_attempt - time.monotonic()))
+				continue
+
+			try:
+				await self.transmit()
+				if self.reader_task.done():
+					self.reader_task.result()  # Raises the error that stopped the reader
+			except (serial.serialutil.SerialException, OSError, asyncio.TimeoutError) as e:
+				print("[Bluetooth] TIMED OUT ({})".format(str(e) or type(e).__name__))
+				self.disconnect()
+		self.close_stream()
+
+	async def wait(self, timeout: float):
+		"""
+		Sleep until the writer is woken up, or until the timeout expires
+		"""
+		try:
+			await asyncio.wait_for(self.wakeup.wait(), max(0., timeout))
+		except asyncio.TimeoutError:
+			pass
+		self.wakeup.clear()
+
+	async def transmit(self):
+		"""
+		Writer coroutine, sends packets until the connection breaks or the handler stops
+		"""
+		while self.running and self.online and not self.reader_task.done():
+			if self.idle_time() > self.keepalive_interval() and not self.window.in_flight:
+				# Nothing was acknowledged for a while, send a presence packet to the Arduino
+				self.outbound.put(OutgoingPacket(ACK_VALID), Priority.PRESENCE, key="presence")
+				self.last_probe = time.monotonic()
+
+			if self.sequenced:
+				self.fill_window()
+				self.retransmit()
+				await self.flush()
+			else:
+				await self.transmit_stop_and_wait_async()
+
+			await self.wait(self.next_deadline())
+
+	def next_deadline(self) -> float:
+		"""
+		:return: seconds until a retransmission, the liveness check or a presence check is due
+		"""
+		now = time.monotonic()
+		if self.window.in_flight:
+			oldest = min(entry.sent_at for entry in self.window.in_flight.values())
+			return min(oldest + self.window.rto(), self.waiting_since + self.dead_timeout()) - now
+		if not self.sequenced and (len(self.outbound) or self.storage_ops):
+			return 0.  # Packets rejected in stop-and-wait mode, after the UPDATE_DELAY pause
+		return self.keepalive_interval() - self.idle_time()
+
+	async def transmit_stop_and_wait_async(self):
+		"""
+		Send each packet and wait for its acknowledgment before sending the next one
+		"""
+		failures = []
+		while self.online:
+			batch = self.next_batch()
+			if not batch:
+				break
+			pk = batch[0]
+			self.before_send(batch)
+			sent_at = time.monotonic()
+			try:
+				processed = await self.get_ack_async(bytes(pk.buffer, 'utf-8'))
+			except (serial.serialutil.SerialException, OSError, asyncio.TimeoutError):
+				# Sent again once reconnected
+				self.put_back_failures(failures + [pk])
+				raise
+			if not processed:
+				# If the Arduino doesn't respond with a positive ack, skip this packet for now
+				print("[Bluetooth] Failed to transmit packet {}".format(pk.buffer))
+				self.retransmits.inc()
+				failures.append(pk)
+			else:
+				self.acknowledged()
+				self.window.measure_rtt(time.monotonic() - sent_at)
+				self.packet_acknowledged(pk)
+
+		if failures:
+			self.put_back_failures(failures)
+			await asyncio.sleep(self.UPDATE_DELAY / 1000)
+
+	async def receive(self):
+		"""
+		Reader coroutine, parses the frames as they are received until the connection breaks
+		"""
+		try:
+			while True:
+				data = await self.reader.read(256)
+				if not data:
+					raise ConnectionResetError("Connection closed by the module")
+				self.last_received = time.monotonic()
+				for frame in self.parser.feed(data):
+					if self.answer is not None and not self.answer.done() and frame.pid != CMD_SEQ_ACK:
+						self.answer.set_result(frame)
+					elif self.sequenced:
+						self.on_frame(frame)
+				self.wakeup.set()
+		except Exception as e:
+			if self.answer is not None and not self.answer.done():
+				self.answer.set_exception(e)
+			self.wakeup.set()
+			raise
+
+	def write(self, data: bytes):
+		"""
+		Buffer a frame, written by the next flush
+		"""
+		self.writer.write(data)
+		self.sent_frames.inc()
+
+	async def flush(self):
+		"""
+		Wait until the buffered frames are written
+		"""
+		with self.write_seconds.time():
+			await asyncio.wait_for(self.writer.drain(), self.WRITE_TIMEOUT)
+
+	async def request(self, data: bytes, timeout: float) -> Frame | None:
+		"""
+		Write a packet and wait for the answer of the Arduino
+		:return: The first frame received that isn't a sequenced acknowledgment, or None if nothing came in time
+		"""
+		self.answer = asyncio.get_running_loop().create_future()
+		try:
+			self.write(data)
+			await self.flush()
+			done, _ = await asyncio.wait((self.answer,), timeout=timeout)
+			return self.answer.result() if done else None
+		finally:
+			self.answer = None
+
+	async def get_ack_async(self, data: bytes) -> bool:
+		"""
+		Write a packet and wait for its acknowledgment
+		:return: Whether the Arduino processed the packet
+		"""
+		sent_at = time.monotonic()
+		frame = await self.request(data, self.dead_timeout())
+		if frame is None:
+			if self.last_received > sent_at:
+				return False  # Garbled answer
+			raise serial.serialutil.SerialTimeoutException("No acknowledgment for {:.2f}s".format(self.dead_timeout()))
+		return frame.valid and frame.pid == CMD_ACK and int(frame.body or "0", base=16) != 0
+
+	async def reconnect_async(self) -> bool:
+		"""
+		Try to establish the bluetooth connection with the Arduino module
+		"""
+		# Scanning the ports blocks, the loop keeps driving the other links in the meantime
+		ports = await asyncio.get_running_loop().run_in_executor(None, self.candidate_ports)
+		for port in ports or []:
+			if await self.connect_async(port):
+				self.connected(port)
+				return True
+		if ports is not None:
+			self.connection_failed()
+		return False
+
+	async def connect_async(self, port: str) -> bool:
+		"""
+		Open a port, negotiate the protocol and resume the session
+		"""
+		try:
+			self.reader, self.writer = await asyncio.wait_for(open_stream(port, 9600, self.WRITE_TIMEOUT), self.CONNECT_TIMEOUT)
+			self.sequenced = False
+			self.parser = AsciiCodec.parser()
+			self.reader_task = asyncio.create_task(self.receive())
+			state = await self.query_state_async()
+			await self.negotiate_async()
+			self.resume(state)
+			self.online = True
+		except (serial.serialutil.SerialException, OSError, asyncio.TimeoutError):
+			print("[Bluetooth] Unable to reach the bluetooth module on {}".format(port))
+			self.online = False
+			self.close_stream()
+			return False
+		self.acknowledged()
+		print("[Bluetooth] Successfully connected to the module on {}".format(port))
+		return True
+
+	async def query_state_async(self) -> ArduinoState | None:
+		"""
+		Ask the Arduino what it still holds
+		:return: Its state, or None if its firmware doesn't support the query or it didn't answer in time
+		"""
+		frame = await self.request(bytes(ascii_packet("{:x}".format(CMD_STATE)), 'utf-8'), self.dead_timeout())
+		if frame is not None and frame.valid and frame.pid == CMD_STATE:
+			return ArduinoState.parse(frame.body)
+		return None  # Rejected by an older firmware
+
+	async def negotiate_async(self):
+		"""
+		Try to switch the connection to the windowed protocol, in the preferred wire format if possible
+		"""
+		self.codec = AsciiCodec
+		self.window.reset()
+		if self.WINDOWED:
+			if self.PREFERRED_FORMAT != FORMAT_ASCII:
+				if await self.get_ack_async(bytes(ascii_packet("{:x}{:x}".format(CMD_NEGOTIATE, self.PREFERRED_FORMAT)), 'utf-8')):
+					self.codec = CODECS[self.PREFERRED_FORMAT]
+					self.parser = self.codec.parser()
+					self.sequenced = True
+			if not self.sequenced:
+				self.sequenced = await self.get_ack_async(bytes(ascii_packet("{:x}".format(CMD_SEQ_RESET)), 'utf-8'))
+		print("[Bluetooth] Using the {} protocol{}".format(
+			"windowed" if self.sequenced else "stop-and-wait",
+			" in binary format" if self.codec is BinaryCodec else ""
+		))
+
+	def disconnect(self):
+		super().disconnect()
+		self.close_stream()
+
+	def close_stream(self):
+		if self.reader_task is not None:
+			self.reader_task.cancel()
+			self.reader_task = None
+		if self.writer is not None:
+			self.writer.close()
+			self.writer = None
@@ -0,0 +1,119 @@
+import asyncio
+from concurrent.futures import ThreadPoolExecutor
+from threading import Lock, Thread
+from urllib.parse import urlsplit
+
+import serial
+
+# Asyncio streams over the bluetooth serial port, used by AsyncBluetoothHandler
+# pyserial-asyncio (pip install pyserial-asyncio) is optional : without it, serial ports are read by a thread
+# that hands the received bytes to the event loop, and written by another one
+try:
+	import serial_asyncio
+except ImportError:
+	serial_asyncio = None
+
+
+class LinkLoop:
+	"""
+	Event loop running in a thread of its own, every asynchronous link can be driven by the same one
+	"""
+
+	shared_loop: "LinkLoop" = None
+	shared_lock = Lock()
+
+	def __init__(self):
+		self.loop = asyncio.new_event_loop()
+		self.thread = Thread(target=self.loop.run_forever, name="LinkLoop", daemon=True)
+		self.thread.start()
+
+	@classmethod
+	def shared(cls) -> "LinkLoop":
+		"""
+		:return: The loop shared by every link, started on first use
+		"""
+		with cls.shared_lock:
+			if cls.shared_loop is None:
+				cls.shared_loop = LinkLoop()
+			return cls.shared_loop
+
+	def submit(self, coroutine):
+		"""
+		Run a coroutine on this loop, from any thread
+		:return: A concurrent.futures.Future of its result
+		"""
+		return asyncio.run_coroutine_threadsafe(coroutine, self.loop)
+
+	def call(self, callback, *args):
+		"""
+		Call a function on this loop, from any thread
+		"""
+		self.loop.call_soon_threadsafe(callback, *args)
+
+
+class SerialStream:
+	"""
+	Serial port read by a thread and written by another one, for when pyserial-asyncio isn't installed
+	Offers the write side of an asyncio.StreamWriter, the received bytes are fed to an asyncio.StreamReader
+	"""
+
+	READ_TIMEOUT = 0.1  # seconds, how often the reading thread checks whether the port was closed
+
+	def __init__(self, port: serial.Serial, loop: asyncio.AbstractEventLoop):
+		"""
+		:param port: Open port, with a READ_TIMEOUT timeout
+		:param loop: Loop the streams are used from
+		"""
+		self.loop = loop
+		self.port = port
+		self.reader = asyncio.StreamReader()
+		self.pending = bytearray()
+		self.writer = ThreadPoolExecutor(1, thread_name_prefix="SerialWriter")
+		self.closed = False
+		Thread(target=self.read_port, name="SerialReader", daemon=True).start()
+
+	def read_port(self):
+		try:
+			while not self.closed:
+				data = self.port.read(max(1, self.port.in_waiting))
+				if data:
+					self.loop.call_soon_threadsafe(self.reader.feed_data, data)
+		except Exception as e:  # pyserial raises various errors when the port is closed during a read
+			if not self.closed:
+				self.loop.call_soon_threadsafe(self.reader.set_exception, ConnectionResetError(str(e)))
+				return
+		self.loop.call_soon_threadsafe(self.reader.feed_eof)
+
+	def write(self, data: bytes):
+		self.pending += data
+
+	async def drain(self):
+		if self.pending:
+			data = bytes(self.pending)
+			self.pending.clear()
+			await self.loop.run_in_executor(self.writer, self.port.write, data)
+
+	def close(self):
+		self.closed = True
+		self.writer.shutdown(wait=False)
+		self.port.close()
+
+
+async def open_stream(url: str, baudrate: int, write_timeout: float):
+	"""
+	Open a serial port, or a pyserial socket:// url, as a pair of asyncio streams
+	:param write_timeout: seconds, only used without pyserial-asyncio (writes never block the loop with it)
+	:return: The reader (asyncio.StreamReader) and the writer (write, drain and close like an asyncio.StreamWriter)
+	"""
+	if url.startswith("socket://"):
+		address = urlsplit(url)
+		return await asyncio.open_connection(address.hostname, address.port)
+	if serial_asyncio is not None:
+		return await serial_asyncio.open_serial_connection(url=url, baudrate=baudrate)
+	# Opening a bluetooth port can take a while, the loop keeps driving the other links in the meantime
+	loop = asyncio.get_running_loop()
+	port = await loop.run_in_executor(None, lambda: serial.serial_for_url(
+		url, baudrate, timeout=SerialStream.READ_TIMEOUT, write_timeout=write_timeout
+	))
+	stream = SerialStream(port, loop)
+	return stream.reader, stream
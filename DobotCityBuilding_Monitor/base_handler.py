@@ -1,10 +1,8 @@
 import enum
-import os.path
-from tkinter import *
 from abc import ABC, abstractmethod
 from threading import Thread
 
-import cv2
+from cells import Cell, default_cell
 
 
 class HandlerId(enum.IntEnum):
@@ -12,24 +10,31 @@ class HandlerId(enum.IntEnum):
 	CALIBRATION = 1
 	BLUETOOTH = 2
 	MONITOR = 3
+	VISION = 4
+	CONTROL = 5
+	METRICS = 6
 
 
 class BaseHandler(ABC):
 	"""
 	Base class for any handler in this program
 	It contains basic methods such as init, update and stop
+	Each handler belongs to a cell, through which the other handlers of the cell are reached
 	"""
 
-	# Static variable that contains the instances of each type of handler
-	handlers: dict = {}
-
+	# Cell this handler belongs to
+	cell: Cell = None
 	# Class variable that determines whether the thread should keep running
 	running = False
 	# Thread currently running this handler's update method
 	thread = None
 
-	def __init__(self, hid: int):
-		BaseHandler.handlers[hid] = self
+	def __init__(self, hid: int, cell: Cell = None):
+		"""
+		:param cell: Cell to register this handler in, the default cell if None
+		"""
+		self.cell = cell if cell is not None else default_cell()
+		self.cell.handlers[hid] = self
 		self.hid = hid
 		self.init()
 
@@ -74,75 +79,3 @@ class BaseHandler(ABC):
 		if self.running:
 			self.running = False
 			self.stop_actions()
-
-
-class TkinterBaseHandler(BaseHandler, ABC):
-	"""
-	Extension of the BaseHandler class so that it adapts to the way
-	tkinter windows work
-	"""
-	window: Tk
-
-	def start(self):
-		self.running = True
-		self.update()
-
-	def stop(self):
-		self.running = False
-		self.stop_actions()
-
-	def stop_actions(self):
-		self.window.destroy()
-
-
-class FrameHoldingBaseHandler(TkinterBaseHandler, ABC):
-	"""
-	Extension to the TkinterBaseHandler class to take care of redondant stuff
-	regarding the display of the camera feed
-	"""
-
-	@staticmethod
-	def get_camera_feed():
-		"""
-		Fetch the most recent camera capture from the camera feed thread
-		"""
-		feed_handler = BaseHandler.handlers.get(HandlerId.CAMERA_FEED, None)
-		if feed_handler is not None:
-			return feed_handler.success, feed_handler.feed
-		return False, None
-
-	REFRESH_DELAY = 100  # ms, how often should we refresh the camera feed
-
-	img_frame: Frame
-	img_label: Label
-	window: Tk
-
-	window_bg = "#292929"
-
-	def init(self):
-		"""
-		Instantiate the tkinter window as well as the frame shown on screen
-		that contains the camera feed
-		"""
-		self.window = Tk()
-		self.window.geometry("500x500")
-		self.window.attributes('-fullscreen', True)
-		self.window.configure(bg=self.window_bg)
-		sw, sh = self.window.winfo_screenwidth(), self.window.winfo_screenheight()
-
-		self.img_frame = Frame(self.window, width=0.9 * sw, height=0.9 * sh)
-		self.img_frame.pack()
-		self.img_frame.place(relx=0.5, y=10, anchor='n')
-
-		self.img_label = Label(self.img_frame)
-		self.img_label.pack()
-
-	def save_result(self, result):
-		"""
-		Save the result as out/out.png file
-		Also updates the camera feed shown on screen to display this new result instead
-		"""
-		cv2.imwrite("out/out.png", result)
-		if os.path.exists("out/out.png"):
-			self.img_label.photo = PhotoImage(file="out/out.png")
-			self.img_label.config(image=self.img_label.photo)
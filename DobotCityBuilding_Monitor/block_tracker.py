@@ -0,0 +1,131 @@
+import math
+from collections import Counter, deque
+
+
+def rotation_delta(a: float, b: float) -> float:
+	"""
+	Signed difference b - a between two block rotations, blocks being symmetrical every 90 degrees
+	:return: The difference, between -45 and 45 degrees
+	"""
+	return (b - a + 45) % 90 - 45
+
+
+class Track:
+	"""
+	A block followed across frames
+	"""
+
+	def __init__(self, detection, vote_frames: int):
+		self.x, self.y = float(detection[0]), float(detection[1])
+		self.rot = float(detection[2]) % 90
+		self.votes = deque([int(detection[3])], maxlen=vote_frames)
+		self.hits = 1  # Consecutive frames the block was detected in
+		self.misses = 0  # Consecutive frames the block wasn't detected in
+		self.confirmed = False
+		self.reported = None  # Last values reported as a change
+
+	def type(self) -> int:
+		"""
+		:return: Most voted type over the last frames, the most recent vote wins ties
+		"""
+		counts = Counter(self.votes)
+		best = max(counts.values())
+		return next(t for t in reversed(self.votes) if counts[t] == best)
+
+	def values(self) -> list:
+		return [self.x, self.y, self.rot, self.type()]
+
+	def observe(self, detection, alpha: float):
+		"""
+		Blend a new detection in the smoothed values
+		"""
+		self.x += alpha * (float(detection[0]) - self.x)
+		self.y += alpha * (float(detection[1]) - self.y)
+		self.rot = (self.rot + alpha * rotation_delta(self.rot, float(detection[2]) % 90)) % 90
+		self.votes.append(int(detection[3]))
+		self.hits += 1
+		self.misses = 0
+
+
+class BlockTracker:
+	"""
+	Filters the compounds detected in successive frames :
+	detections are associated with the blocks seen in the previous frames, their position and rotation are smoothed,
+	their type is voted, and blocks only appear or disappear once they were stable for a few frames
+	"""
+
+	MATCH_DISTANCE = 12  # mm, a detection this close to a tracked block is the same block
+	SMOOTHING = 0.3  # Weight of a new detection in the smoothed position and rotation
+	CONFIRM_FRAMES = 3  # Consecutive frames a block must be detected in before it is reported
+	DROP_FRAMES = 5  # Consecutive frames a block must be missing from before it is reported as removed
+	VOTE_FRAMES = 10  # Frames over which the type of a block is voted
+	MOVE_TOLERANCE = 1.5  # mm, smaller moves of a reported block are not reported
+	ROT_TOLERANCE = 2  # degrees, smaller rotations of a reported block are not reported
+
+	def __init__(self):
+		self.tracks: list[Track] = []
+
+	def reset(self):
+		self.tracks.clear()
+
+	def update(self, detections) -> bool:
+		"""
+		Process the compounds detected in a new frame
+		:param detections: Detected compounds, as [x, y, rot, type] lists
+		:return: Whether the confirmed blocks changed enough to be sent again
+		"""
+		# Greedily associate each detection with the closest tracked block
+		pairs = []
+		for ti, track in enumerate(self.tracks):
+			for di, data in enumerate(detections):
+				dist = math.hypot(float(data[0]) - track.x, float(data[1]) - track.y)
+				if dist < self.MATCH_DISTANCE:
+					pairs.append((dist, ti, di))
+		pairs.sort()
+
+		matched_tracks, matched_detections = set(), set()
+		for dist, ti, di in pairs:
+			if ti not in matched_tracks and di not in matched_detections:
+				self.tracks[ti].observe(detections[di], self.SMOOTHING)
+				matched_tracks.add(ti)
+				matched_detections.add(di)
+
+		changed = False
+		kept = []
+		for ti, track in enumerate(self.tracks):
+			if ti not in matched_tracks:
+				track.hits = 0
+				track.misses += 1
+				if track.misses >= (self.DROP_FRAMES if track.confirmed else 1):
+					changed |= track.confirmed
+					continue
+			kept.append(track)
+		self.tracks = kept
+
+		for di, data in enumerate(detections):
+			if di not in matched_detections:
+				self.tracks.append(Track(data, self.VOTE_FRAMES))
+
+		for track in self.tracks:
+			if not track.confirmed and track.hits >= self.CONFIRM_FRAMES:
+				track.confirmed = True
+			if track.confirmed and self.has_changed(track):
+				track.reported = track.values()
+				changed = True
+		return changed
+
+	def has_changed(self, track: Track) -> bool:
+		if track.reported is None:
+			return True
+		x, y, rot, t = track.reported
+		return (
+			t != track.type()
+			or math.hypot(track.x - x, track.y - y) > self.MOVE_TOLERANCE
+			or abs(rotation_delta(rot, track.rot)) > self.ROT_TOLERANCE
+		)
+
+	def blocks(self) -> list[list]:
+		"""
+		:return: The confirmed blocks, as [x, y, rot, type] lists
+		"""
+		return [track.values() for track in self.tracks if track.confirmed]
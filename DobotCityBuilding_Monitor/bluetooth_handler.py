@@ -1,10 +1,13 @@
 import time
-from ctypes import Union
 
 import serial
 from serial.tools import list_ports
 
+import metrics
 from base_handler import *
+from link_protocol import *
+from outbound_queue import OutboundQueue, Priority
+from storage_sync import StorageSync
 
 
 class BluetoothHandler(BaseHandler):
@@ -12,127 +15,539 @@ class BluetoothHandler(BaseHandler):
 	Takes care of handling the bluetooth connection
 	"""
 
-	UPDATE_DELAY = 100  # ms, how often should we send newly added packets
-	CONN_CHECK_INTERVAL = 3  # seconds, how often do we send a presence check packet
+	UPDATE_DELAY = 100  # ms, how long to wait before retrying packets that were rejected
+	ACK_POLL_TIMEOUT = 0.02  # seconds, how long to wait for acknowledgments while packets are in flight
+	CONNECT_TIMEOUT = 1.  # seconds, how long to wait for an answer until the round trip time was measured
+	WRITE_TIMEOUT = 0.5  # seconds
+
+	# Liveness, derived from the measured round trip time :
+	# the link is considered dead once a packet went unacknowledged for LIVENESS_RTOS retransmission timeouts,
+	# and a presence check is sent after KEEPALIVE_RTTS round trips without any acknowledgment
+	LIVENESS_RTOS = 3
+	MIN_DEAD_TIMEOUT = 0.3  # seconds
+	MAX_DEAD_TIMEOUT = 3.  # seconds
+	KEEPALIVE_RTTS = 10
+	MIN_KEEPALIVE = 0.25  # seconds
+	MAX_KEEPALIVE = 2.  # seconds, well under the 5 seconds of silence after which the Arduino stops
+	# Reconnection : the port the module was last reached on is tried first, and again after every failure
+	# with an exponential backoff, the other ports are only scanned with a slower backoff
+	RETRY_DELAY = 0.1  # seconds
+	MAX_RETRY_DELAY = 2.  # seconds
+	SCAN_DELAY = 0.5  # seconds
+	MAX_SCAN_DELAY = 10.  # seconds
+
+	# Protocol mode : if enabled, packets are sequenced and several of them can be in flight at once
+	# Falls back to one packet per round trip if the Arduino doesn't support it
+	WINDOWED = True
+	# Wire format to negotiate in windowed mode, ASCII is used if the Arduino doesn't support it
+	PREFERRED_FORMAT = FORMAT_BINARY
+	WINDOW_SIZE = 4  # Packets in flight
+	WINDOW_BYTES = 64  # Bytes in flight (size of the Arduino's software serial buffer)
 
 	# Mac Address of the HC-06 Module
 	mac_addr = "98D351FE0B8C"
-	# Local COM Port
+	# Local COM Port the module was last reached on
 	com_port = None
+	# Serial port or pyserial url to connect to instead of looking for the module (for instance an ArduinoEmulator's url)
+	port_url = None
 	# Bluetooth Serial Instance
 	bluetooth_serial: serial.Serial = None
-	# Packets to be sent
-	outgoing_pks = []
+	# Packets and compounds waiting to be sent
+	outbound: OutboundQueue
+	# Storage operations computed from the last compounds taken from the outbound queue, waiting to be sent
+	storage_ops: list[OutgoingPacket] = []
+	# Last compounds taken from the outbound queue
+	last_compounds = []
+	# Compounds known by the Arduino
+	storage: StorageSync
 	# Received buffer
 	incoming_pk = ""
 	# Current connection status
 	online = False
-	# Are we using the outgoing_pks list
-	using = False
-	# Last time we checked the bluetooth connection
-	last_check = 0
+	# Whether the windowed protocol is being used on the current connection
+	sequenced = False
+	# Sending side of the windowed protocol
+	window: SenderWindow
+	# Whether the Arduino reported a corrupted packet, the oldest packet in flight is then sent again right away
+	fast_retransmit = False
+	# Wire format used in windowed mode, and the parser for the frames received in this format
+	codec = AsciiCodec
+	parser: FrameParser | BinaryFrameParser
+	# time.monotonic() of the last acknowledgment, of the last presence check,
+	# and since when packets have been waiting for an acknowledgment in windowed mode
+	last_ack = 0.
+	last_probe = 0.
+	waiting_since = 0.
+	# Next connection attempt on the cached port and its backoff, next scan of the ports and its backoff
+	next_attempt = 0.
+	retry_delay = RETRY_DELAY
+	next_scan = 0.
+	scan_delay = SCAN_DELAY
+	# Boot id reported by the Arduino when the storage was last synchronized, None if unknown
+	boot_id = None
+	# Last mode sent, sent again if the Arduino restarted
+	mode = 0
+	# Time spent encoding the storage operations, framing the packets in the wire format,
+	# writing them to the serial port, and waiting for their acknowledgment
+	encode_seconds: metrics.Histogram
+	frame_seconds: metrics.Histogram
+	write_seconds: metrics.Histogram
+	ack_seconds: metrics.Histogram
+	sent_frames: metrics.Counter
+	retransmits: metrics.Counter
+	disconnections: metrics.Counter
 
 	def init(self):
-		pass
+		self.outbound = OutboundQueue()
+		self.storage_ops = []
+		self.last_compounds = []
+		self.storage = StorageSync()
+		self.window = SenderWindow(self.WINDOW_SIZE, self.WINDOW_BYTES)
+		self.next_attempt = self.next_scan = 0.
+		self.retry_delay, self.scan_delay = self.RETRY_DELAY, self.SCAN_DELAY
+		self.boot_id = None
+		self.mode = 0
+		self.parser = self.codec.parser()
+		self.fast_retransmit = False
+		# Each cell has its own module
+		if self.cell.port is not None:
+			self.port_url = self.cell.port
+		if self.cell.mac_addr is not None:
+			self.mac_addr = self.cell.mac_addr
+		cell_id = self.cell.cell_id
+		self.encode_seconds = metrics.histogram("link_stage_seconds", "Time spent in each stage of a transmission", stage="encode", cell=cell_id)
+		self.frame_seconds = metrics.histogram("link_stage_seconds", stage="frame", cell=cell_id)
+		self.write_seconds = metrics.histogram("link_stage_seconds", stage="write", cell=cell_id)
+		self.ack_seconds = metrics.histogram("link_stage_seconds", stage="ack", cell=cell_id)
+		self.sent_frames = metrics.counter("link_frames_total", "Frames written to the serial port, retransmissions included", cell=cell_id)
+		self.retransmits = metrics.counter("link_retransmits_total", "Frames written again because they weren't acknowledged", cell=cell_id)
+		self.disconnections = metrics.counter("link_disconnections_total", "Connections lost", cell=cell_id)
+		self.window.on_rtt = self.ack_seconds.observe
+		metrics.gauge("link_queue_depth", "Items waiting in the outbound queue", lambda: len(self.outbound), cell=cell_id)
+		metrics.gauge("link_in_flight", "Frames waiting for their acknowledgment", lambda: len(self.window.in_flight), cell=cell_id)
 
 	def update(self):
 		while self.running:
 			# Try reconnecting if the connection broke
-			if self.running and not self.online:
+			if not self.online:
 				self.reconnect()
+				time.sleep(self.UPDATE_DELAY / 1000)
+				continue
+
+			if self.idle_time() > self.keepalive_interval() and not self.window.in_flight:
+				# Nothing was acknowledged for a while, send a presence packet to the Arduino
+				self.outbound.put(OutgoingPacket(ACK_VALID), Priority.PRESENCE, key="presence")
+				self.last_probe = time.monotonic()
+
+			try:
+				if self.sequenced:
+					self.transmit_windowed()
+				else:
+					self.transmit_stop_and_wait()
+			except serial.serialutil.SerialException:
+				print("[Bluetooth] TIMED OUT")
+				self.disconnect()
+
+			if self.online and not self.window.in_flight and not self.storage_ops:
+				# Sleep until there is something to send, or until a presence check is due
+				self.outbound.wait(max(0., self.keepalive_interval() - self.idle_time()))
+
+	def stop(self):
+		self.running = False
+		self.outbound.wake()
+		super().stop()
+
+	def dead_timeout(self) -> float:
+		"""
+		:return: seconds without any acknowledgment after which the link is considered dead
+		"""
+		if self.window.srtt is None:
+			return self.CONNECT_TIMEOUT
+		# Rounded, so that the serial port isn't reconfigured after every measure
+		timeout = round(self.LIVENESS_RTOS * self.window.rto(), 2)
+		return min(self.MAX_DEAD_TIMEOUT, max(self.MIN_DEAD_TIMEOUT, timeout))
+
+	def keepalive_interval(self) -> float:
+		"""
+		:return: seconds without any acknowledgment after which a presence check is sent
+		"""
+		if self.window.srtt is None:
+			return self.MAX_KEEPALIVE
+		return min(self.MAX_KEEPALIVE, max(self.MIN_KEEPALIVE, self.KEEPALIVE_RTTS * self.window.srtt))
+
+	def idle_time(self) -> float:
+		"""
+		:return: seconds since the last acknowledgment or presence check
+		"""
+		return time.monotonic() - max(self.last_ack, self.last_probe)
+
+	def acknowledged(self):
+		self.last_ack = self.waiting_since = time.monotonic()
+
+	def next_batch(self) -> list[OutgoingPacket]:
+		"""
+		Take the next packets to send in a single frame, control packets overtake storage operations
+		Storage operations are only computed once there is nothing else to send,
+		so that they are always computed from the most recent compounds
+		:return: The packets, or an empty list if there is nothing to send
+		"""
+		pk = self.outbound.pop(Priority.PRESENCE)
+		if pk is not None:
+			return [pk]
+		if not self.storage_ops:
+			compounds = self.outbound.pop(Priority.STORAGE)
+			if compounds is not None:
+				self.last_compounds = compounds
+				with self.encode_seconds.time():
+					self.storage_ops = self.storage_packets(compounds)
+		if not self.storage_ops:
+			return []
+		count = self.codec.batch_size(self.storage_ops)
+		batch = self.storage_ops[:count]
+		del self.storage_ops[:count]
+		return batch
+
+	def put_back(self, batch: list[OutgoingPacket]):
+		"""
+		Give back packets taken with next_batch that couldn't be sent
+		"""
+		if batch[0].op is None:
+			self.outbound.push_front(batch, Priority.CONTROL)
+		else:
+			self.storage_ops[:0] = batch
+
+	def before_send(self, batch: list[OutgoingPacket]):
+		"""
+		Called right before packets are written for the first time
+		"""
+		if batch[0].resets_storage:
+			# Operations computed against the previous storage state are now meaningless
+			self.storage.reset()
+			self.storage_ops.clear()
+			if not self.outbound.has("storage"):
+				self.outbound.put(self.last_compounds, Priority.STORAGE, key="storage")
+
+	def transmit_stop_and_wait(self):
+		"""
+		Send each packet and wait for its acknowledgment before sending the next one
+		"""
+		failures = []
+		while self.online:
+			batch = self.next_batch()
+			if not batch:
+				break
+			# Write the buffer to the serial stream
+			pk = batch[0]
+			self.before_send(batch)
+			if self.bluetooth_serial.timeout != self.dead_timeout():
+				self.bluetooth_serial.timeout = self.dead_timeout()
+			sent_at = time.monotonic()
+			self.write(bytes(pk.buffer, 'utf-8'))
+			if not self.get_ack():
+				# If the Arduino doesn't respond with a positive ack, skip this packet for now
+				print("[Bluetooth] Failed to transmit packet {}".format(pk.buffer))
+				self.retransmits.inc()
+				failures.append(pk)
 			else:
-				# Check if any packet needs to be sent
-				if len(self.outgoing_pks) == 0 and time.time() - self.last_check > self.CONN_CHECK_INTERVAL:
-					while self.using:
-						pass
-					# Send a presence packet to the Arduino
-					print("[Bluetooth] Sending presence check")
-					if "AAF15AA" not in self.outgoing_pks:
-						self.outgoing_pks.append("AAF15AA")
-					self.last_check = time.time()
-
-				failures = 0
-				while not self.using and len(self.outgoing_pks) > failures and self.online:
-					# Loop through each packet to be sent
-					try:
-						# Write the buffer to the serial stream
-						self.bluetooth_serial.write(bytes(self.outgoing_pks[failures], 'utf-8'))
-						if not self.get_ack():
-							# If the Arduino doesn't respond with a positive ack, skip this packet for now
-							print("[Bluetooth] Failed to transmit packet {}".format(self.outgoing_pks[failures]))
-							failures += 1
-						else:
-							# Otherwise, remove it from the packets to be sent and move on
-							self.last_check = time.time()
-							self.outgoing_pks.pop(failures)
-					except serial.serialutil.SerialTimeoutException:
-						print("[Bluetooth] TIMED OUT")
-						self.online = False
-						self.bluetooth_serial.close()
+				# Otherwise, move on
+				self.acknowledged()
+				self.window.measure_rtt(time.monotonic() - sent_at)
+				self.packet_acknowledged(pk)
+
+		if failures:
+			self.put_back_failures(failures)
 			time.sleep(self.UPDATE_DELAY / 1000)
 
+	def put_back_failures(self, failures: list[OutgoingPacket]):
+		"""
+		Give back the packets the Arduino rejected in stop-and-wait mode, they will be sent again later
+		"""
+		for op in (True, False):
+			skipped = [pk for pk in failures if (pk.op is not None) == op]
+			if skipped:
+				self.put_back(skipped)
+
+	def transmit_windowed(self):
+		"""
+		Fill the send window with sequenced packets, process the acknowledgments
+		and retransmit the packets that went missing
+		"""
+		self.fill_window()
+		if not self.window.in_flight:
+			return
+
+		# Process the acknowledgments received so far
+		data = self.bluetooth_serial.read(max(1, self.bluetooth_serial.in_waiting))
+		for frame in self.parser.feed(data):
+			self.on_frame(frame)
+		self.retransmit()
+
+	def fill_window(self):
+		"""
+		Send as many new frames as the window allows
+		"""
+		while True:
+			batch = self.next_batch()
+			if not batch:
+				break
+			if not self.window.can_send(len(self.codec.encode(0, batch))):
+				self.put_back(batch)
+				break
+			self.before_send(batch)
+			if not self.window.in_flight:
+				self.waiting_since = time.monotonic()
+			with self.frame_seconds.time():
+				entry = self.window.register(batch, self.codec)
+			self.write(entry.frame)
+			self.window.sent(entry)
+
+	def on_frame(self, frame: Frame):
+		"""
+		Process a frame received in windowed mode
+		"""
+		if not frame.valid:
+			return
+		if frame.pid == CMD_SEQ_ACK:
+			for pk in self.window.on_ack(frame.body):
+				self.acknowledged()
+				self.packet_acknowledged(pk)
+		elif frame.pid == CMD_ACK and int(frame.body or "0", base=16) == 0:
+			# The Arduino received a corrupted packet
+			self.fast_retransmit = True
+
+	def retransmit(self):
+		"""
+		Send the missing packets again
+		Raises a SerialTimeoutException once the link is considered dead, the connection is then reset
+		"""
+		if self.window.in_flight and time.monotonic() - self.waiting_since > self.dead_timeout():
+			raise serial.serialutil.SerialTimeoutException("No acknowledgment for {:.2f}s".format(time.monotonic() - self.waiting_since))
+
+		due = self.window.due(fast=self.fast_retransmit)
+		if due and self.window.broken():
+			# The last attempt went unacknowledged too
+			raise serial.serialutil.SerialTimeoutException(
+				"Frame sent {} times without acknowledgment".format(self.window.MAX_TRANSMISSIONS)
+			)
+		for entry in due:
+			self.write(entry.frame)
+			self.retransmits.inc()
+			self.window.sent(entry)
+		self.fast_retransmit = False
+
+	def write(self, data: bytes):
+		"""
+		Write a frame to the serial port
+		"""
+		with self.write_seconds.time():
+			self.bluetooth_serial.write(data)
+		self.sent_frames.inc()
+
+	def packet_acknowledged(self, pk: OutgoingPacket):
+		"""
+		Called once the Arduino acknowledged a packet
+		"""
+		if pk.op is not None:
+			self.storage.acknowledge(pk.op)
+
+	def disconnect(self):
+		"""
+		Close the serial port, the packets that were in flight will be sent again once reconnected
+		"""
+		self.online = False
+		self.disconnections.inc()
+		in_flight = self.window.reset()
+		self.storage_ops[:0] = [pk for pk in in_flight if pk.op is not None]
+		control = [pk for pk in in_flight if pk.op is None]
+		if control:
+			self.outbound.push_front(control, Priority.CONTROL)
+		self.parser.clear()
+		if self.bluetooth_serial is not None:
+			self.bluetooth_serial.close()
+		# Try the same port again right away
+		self.next_attempt = 0.
+
+	def negotiate(self):
+		"""
+		Try to switch the connection to the windowed protocol, in the preferred wire format if possible
+		The Arduino acknowledges a format negotiation or a sequence reset only if it supports it
+		"""
+		self.sequenced = False
+		self.codec = AsciiCodec
+		self.window.reset()
+		if self.WINDOWED:
+			if self.PREFERRED_FORMAT != FORMAT_ASCII:
+				self.bluetooth_serial.write(bytes(ascii_packet("{:x}{:x}".format(CMD_NEGOTIATE, self.PREFERRED_FORMAT)), 'utf-8'))
+				if self.get_ack():
+					self.sequenced, self.codec = True, CODECS[self.PREFERRED_FORMAT]
+			if not self.sequenced:
+				self.bluetooth_serial.write(bytes(ascii_packet("{:x}".format(CMD_SEQ_RESET)), 'utf-8'))
+				self.sequenced = self.get_ack()
+		self.parser = self.codec.parser()
+		if self.sequenced:
+			# Acknowledgments are polled while packets are in flight instead of blocking on each of them
+			self.bluetooth_serial.timeout = self.ACK_POLL_TIMEOUT
+		else:
+			self.bluetooth_serial.timeout = self.dead_timeout()
+		print("[Bluetooth] Using the {} protocol{}".format(
+			"windowed" if self.sequenced else "stop-and-wait",
+			" in binary format" if self.codec is BinaryCodec else ""
+		))
+
 	def reconnect(self) -> bool:
 		"""
 		Try to establish the bluetooth connection with the Arduino module
 		"""
-		print("[Bluetooth] Attempting connection with the bluetooth module")
-		devices = list_ports.comports()
-		self.com_port = None
-		for device in devices:
-			if self.mac_addr in device.hwid:
-				self.com_port = device.usb_description()
+		ports = self.candidate_ports()
+		for port in ports or []:
+			if self.connect(port):
+				self.connected(port)
+				return True
+		if ports is not None:
+			self.connection_failed()
+		return False
 
-		if self.com_port is None:
-			print("[Bluetooth] Unable to identify the bluetooth module amongst available COM ports")
-			return False
-		else:
-			try:
-				self.bluetooth_serial = serial.Serial(self.com_port, 9600, writeTimeout=3, timeout=5)
-				self.online = True
-			except serial.serialutil.SerialException:
+	def candidate_ports(self) -> list[str] | None:
+		"""
+		The port the module was last reached on is tried first, the other ports are only scanned once in a while
+		:return: The ports to try, or None if the next attempt isn't due yet
+		"""
+		now = time.monotonic()
+		if now < self.next_attempt:
+			return None
+		if self.port_url is not None:
+			return [self.port_url]
+		ports = [self.com_port] if self.com_port is not None else []
+		if now >= self.next_scan:
+			self.next_scan = now + self.scan_delay
+			self.scan_delay = min(2 * self.scan_delay, self.MAX_SCAN_DELAY)
+			print("[Bluetooth] Attempting connection with the bluetooth module")
+			found = self.scan_ports()
+			if not found:
 				print("[Bluetooth] Unable to identify the bluetooth module amongst available COM ports")
-				time.sleep(1)
-				return False
-			print("[Bluetooth] Successfully connected to the module on {}".format(self.com_port))
+			ports += [port for port in found if port not in ports]
+		return ports
+
+	def connected(self, port: str):
+		"""
+		Remember the port the module was reached on, and reset the backoffs
+		"""
+		self.com_port = port
+		self.retry_delay, self.scan_delay, self.next_scan = self.RETRY_DELAY, self.SCAN_DELAY, 0.
+
+	def connection_failed(self):
+		self.next_attempt = time.monotonic() + self.retry_delay
+		self.retry_delay = min(2 * self.retry_delay, self.MAX_RETRY_DELAY)
+
+	def scan_ports(self) -> list[str]:
+		"""
+		:return: The COM ports of the bluetooth module
+		"""
+		return [device.usb_description() for device in list_ports.comports() if self.mac_addr in device.hwid]
+
+	def connect(self, port: str) -> bool:
+		"""
+		Open a port, negotiate the protocol and resume the session
+		"""
+		try:
+			self.bluetooth_serial = serial.serial_for_url(port, 9600, write_timeout=self.WRITE_TIMEOUT, timeout=self.CONNECT_TIMEOUT)
+			self.online = True
+			state = self.query_state()
+			self.negotiate()
+			if not self.online:
+				raise serial.serialutil.SerialTimeoutException("No answer to the negotiation")
+			self.resume(state)
+		except serial.serialutil.SerialException:
+			print("[Bluetooth] Unable to reach the bluetooth module on {}".format(port))
+			self.online = False
+			if self.bluetooth_serial is not None:
+				self.bluetooth_serial.close()
+			return False
+		self.acknowledged()
+		print("[Bluetooth] Successfully connected to the module on {}".format(port))
 		return True
 
+	def query_state(self) -> ArduinoState | None:
+		"""
+		Ask the Arduino what it still holds
+		:return: Its state, or None if its firmware doesn't support the query or it didn't answer in time
+		"""
+		self.bluetooth_serial.write(bytes(ascii_packet("{:x}".format(CMD_STATE)), 'utf-8'))
+		parser = FrameParser()
+		deadline = time.monotonic() + self.dead_timeout()
+		while time.monotonic() < deadline:
+			for frame in parser.feed(self.bluetooth_serial.read(max(1, self.bluetooth_serial.in_waiting))):
+				if frame.valid and frame.pid == CMD_STATE:
+					return ArduinoState.parse(frame.body)
+				if frame.pid == CMD_ACK:
+					return None  # Rejected by an older firmware
+		return None
+
+	def resume(self, state: ArduinoState | None):
+		"""
+		Send again what the Arduino lost since the previous connection
+		If it didn't restart, only the packets that were in flight when the link dropped are sent again
+		"""
+		if state is not None and state.boot_id == self.boot_id and (state.compounds == len(self.storage.acked) or self.storage_ops):
+			print("[Bluetooth] Resuming the session, the Arduino kept its {} compounds".format(state.compounds))
+		else:
+			# The Arduino was restarted, or can't tell : start over from an empty storage
+			self.boot_id = state.boot_id if state is not None else None
+			self.resync_storage()
+		if self.mode != 0 and (state is None or state.mode != self.mode):
+			self.send_mode(self.mode)
+
 	def stop_actions(self):
 		pass
 
 	def send_blocks(self, compounds):
 		"""
-		Clear the Arduino memory from all the register compounds,
-		and send all those that have been detected in the previous frame
+		Queue the compounds detected in the previous frame
+		Only the changes between them and those the Arduino already knows about will be sent,
+		and they replace any compounds that weren't sent yet
 		"""
-		self.outgoing_pks.append("AA00AA")  # Flush blocks
+		valid = []
 		for data in compounds:
-			checksum = 1  # 1 for the packet id
-			xPos, yPos, rot, t = hex(round(data[0] * 100))[2:].zfill(4), hex(round(data[1] * 100))[2:].zfill(4), hex(
-				round((data[2] % 90) * 100))[2:].zfill(4), hex(data[3])[2]
-			if len(xPos) != 4 or len(yPos) != 4 or len(rot) != 4:
+			if not (0 <= round(data[0] * 100) <= 0xFFFF and 0 <= round(data[1] * 100) <= 0xFFFF):
 				print("[Bluetooth] Unable to send block detected at x={} ; y={} ; rot={} of type {}".format(*data))
 				continue
-			for param in [xPos, yPos, rot, t]:
-				for letter in param:
-					for n in range(8):
-						checksum += (int(letter, base=16) >> n) & 0x01
-			checksum %= 10
-			buffer = "AA1{}{}{}{}{}AA".format(
-				xPos, yPos, rot, t, checksum
-			)  # Create Compound Packet
-			self.outgoing_pks.append(buffer)
+			valid.append(data)
+		self.outbound.put(valid, Priority.STORAGE, key="storage")
+
+	def storage_packets(self, compounds) -> list[OutgoingPacket]:
+		"""
+		Compute the packets that bring the Arduino storage up to date with the given compounds
+		"""
+		packets = []
+		for op in self.storage.diff(compounds):
+			if op.compound is None:
+				buffer = ascii_packet("3{:02x}".format(op.cid))  # Remove Compound Packet
+			else:
+				x, y, rot, t = op.compound
+				buffer = ascii_packet("4{:02x}{:04x}{:04x}{:04x}{:x}".format(
+					op.cid, round(x * 100), round(y * 100), round(rot * 100), t
+				))  # Update Compound Packet
+			packets.append(OutgoingPacket(buffer, op))
+		return packets
+
+	def resync_storage(self):
+		"""
+		Clear the Arduino memory from all the registered compounds,
+		so that every compound is sent again
+		"""
+		self.outbound.put(OutgoingPacket("AA00AA", resets_storage=True), Priority.CONTROL)  # Flush blocks
 
 	def send_calib_request(self):
 		"""
 		Called when the Calibration button is pressed for the first time
 		"""
-		self.outgoing_pks.append('AA52AA')
+		self.outbound.put(OutgoingPacket('AA52AA'), Priority.CONTROL)
 
 	def send_calib_confirmation(self):
 		"""
 		Called when the Calibration button is pressed again
 		"""
-		self.outgoing_pks.append('AA62AA')
+		self.outbound.put(OutgoingPacket('AA62AA'), Priority.CONTROL)
 
 	def send_mode(self, mode: int):
 		"""
@@ -148,14 +563,16 @@ class BluetoothHandler(BaseHandler):
 				buff = "AA222AA"
 			case _:
 				buff = "AA201AA"
-		self.outgoing_pks.append(buff)
+		self.mode = mode if mode in (1, 2) else 0
+		self.outbound.put(OutgoingPacket(buff), Priority.CONTROL, key="mode")
 
 	def send_reset(self):
 		"""
 		Called when the RESET button is clicked
 		Will reset both the local memory and that of the Arduino, as well as home the Dobots
 		"""
-		self.outgoing_pks.append("AAE3AA")
+		# The Arduino clears its compounds on reset
+		self.outbound.put(OutgoingPacket("AAE3AA", resets_storage=True), Priority.CONTROL)
 
 	def get_ack(self) -> bool:
 		"""
@@ -163,13 +580,12 @@ class BluetoothHandler(BaseHandler):
 		"""
 		if self.running and self.online:
 			try:
-				ack = self.bluetooth_serial.read_until(size=7).decode('utf-8')
+				ack = self.bluetooth_serial.read_until(size=7).decode('utf-8', errors='replace')
 				if ack == '':
 					raise serial.serialutil.SerialTimeoutException(self.bluetooth_serial)
-				return ack == "AAF15AA"
+				return ack == ACK_VALID
 			except serial.serialutil.SerialException:
-				self.online = False
-				self.bluetooth_serial.close()
-				print("Timed out")
+				print("[Bluetooth] Timed out")
+				self.disconnect()
 		return False
 
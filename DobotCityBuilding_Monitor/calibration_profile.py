@@ -0,0 +1,41 @@
+import json
+import os
+
+import camera_utils
+
+# Calibration values kept from one run to the next, so that the headless mode can start without the calibration window
+# Each cell has its own profile, DEFAULT_PATH is used by the cells that don't name one
+DEFAULT_PATH = "calibration_profile.json"
+
+
+def save_profile(calibration: camera_utils.Calibration, path: str = None):
+	"""
+	Save the current calibration values of a cell
+	:param path: DEFAULT_PATH if None
+	"""
+	path = path or DEFAULT_PATH
+	profile = {
+		"shadow_size": calibration.shadow_size,
+		"shadow_intensity": calibration.shadow_intensity,
+	}
+	with open(path, "w") as f:
+		json.dump(profile, f, indent=1)
+	print("[Profile] Calibration saved to {}".format(path))
+
+
+def load_profile(calibration: camera_utils.Calibration, path: str = None) -> bool:
+	"""
+	Apply saved calibration values to a cell
+	:param path: DEFAULT_PATH if None
+	:return: Whether a profile was found
+	"""
+	path = path or DEFAULT_PATH
+	if not os.path.isfile(path):
+		print("[Profile] No calibration profile found at {}, using the default values".format(path))
+		return False
+	with open(path) as f:
+		profile = json.load(f)
+	calibration.shadow_size = int(profile.get("shadow_size", calibration.shadow_size))
+	calibration.shadow_intensity = int(profile.get("shadow_intensity", calibration.shadow_intensity))
+	print("[Profile] Calibration loaded from {}".format(path))
+	return True
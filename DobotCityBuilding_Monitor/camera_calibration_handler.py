@@ -1,5 +1,5 @@
 import camera_utils
-from base_handler import *
+from gui_handler import *
 from PIL import Image as PILImage, ImageTk
 
 
@@ -43,11 +43,13 @@ class CameraCalibrationHandler(FrameHoldingBaseHandler):
 		self.previous_button = Button(self.window, command=self.previous_state, image=self.btnImages[1], bg=self.window_bg, activebackground=self.window_bg, borderwidth=0, state="disabled")
 		self.previous_button.place(relx=0.35, y=sh - int(1.2 * self.btnImages[0].height()), anchor='n')
 
+		calibration = self.cell.calibration
+
 		def update_shadow_size(val):
-			camera_utils.sl_shadow_size = int(val)
+			calibration.shadow_size = int(val)
 
 		def update_shadow_intensity(val):
-			camera_utils.sl_shadow_intensity = int(val)
+			calibration.shadow_intensity = int(val)
 
 		self.shadow_size = Scale(self.window, from_=0, to=1000, resolution=2, length=int(0.7 * sw), orient=HORIZONTAL,
 							command=update_shadow_size, label="Taille des ombres", bg=self.window_bg, fg="white")
@@ -77,17 +79,20 @@ class CameraCalibrationHandler(FrameHoldingBaseHandler):
 				self.confirm_button.config(image=self.btnImages[0])
 				self.previous_button.config(state="disabled")
 			case 1:
+				# The camera might have been moved while the markers were shown
+				self.cell.calibration.invalidate_storage_zone()
 				self.shadow_size.pack()
 				self.shadow_size.place(relx=0.5, rely=0.58, anchor='n')
-				self.shadow_size.set(camera_utils.sl_shadow_size)
+				self.shadow_size.set(self.cell.calibration.shadow_size)
 				self.shadow_intensity.pack()
 				self.shadow_intensity.place(relx=0.5, rely=0.65, anchor='n')
-				self.shadow_intensity.set(camera_utils.sl_shadow_intensity)
+				self.shadow_intensity.set(self.cell.calibration.shadow_intensity)
 				self.confirm_button.config(image=self.btnImages[2])
 				self.previous_button.config(state="normal")
 			case 2:
-				camera_utils.sl_shadow_size = self.shadow_size.get()
-				camera_utils.sl_shadow_intensity = self.shadow_intensity.get()
+				self.cell.calibration.shadow_size = self.shadow_size.get()
+				self.cell.calibration.shadow_intensity = self.shadow_intensity.get()
+				self.cell.save_profile()
 				self.confirm_button.config(state="disabled")
 				self.previous_button.config(state="disabled")
 				self.stop()
@@ -101,16 +106,20 @@ class CameraCalibrationHandler(FrameHoldingBaseHandler):
 
 	def update(self):
 		if self.running:
-			success, feed = FrameHoldingBaseHandler.get_camera_feed()
-			if feed is not None:
+			frame = self.get_new_frame()
+			if frame is not None:
+				success, feed = frame.success, frame.image
 				if success:
 					match self.state:
 						case 0:
-							result = camera_utils.detect_markers(feed)
+							# Work on a copy, the feed buffer is shared with the other camera consumers
+							result = camera_utils.detect_markers(feed.copy())
 							self.set_info("Placez la caméra de sorte à ce que les 4 marqueurs aux coins"
 							              " de la zone de stockage soient détectés", "#00aa00")
 						case 1:
-							result = camera_utils.calib_show_contours(feed, camera_utils.sl_shadow_size, camera_utils.sl_shadow_intensity)
+							result = camera_utils.calib_show_contours(
+								feed.copy(), self.cell.calibration.shadow_size, self.cell.calibration.shadow_intensity
+							)
 							self.set_info("Réglez les paramètres si dessous de sorte à réduire le bruit au maximum"
 							              "\n tout en s'assurant que les blocs placés dans la zone soient entourés en vert", "#00aa00")
 						case _:
@@ -121,7 +130,7 @@ class CameraCalibrationHandler(FrameHoldingBaseHandler):
 					self.set_info("Impossible de capturer une image... Vérifiez la connexion par USB de la caméra", "#aa0000")
 					self.confirm_button.config(state='disabled')
 
-				self.save_result(result)
+				self.show_result(result)
 			self.window.after(self.REFRESH_DELAY, self.update)
 
 	def set_info(self, text: str, fg: str):
@@ -1,38 +1,253 @@
 import time
+from multiprocessing import shared_memory
+from threading import Condition
+from typing import NamedTuple
 
 import cv2
+import numpy as np
 
 import base_handler
+import metrics
+from frame_sources import FrameSource, open_source
+
+# Time spent reading the frames, and outcome of the captures
+capture_seconds = metrics.histogram("camera_capture_seconds", "Time spent reading a frame from the source")
+captured_frames = metrics.counter("camera_frames_total", "Capture attempts")
+failed_captures = metrics.counter("camera_failures_total", "Failed captures")
+
+
+class CapturedFrame(NamedTuple):
+	"""
+	A frame taken from the capture ring
+	`image` is a view on one of the ring buffers, it will be overwritten once the ring wraps around
+	"""
+	seq: int  # Sequence number, increases by one on every capture attempt
+	timestamp: float  # time.monotonic() at which the capture completed
+	success: bool  # Whether the capture succeeded (otherwise, image is a read-only placeholder)
+	image: np.ndarray
+	slot: int = -1  # Ring slot holding the image
 
 
 class CameraFeedHandler(base_handler.BaseHandler):
 
 	CAPTURE_DELAY = 50  # ms, how often to capture an image
+	# Camera index, video file or image directory to take the frames from, None for the camera of the rig
+	# Only used by the cells that don't name a source of their own
+	SOURCE = None
+	SOURCE_REALTIME = True  # Replay recordings at their recorded speed, otherwise as fast as possible
+	SOURCE_LOOP = True  # Start recordings over once they are over
+	RING_SIZE = 4  # How many frame buffers are preallocated
+	# Allocate the frame buffers in shared memory, so that worker processes can read the frames without any copy
+	SHARED_MEMORY = False
+	SHARED_FRAME_BYTES = 1920 * 1080 * 3  # Size of each shared buffer, larger frames are kept in process memory
 
 	# # # LINKS & INSTANCES # # #
-	capture: cv2.VideoCapture
+	source: FrameSource
+
+	# # # FRAME RING # # #
+	# Frame buffers, filled in place by the capture
+	ring: list = []
+	# Frames stored in each slot of the ring
+	frames: list = []
+	# Sequence number of the last capture (-1 until the first capture is done)
+	last_seq = -1
+	# Slot holding the last capture, and slot being filled by the capture in progress
+	latest_slot = -1
+	writing_slot = -1
+	# Number of leases on each slot, leased slots are never overwritten
+	leases: list = []
+	# Shared memory blocks backing each slot (empty unless SHARED_MEMORY is enabled), and a flat view of each of them
+	shared: list = []
+	shared_bytes: list = []
+	# Notified every time a new frame is available
+	new_frame: Condition
 
 	# # # OUTPUT DATA # # #
 	# Last capture to have been performed
 	feed = None
 	# Last capture successful
 	success = False
-	# Last capture saved
-	saved = False
+	# Image published in place of the frames while the camera can't be read, loaded once
+	placeholder: np.ndarray = None
+	# Black frame published instead when the placeholder couldn't be loaded, the size of the last capture
+	blank: np.ndarray = None
+	BLANK_SHAPE = 480, 640, 3  # Shape of the black frame until a frame was captured
 
 	def init(self):
-		self.capture = cv2.VideoCapture(1, cv2.CAP_DSHOW)
+		source = self.cell.source if self.cell.source is not None else self.SOURCE
+		self.source = open_source(source, self.SOURCE_REALTIME, self.SOURCE_LOOP)
+		self.placeholder = cv2.imread("resources/camera_noise.png")
+		if self.placeholder is not None:
+			self.placeholder.flags.writeable = False
+		else:
+			print("[Camera] Couldn't load resources/camera_noise.png, failed captures are shown as black frames")
+		self.blank = None
+		print("[Camera] Reading the frames of {} from {}".format(self.cell, self.source))
+		self.ring = [None] * self.RING_SIZE
+		self.frames = [None] * self.RING_SIZE
+		self.last_seq = -1
+		self.latest_slot = self.writing_slot = -1
+		self.leases = [0] * self.RING_SIZE
+		self.new_frame = Condition()
+		self.shared = []
+		if self.SHARED_MEMORY:
+			self.shared = [shared_memory.SharedMemory(create=True, size=self.SHARED_FRAME_BYTES) for _ in range(self.RING_SIZE)]
+		self.shared_bytes = [np.ndarray((self.SHARED_FRAME_BYTES,), np.uint8, buffer=block.buf) for block in self.shared]
+		metrics.gauge(
+			"camera_leased_frames", "Ring buffers leased by the consumers of the frames", lambda: sum(self.leases),
+			cell=self.cell.cell_id
+		)
 
 	def update(self):
 		while self.running:
-			self.saved = False
-			self.success, self.feed = self.capture.read()
+			slot = self.next_slot()
+			if slot is None:
+				# Every buffer is leased, wait for one to be released
+				time.sleep(self.CAPTURE_DELAY / 1000)
+				continue
 
-			if not self.success:
+			# Capture straight into the preallocated buffer (OpenCV only reallocates it if the resolution changed)
+			start = time.perf_counter()
+			success, image = self.source.read(image=self.ring[slot])
+			capture_seconds.observe(time.perf_counter() - start)
+			if (not success or image is None) and self.source.exhausted:
+				# The recording is over, the last frame stays the latest one
+				with self.new_frame:
+					self.writing_slot = -1
+				time.sleep(self.CAPTURE_DELAY / 1000)
+				continue
+			if not success or image is None:
 				# If the capture failed, the camera might be disconnected
-				self.feed = cv2.imread("resources/camera_noise.png")
-				self.capture = cv2.VideoCapture(1, cv2.CAP_DSHOW)
-			time.sleep(self.CAPTURE_DELAY / 1000)
+				# the source then tells how long to wait before its next reconnection attempt
+				success = False
+				failed_captures.inc()
+				image = self.failure_image()
+				self.source.reopen()
+			else:
+				image = self.to_shared(slot, image)
+				self.ring[slot] = image
+
+			captured_frames.inc()
+			with self.new_frame:
+				seq = self.last_seq + 1
+				self.frames[slot] = CapturedFrame(seq, time.monotonic(), success, image, slot)
+				self.last_seq, self.latest_slot, self.writing_slot = seq, slot, -1
+				self.success, self.feed = success, image
+				self.new_frame.notify_all()
+			time.sleep(self.source.delay(self.CAPTURE_DELAY / 1000))
+
+	def failure_image(self) -> np.ndarray:
+		"""
+		:return: Read-only image to publish in place of a frame that couldn't be captured
+		"""
+		if self.placeholder is not None:
+			return self.placeholder
+		latest = self.frames[self.latest_slot] if self.last_seq >= 0 else None
+		shape = latest.image.shape if latest is not None else self.BLANK_SHAPE
+		if self.blank is None or self.blank.shape != shape:
+			self.blank = np.zeros(shape, np.uint8)
+			self.blank.flags.writeable = False
+		return self.blank
+
+	def next_slot(self) -> int | None:
+		"""
+		Pick the buffer the next capture goes into : the oldest one that is neither leased nor holding the last capture
+		:return: The slot, or None if every buffer is in use
+		"""
+		with self.new_frame:
+			for offset in range(1, self.RING_SIZE + 1):
+				slot = (self.latest_slot + offset) % self.RING_SIZE
+				if slot != self.latest_slot and self.leases[slot] == 0:
+					self.writing_slot = slot
+					return slot
+		return None
+
+	def to_shared(self, slot: int, image: np.ndarray) -> np.ndarray:
+		"""
+		Make sure a captured image lives in the shared buffer of its slot
+		OpenCV only allocates a new image when the resolution changes, it is then copied once in the shared buffer
+		"""
+		if not self.shared or np.may_share_memory(image, self.shared_bytes[slot]):
+			return image
+		if image.nbytes > self.SHARED_FRAME_BYTES:
+			print("[Camera] Frame of {} bytes can't fit in shared memory".format(image.nbytes))
+			return image
+		view = self.shared_view(slot, image.shape)
+		np.copyto(view, image)
+		return view
+
+	def shared_view(self, slot: int, shape: tuple) -> np.ndarray:
+		"""
+		:return: An image of the given shape, backed by the shared buffer of a slot
+		"""
+		return np.ndarray(shape, np.uint8, buffer=self.shared[slot].buf)
+
+	def is_shared(self, frame: CapturedFrame) -> bool:
+		"""
+		:return: Whether a frame's image can be read by other processes
+		"""
+		return bool(self.shared) and frame.slot >= 0 and np.may_share_memory(frame.image, self.shared_bytes[frame.slot])
+
+	def latest_frame(self) -> CapturedFrame | None:
+		"""
+		Get the most recent frame without copying it
+		:return: The last captured frame, or None if nothing was captured yet
+		"""
+		with self.new_frame:
+			if self.last_seq < 0:
+				return None
+			return self.frames[self.latest_slot]
+
+	def wait_for_frame(self, after_seq: int = -1, timeout: float | None = None) -> CapturedFrame | None:
+		"""
+		Wait for a frame more recent than one that was already processed
+		:param after_seq: Sequence number of the last frame the caller has seen
+		:param timeout: Maximum time to wait for, in seconds (None to wait forever)
+		:return: The most recent frame, or None if no new frame arrived in time
+		"""
+		with self.new_frame:
+			if not self.new_frame.wait_for(lambda: self.last_seq > after_seq or not self.running, timeout):
+				return None
+			if self.last_seq <= after_seq:
+				return None
+			return self.frames[self.latest_slot]
+
+	def lease_frame(self, after_seq: int = -1, timeout: float | None = None) -> CapturedFrame | None:
+		"""
+		Same as wait_for_frame, but the frame's buffer won't be overwritten until release_frame is called
+		"""
+		with self.new_frame:
+			frame = self.wait_for_frame(after_seq, timeout)
+			if frame is not None:
+				self.leases[frame.slot] += 1
+			return frame
+
+	def release_frame(self, frame: CapturedFrame):
+		"""
+		Give back a frame obtained with lease_frame
+		"""
+		with self.new_frame:
+			self.leases[frame.slot] -= 1
+
+	def is_valid(self, frame: CapturedFrame) -> bool:
+		"""
+		Check that a frame's buffer hasn't been overwritten by a newer capture yet
+		"""
+		return frame.slot != self.writing_slot and self.frames[frame.slot] is frame
 
 	def stop_actions(self):
-		pass
+		with self.new_frame:
+			self.new_frame.notify_all()
+		self.source.release()
+		# Drop the images backed by the shared buffers before releasing them
+		self.ring = [None] * self.RING_SIZE
+		self.frames = [None] * self.RING_SIZE
+		self.feed = None
+		self.shared_bytes = []
+		for block in self.shared:
+			try:
+				block.close()
+			except BufferError:
+				pass  # Still referenced somewhere, the mapping goes away with the last reference
+			block.unlink()
+		self.shared = []
@@ -1,12 +1,16 @@
 import enum
 import math
+import time
+from typing import NamedTuple
 
-from base_handler import *
-from ArucoCrop import CV2_ArucoCrop as AC
-from ArucoCrop.ArucoArea import CallbackArucoArea
 import cv2
 import numpy as np
 
+import city_map
+from area_registry import ArucoArea, AreaRegistry
+from marker_detector import MarkerDetector
+from storage_zone import StorageZone
+
 
 class BlockType(enum.IntEnum):
 	House = 0
@@ -15,16 +19,19 @@ class BlockType(enum.IntEnum):
 	Tree = 3
 
 
-# Dimensions of the storage area, in mm
+# Detector of the Aruco markers highlighted by the calibration window
+marker_detector = MarkerDetector(cv2.aruco.DICT_4X4_50)
+# Default dimensions of the storage area, in mm
 storage_dimensions = 278, 104
-# Coordinates in mm corresponding to the top left corner of the image
+# Default ID of the four Aruco markers around the storage area
+storage_aruco_id = 10
+# Default coordinates in mm corresponding to the top left corner of the image
 # once it has been cropped
 camera_origin = 133, 319
-
-# Shadow size read on the calibration slider
-sl_shadow_size = 1
-# Shadow intensity read on the calibration slider
-sl_shadow_intensity = 1
+# Default ID of the four Aruco markers around the build zone, the city map of city_map.SLOTS
+# Its dimensions and position depend on where the markers are stuck around the printed map : they are measured on
+# the rig and set in the "build" entry of a cell (see cells.py), the build zone isn't checked until then
+build_aruco_id = 11
 
 # Color palette
 palette = {
@@ -33,27 +40,237 @@ palette = {
 	BlockType.Car: (255, 0, 0),
 	BlockType.Tree: (0, 255, 0)
 }
-# Last image result
-last_result = None
-# Last success
-last_success = False
-# Last found compounds
-compounds = []
-# Last success cube count
-last_count = 0
+# Minimum distance between the centers of two blocks, in mm
+BLOCK_SEPARATION = 10
+# Stages timed by detect_storage, the first two locate the storage zone and the next ones process it
+# "build" is the warp and the verification of the build zone, concurrent with the storage stages
+STAGES = ("markers", "warp", "canny", "contours", "colours", "annotate", "build")
+LOCATE_STAGES = STAGES[:2]
+
+
+class SpatialHash:
+	"""
+	Uniform grid of candidates, used to keep a single candidate within a given distance
+	Each candidate is only compared to those of the neighbouring cells
+	"""
+
+	def __init__(self, cell_size: float):
+		"""
+		:param cell_size: Minimum distance between two kept candidates
+		"""
+		self.cell_size = cell_size
+		# Cell => indices of the candidates it holds
+		self.cells = {}
+		# (x, y, score, payload) for each inserted candidate, None once it was replaced
+		self.items = []
+
+	def cell(self, x: float, y: float) -> tuple[int, int]:
+		return math.floor(x / self.cell_size), math.floor(y / self.cell_size)
+
+	def neighbours(self, x: float, y: float) -> list[int]:
+		"""
+		:return: Indices of the kept candidates closer than cell_size to the given point
+		"""
+		cx, cy = self.cell(x, y)
+		found = []
+		for i in range(cx - 1, cx + 2):
+			for j in range(cy - 1, cy + 2):
+				for index in self.cells.get((i, j), ()):
+					other = self.items[index]
+					if math.hypot(other[0] - x, other[1] - y) < self.cell_size:
+						found.append(index)
+		return found
+
+	def insert(self, x: float, y: float, score: float, payload) -> bool:
+		"""
+		Add a candidate, unless a better one is too close to it
+		Worse candidates that are too close to it are dropped
+		:return: Whether the candidate was kept
+		"""
+		near = self.neighbours(x, y)
+		if any(self.items[index][2] >= score for index in near):
+			return False
+		for index in near:
+			other = self.items[index]
+			self.cells[self.cell(other[0], other[1])].remove(index)
+			self.items[index] = None
+		self.cells.setdefault(self.cell(x, y), []).append(len(self.items))
+		self.items.append((x, y, score, payload))
+		return True
+
+	def values(self) -> list:
+		"""
+		:return: Payloads of the kept candidates, in insertion order
+		"""
+		return [item[3] for item in self.items if item is not None]
+
+
+class StorageDetection(NamedTuple):
+	"""
+	Outcome of the storage processing of one frame
+	"""
+	area_found: bool  # Whether the storage zone was found
+	compounds: tuple  # Detected compounds, as (x, y, rot, type) tuples
+	image: np.ndarray | None  # Annotated storage zone, None if it wasn't found
+	timings: tuple  # (stage, seconds) for each stage that ran, see STAGES
+	build: city_map.BuildCheck | None = None  # Verification of the build zone, None if it wasn't found
+
+
+class PipelineContext:
+	"""
+	Intermediate buffers of the processing stages, reused from one frame to the next
+	They are only reallocated when the size of the warped area changes
+	Only buffers private to the pipeline are kept here : an image that leaves it, such as the annotated storage zone,
+	is written to an array of its own
+	"""
+
+	def __init__(self):
+		# (height, width) of the stage buffers
+		self.size = None
+		self.blurred = None
+		self.edges = None
+		self.labels = None
+		# Warped area whose image isn't handed out, such as the build zone
+		self.warped = None
+
+	def fit(self, shape: tuple):
+		"""
+		Make sure the stage buffers can process an image of the given shape
+		"""
+		if self.size != shape[:2]:
+			self.size = shape[:2]
+			self.blurred = np.empty(shape, np.uint8)
+			self.edges = np.empty(self.size, np.uint8)
+			self.labels = np.empty(self.size, np.uint16)
+
+	def warp_buffer(self, shape: tuple) -> np.ndarray:
+		"""
+		:return: Buffer to warp an area into when its image stays in the pipeline, overwritten on the next frame
+		"""
+		if self.warped is None or self.warped.shape != shape:
+			self.warped = np.empty(shape, np.uint8)
+		return self.warped
+
+
+# Buffers of the vision pipeline of a worker process, threads use a context of their own
+pipeline = PipelineContext()
+
+
+class AreaLayout(NamedTuple):
+	"""
+	Area of the table delimited by four Aruco markers
+	"""
+	aruco_id: int  # ID of the markers in its corners
+	dimensions: tuple  # Dimensions between the inner corners of the markers, in mm
+	origin: tuple  # Coordinates in mm corresponding to the top left corner of the warped area
+
+
+storage_layout = AreaLayout(storage_aruco_id, storage_dimensions, camera_origin)
+
+
+class DetectionParameters(NamedTuple):
+	"""
+	Settings of the detection of a cell, sent along with its frames to the worker processes
+	"""
+	storage: AreaLayout
+	build: AreaLayout | None
+	shadow_size: int
+	shadow_intensity: int
+	generation: int  # Calibration.zone_generation
+
 
+class Calibration:
+	"""
+	Calibration of a build cell : the areas its camera looks at, and the Canny thresholds read on the sliders
+	Each cell has its own, worker processes keep a copy of it updated from the DetectionParameters of each frame
+	"""
 
-def init_aruco_crop():
+	def __init__(self, storage: AreaLayout = storage_layout, build: AreaLayout | None = None):
+		"""
+		:param storage: Storage zone, the blocks found in it are sent to the Arduino
+		:param build: Build zone, checked against the city map, None if it isn't configured
+		"""
+		self.storage = storage
+		self.build = build
+		# Each cell has its own detector, the cells are processed concurrently
+		self.areas = AreaRegistry(MarkerDetector(cv2.aruco.DICT_4X4_50))
+		self.storage_zone = self.add_area("storage", storage, lambda warped, context, timings: process_storage(
+			warped, self, context, timings
+		)).zone
+		if build is not None:
+			self.add_area("build", build, lambda warped, context, timings: check_build(
+				warped, self, context, timings
+			), optional=True)
+		# Shadow size and intensity read on the calibration sliders
+		self.shadow_size = 1
+		self.shadow_intensity = 1
+		# Incremented to have the markers of the areas detected again, see invalidate_storage_zone
+		self.zone_generation = 0
+
+	def invalidate_storage_zone(self):
+		"""
+		Have the markers of every area detected again on the next processed frame, in every process
+		"""
+		self.zone_generation += 1
+
+	def add_area(self, name: str, layout: AreaLayout, analyse, optional: bool = False) -> ArucoArea:
+		"""
+		Have another area located and analysed on every frame, with the markers of the other ones
+		:param analyse: Called with the warped area, its buffers and the list of timings, returns its outcome
+		"""
+		zone = StorageZone(self.areas.detector, layout.aruco_id, tuple(layout.dimensions))
+		return self.areas.add(ArucoArea(name, zone, analyse, PipelineContext(), optional))
+
+	def parameters(self) -> DetectionParameters:
+		return DetectionParameters(self.storage, self.build, self.shadow_size, self.shadow_intensity, self.zone_generation)
+
+	def matches(self, parameters: DetectionParameters) -> bool:
+		"""
+		:return: Whether the areas are those described by the parameters
+		"""
+		return (self.storage, self.build) == (parameters.storage, parameters.build)
+
+	def apply(self, parameters: DetectionParameters):
+		"""
+		Take the thresholds of the parameters, the areas are kept
+		"""
+		self.shadow_size, self.shadow_intensity = parameters.shadow_size, parameters.shadow_intensity
+		self.zone_generation = parameters.generation
+
+
+def detect_storage(
+		image: np.ndarray, calibration: Calibration, context: PipelineContext = None, output: np.ndarray = None
+) -> StorageDetection:
 	"""
-	Initialize the ArucoCrop library to handle our storage zone
+	Locate the areas of the cell in a frame, run process_storage on the storage zone and check_build on the build zone
+	:param image: Frame to process, it is only read
+	:param calibration: Calibration of the cell the frame comes from
+	:param context: Buffers to process the storage zone with, `pipeline` by default
+	:param output: Buffer the annotated storage zone is written to, a new array by default
 	"""
-	storage_zone = CallbackArucoArea(
-		name="Storage Zone",
-		aruco_id=10,
-		marker_count=4,
-		process_method=process_storage
-	)
-	AC.init(areas=[storage_zone], debug=True, debug_prefix="[ArucoCrop]")
+	areas = calibration.areas
+	if areas.generation != calibration.zone_generation:
+		areas.generation = calibration.zone_generation
+		areas.invalidate()
+	if context is None:
+		context = pipeline
+	if output is None:
+		output = np.empty(calibration.storage_zone.shape(), np.uint8)
+
+	start = time.perf_counter()
+	areas.locate(image)
+	timings = [("markers", time.perf_counter() - start)]
+	results = areas.process(image, {"storage": (context, output)})
+
+	storage, build = results.get("storage"), results.get("build")
+	if storage is not None:
+		timings.extend(storage.timings)
+	if build is not None:
+		timings.append(("build", sum(seconds for _, seconds in build.timings)))
+		build = build.outcome
+	if storage is None:
+		return StorageDetection(False, (), None, tuple(timings), build)
+	return StorageDetection(True, storage.outcome, storage.image, tuple(timings), build)
 
 
 def detect_markers(_frame: np.ndarray) -> np.ndarray:
@@ -62,29 +279,31 @@ def detect_markers(_frame: np.ndarray) -> np.ndarray:
 	:param _frame: Frame from which we try to find Aruco markers
 	:return: Same frame with markers highlighted
 	"""
-	(_corners, _ids, _rejected) = cv2.aruco.detectMarkers(
-		_frame,
-		cv2.aruco.Dictionary_get(cv2.aruco.DICT_4X4_50),
-		parameters=cv2.aruco.DetectorParameters_create()
-	)
+	(_corners, _ids) = marker_detector.detect(_frame)
 
 	for corners in _corners:
-		corners = corners.astype(np.int0)
+		corners = corners.astype(np.intp)
 		cv2.circle(_frame, tuple(corners[0, 0]), 3, (255, 0, 0), 3)
 
 	return cv2.aruco.drawDetectedMarkers(_frame, _corners, _ids, (0, 255, 0))
 
 
-def canny_find_contours(_frame: np.ndarray, _block_size: int, _intensity: int):
+def canny_find_contours(_frame: np.ndarray, _block_size: int, _intensity: int, context: PipelineContext = None):
 	"""
 	Apply the Canny edge detection algorithm
 	:param _frame: Frame to detect the contours from
 	:param _block_size: Canny threshold 1
 	:param _intensity: Canny threshold 2
+	:param context: Buffers to write the intermediate images to, they are allocated if None
 	:return: Detected contours after the filtering has been performed
 	"""
-	blurred = cv2.GaussianBlur(_frame, (5, 5), 0)
-	canny = cv2.Canny(blurred, _block_size, _intensity)
+	if context is None:
+		blurred = cv2.GaussianBlur(_frame, (5, 5), 0)
+		canny = cv2.Canny(blurred, _block_size, _intensity)
+	else:
+		context.fit(_frame.shape)
+		blurred = cv2.GaussianBlur(_frame, (5, 5), 0, dst=context.blurred)
+		canny = cv2.Canny(blurred, _block_size, _intensity, edges=context.edges)
 	contours, _ = cv2.findContours(canny, cv2.RETR_TREE, cv2.CHAIN_APPROX_SIMPLE)
 	return contours
 
@@ -105,29 +324,28 @@ def calib_show_contours(_frame: np.ndarray, _block_size: int, _intensity: int) -
 	return _frame
 
 
-def process_storage(self: CallbackArucoArea, image, rel_corners):
+def find_blocks(
+		warped: np.ndarray, dimensions: tuple, calibration: Calibration, context: PipelineContext, timings: list = None
+) -> list[tuple]:
 	"""
-	ArucoCrop Storage Process function
-	:param self: Area instance from the ArucoCrop memory
-	:param image: Image that was taken
-	:param rel_corners: Corners of the Aruco markers with the correct ID (here, 10)
-	:return:
+	Detect the blocks in a warped area
+	:param warped: Area, warped so that it is plain, it is only read
+	:param dimensions: Dimensions of the area, in mm
+	:param calibration: Calibration of the cell the area belongs to, for its Canny thresholds
+	:param context: Buffers of the intermediate images
+	:param timings: List the (stage, seconds) of each stage are appended to
+	:return: (box, approx, type) of each block, box being a rotated rectangle as returned by cv2.minAreaRect
 	"""
-	global compounds, last_result, last_count, last_success
+	start = time.perf_counter()
+	height, width = warped.shape[:2]
 
-	# Rotate the image, crop it around the markers and transform it so that the new image is plain
-	width, height, rot, warped = self.rotate_and_crop(image, rel_corners)
-
-	if width <= 0 or height <= 0:
-		print("An error occured")
-		return None
-
-	# Detected Compounds output list, Registered center points
-	compounds, centers_px = [], []
+	# Accepted contours, keyed by their center in mm, only the best one is kept for each block
+	candidates = SpatialHash(BLOCK_SEPARATION)
 	# Compute horizontal and vertical ratio
-	ratio = storage_dimensions[0] / width, storage_dimensions[1] / height
+	ratio = dimensions[0] / width, dimensions[1] / height
 	# Detect contours in the cropped image
-	contours = canny_find_contours(warped, sl_shadow_size, sl_shadow_intensity)
+	contours = canny_find_contours(warped, calibration.shadow_size, calibration.shadow_intensity, context)
+	canny_done = time.perf_counter()
 	# Validate each contour
 	for cnt in contours:
 		approx = cv2.approxPolyDP(cnt, 0.01 * cv2.arcLength(cnt, True), True)
@@ -138,64 +356,164 @@ def process_storage(self: CallbackArucoArea, image, rel_corners):
 
 			# Check surface area and width by height ratios
 			if 20 * 20 * 0.7 <= boxSurfaceMM <= 20 * 20 * 1.7 and 0.65 <= boxW / boxH <= 1.35:
-				dist = math.sqrt(cX ** 2 + cY ** 2)
-				for center in centers_px:
-					# Verify more than 10mm separate each registered contour
-					if abs(dist - center) < 10 * max(ratio[0], ratio[1]):
-						break
-				else:
-					# Get the box's mean color by creating a mask around it
-					rect = cv2.boxPoints(box).astype(np.int0)
-					mask = np.zeros_like(warped)
-					cv2.fillPoly(mask, [rect], (255, 255, 255))
-					mask = cv2.cvtColor(mask, cv2.COLOR_BGR2GRAY)
-
-					if cv2.countNonZero(mask) == 0:
-						continue  # Mask would be all black for some reason
-
-					mean_color = cv2.mean(warped, mask=mask)
-					boxType = type_from_color(mean_color)
-
-					# Correction to try and fix the offset caused by the 2D projection of the scene
-					# This is probably incorrect, and results were decent without correction
-
-					# dx = width / 2 - cX
-					# hx = 29 / ratio[0]
-					# dy = cY - height / 2
-					# hy = 29 / ratio[1]
-					# correction = [0.5 * dx / hx, 3 * dy / hy]
-					correction = [0, 0]
-
-					# Register compound
-					compounds.append(
-						[
-							camera_origin[0] + (cY + correction[1]) * ratio[0],
-							camera_origin[1] - (cX + correction[0]) * ratio[1],
-							rot,
-							boxType
-						]
-					)
-					centers_px.append(dist)
-
-					###
-					# Display the information on screen
-					###
-
-					cv2.circle(warped, (int(cX), int(cY)), 4, (255, 255, 255), -1)
-					cX, cY = int(cX + correction[0]), int(cY + correction[1])
-					# Draw valid contour
-					cv2.drawContours(warped, [approx], -1, (0, 255, 0), 3)
-					# Display its center point
-					cv2.circle(warped, (int(cX), int(cY)), 4, (255, 0, 0), -1)
-					# Display compound infos
-					cv2.putText(warped, "Type : {}".format(boxType), (cX + 2, cY - 15), cv2.FONT_HERSHEY_SIMPLEX, 0.4, (0, 0, 0), 1)
-					cv2.putText(warped, "X : {}px".format(cX), (cX + 2, cY), cv2.FONT_HERSHEY_SIMPLEX, 0.4, (0, 0, 0), 1)
-					cv2.putText(warped, "Y : {}px".format(cY), (cX + 2, cY + 15), cv2.FONT_HERSHEY_SIMPLEX, 0.4, (0, 0, 0), 1)
-					cv2.putText(warped, "Rot : {:.2f}deg".format(rot), (cX + 2, cY + 30), cv2.FONT_HERSHEY_SIMPLEX, 0.4, (0, 0, 0), 1)
-
-	last_count = len(compounds)
-	last_result = warped
-	last_success = True
+				# Both the inner and outer edges of a block are detected, keep the one closest to a 20mm square
+				score = -abs(math.log(boxSurfaceMM / (20 * 20))) - abs(math.log(boxW / boxH))
+				candidates.insert(cX * ratio[0], cY * ratio[1], score, (box, approx))
+
+	boxes = [box for box, _ in candidates.values()]
+	approxes = [approx for _, approx in candidates.values()]
+	contours_done = time.perf_counter()
+
+	# Get the mean color of every box at once, before anything is drawn on the image
+	counts, mean_colors = box_mean_colors(warped, boxes, context.labels)
+	box_types = types_from_colors(mean_colors)
+
+	if timings is not None:
+		timings.extend((
+			("canny", canny_done - start), ("contours", contours_done - canny_done),
+			("colours", time.perf_counter() - contours_done)
+		))
+	# Mask would be all black for some reason when the count is 0
+	return [(box, approx, int(boxType)) for box, approx, count, boxType in zip(boxes, approxes, counts, box_types) if count > 0]
+
+
+def process_storage(warped: np.ndarray, calibration: Calibration, context: PipelineContext, timings: list = None) -> tuple:
+	"""
+	Detect the compounds in the storage zone
+	:param warped: Storage zone, warped so that it is plain, annotations are drawn on it
+	:param calibration: Calibration of the cell the storage zone belongs to
+	:param context: Buffers of the intermediate images
+	:param timings: List the (stage, seconds) of each stage are appended to
+	:return: The detected compounds, as (x, y, rot, type) tuples
+	"""
+	height, width = warped.shape[:2]
+	dimensions = calibration.storage.dimensions
+	ratio = dimensions[0] / width, dimensions[1] / height
+	blocks = find_blocks(warped, dimensions, calibration, context, timings)
+	colours_done = time.perf_counter()
+
+	# Detected Compounds output list
+	compounds = []
+	origin = calibration.storage.origin
+	for box, approx, boxType in blocks:
+		((cX, cY), (boxW, boxH), rot) = box
+
+		# Correction to try and fix the offset caused by the 2D projection of the scene
+		# This is probably incorrect, and results were decent without correction
+
+		# dx = width / 2 - cX
+		# hx = 29 / ratio[0]
+		# dy = cY - height / 2
+		# hy = 29 / ratio[1]
+		# correction = [0.5 * dx / hx, 3 * dy / hy]
+		correction = [0, 0]
+
+		# Register compound
+		compounds.append(
+			(
+				origin[0] + (cY + correction[1]) * ratio[0],
+				origin[1] - (cX + correction[0]) * ratio[1],
+				rot,
+				boxType
+			)
+		)
+
+		###
+		# Display the information on screen
+		###
+
+		cv2.circle(warped, (int(cX), int(cY)), 4, (255, 255, 255), -1)
+		cX, cY = int(cX + correction[0]), int(cY + correction[1])
+		# Draw valid contour
+		cv2.drawContours(warped, [approx], -1, (0, 255, 0), 3)
+		# Display its center point
+		cv2.circle(warped, (int(cX), int(cY)), 4, (255, 0, 0), -1)
+		# Display compound infos
+		cv2.putText(warped, "Type : {}".format(boxType), (cX + 2, cY - 15), cv2.FONT_HERSHEY_SIMPLEX, 0.4, (0, 0, 0), 1)
+		cv2.putText(warped, "X : {}px".format(cX), (cX + 2, cY), cv2.FONT_HERSHEY_SIMPLEX, 0.4, (0, 0, 0), 1)
+		cv2.putText(warped, "Y : {}px".format(cY), (cX + 2, cY + 15), cv2.FONT_HERSHEY_SIMPLEX, 0.4, (0, 0, 0), 1)
+		cv2.putText(warped, "Rot : {:.2f}deg".format(rot), (cX + 2, cY + 30), cv2.FONT_HERSHEY_SIMPLEX, 0.4, (0, 0, 0), 1)
+
+	if timings is not None:
+		timings.append(("annotate", time.perf_counter() - colours_done))
+	return tuple(compounds)
+
+
+def check_build(warped: np.ndarray, calibration: Calibration, context: PipelineContext, timings: list = None) -> city_map.BuildCheck:
+	"""
+	Detect the blocks in the build zone, and check them against the slots of the city map
+	:param warped: Build zone, warped so that it is plain, the misplaced blocks are circled on it
+	:param calibration: Calibration of the cell the build zone belongs to
+	:param context: Buffers of the intermediate images
+	:param timings: List the (stage, seconds) of each stage are appended to
+	"""
+	height, width = warped.shape[:2]
+	dimensions, origin = calibration.build.dimensions, calibration.build.origin
+	ratio = dimensions[0] / width, dimensions[1] / height
+	blocks = find_blocks(warped, dimensions, calibration, context, timings)
+	# Same axes as the storage zone, coordinates in R1'
+	seen = [(origin[0] + cY * ratio[0], origin[1] - cX * ratio[1], rot, boxType) for ((cX, cY), _, rot), _, boxType in blocks]
+	check = city_map.check_build(seen)
+	# Circle the misplaced blocks
+	for (((cX, cY), _, _), _, _), block in zip(blocks, seen):
+		if block in check.misplaced:
+			cv2.circle(warped, (int(cX), int(cY)), round(city_map.UNIT_X_SIZE / ratio[0]), (0, 0, 255), 2)
+	return check
+
+
+def box_mean_colors(image: np.ndarray, boxes: list, labels: np.ndarray = None) -> tuple[np.ndarray, np.ndarray]:
+	"""
+	Compute the mean color inside each box in a single pass :
+	every box is drawn with its own label, then the pixels are summed per label
+	Where boxes overlap, the pixels belong to the last one
+	:param image: BGR image
+	:param boxes: Rotated rectangles, as returned by cv2.minAreaRect
+	:param labels: uint16 buffer the size of the image to draw the labels in, allocated if None
+	:return: The pixel count and the mean BGR color of each box
+	"""
+	if not boxes:
+		return np.zeros(0, np.int64), np.zeros((0, 3))
+	rects = [cv2.boxPoints(box).astype(np.int32) for box in boxes]
+
+	# Only label the part of the image covered by the boxes
+	points = np.concatenate(rects)
+	x0, y0 = np.maximum(points.min(axis=0), 0)
+	x1, y1 = np.minimum(points.max(axis=0) + 1, (image.shape[1], image.shape[0]))
+	if x1 <= x0 or y1 <= y0:
+		return np.zeros(len(boxes), np.int64), np.zeros((len(boxes), 3))
+	roi = image[y0:y1, x0:x1]
+
+	if labels is None:
+		labels = np.zeros(roi.shape[:2], np.uint16)
+	else:
+		labels = labels[y0:y1, x0:x1]
+		labels.fill(0)
+	for label, rect in enumerate(rects, start=1):
+		cv2.fillPoly(labels, [rect - (x0, y0)], label)
+
+	# Only reduce the labelled pixels, label 0 is the background
+	ys, xs = np.nonzero(labels)
+	box_labels = labels[ys, xs] - 1
+	pixels = roi[ys, xs]
+	counts = np.bincount(box_labels, minlength=len(boxes))
+	sums = np.stack([
+		np.bincount(box_labels, weights=pixels[:, channel], minlength=len(boxes))
+		for channel in range(3)
+	], axis=1)
+	return counts, sums / np.maximum(counts, 1)[:, None]
+
+
+def types_from_colors(colors: np.ndarray) -> np.ndarray:
+	"""
+	Retrieve the type of several blocks from their colors, picking the closest color of the palette
+	:param colors: Mean colors of the areas, as an (N, 3) array
+	:return: The corresponding types, as an (N,) array
+	"""
+	types = np.array(list(palette.keys()))
+	references = np.array(list(palette.values()), np.float64)
+	colors = np.asarray(colors, np.float64).reshape(-1, 3)
+	distances = ((colors[:, None, :] - references[None, :, :]) ** 2).sum(axis=2)
+	return types[distances.argmin(axis=1)]
 
 
 def type_from_color(color) -> int:
@@ -207,13 +525,4 @@ def type_from_color(color) -> int:
 	:param color: Mean color of the area
 	:return: The corresponding type
 	"""
-	dist = None
-	RGB_type = None
-	for t, RGB in palette.items():
-		length = ((RGB[0] - color[0])**2 + (RGB[1] - color[1])**2 + (RGB[2] - color[2])**2) ** 0.5
-		if dist is None or length < dist:
-			RGB_type = t
-			dist = length
-	if RGB_type == 0:
-		print(color)
-	return int(RGB_type)
+	return int(types_from_colors(np.array(color[:3]))[0])
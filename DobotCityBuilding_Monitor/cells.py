@@ -0,0 +1,119 @@
+import json
+
+import calibration_profile
+import camera_utils
+
+# Build cells driven by this process : each one has its own camera, storage zone, calibration profile,
+# vision pipeline and Arduino link, and its handlers are addressed through it
+# Example of a configuration file, every key but "id" is optional :
+# [
+#  {"id": 0, "source": 0, "port": "COM5", "profile": "cell0.json"},
+#  {"id": 1, "source": 1, "mac": "98D351FE0B8D", "profile": "cell1.json", "aruco_id": 10,
+#   "build": {"aruco_id": 11, "dimensions": [370, 260], "origin": [20, 360]}}
+# ]
+# "build" describes the build zone like camera_utils.AreaLayout, its dimensions and origin measured on the rig
+# The build zone of a cell without this entry isn't checked
+
+
+class Cell:
+	"""
+	Build cell : a camera looking at a storage zone, and the Arduino driving the Dobots of this zone
+	"""
+
+	def __init__(
+			self, cell_id: int = 0, source=None, port: str = None, mac_addr: str = None, profile: str = None,
+			aruco_id: int = camera_utils.storage_aruco_id, dimensions: tuple = camera_utils.storage_dimensions,
+			origin: tuple = camera_utils.camera_origin, build: camera_utils.AreaLayout | None = None
+	):
+		"""
+		:param source: Camera index, video file or image directory, None for CameraFeedHandler.SOURCE
+		:param port: Serial port or pyserial url of the Arduino link, None to look for the module by its MAC address
+		:param mac_addr: MAC address of the bluetooth module, None for BluetoothHandler.mac_addr
+		:param profile: Calibration profile, None for calibration_profile.DEFAULT_PATH
+		:param aruco_id: ID of the four markers around the storage zone
+		:param dimensions: Dimensions of the storage zone, in mm
+		:param origin: Coordinates in mm corresponding to the top left corner of the storage zone
+		:param build: Build zone checked against the city map, None if it isn't configured
+		"""
+		self.cell_id = cell_id
+		self.source = source
+		self.port = port
+		self.mac_addr = mac_addr
+		self.profile = profile
+		self.calibration = camera_utils.Calibration(camera_utils.AreaLayout(aruco_id, tuple(dimensions), tuple(origin)), build)
+		# HandlerId => handler of this cell
+		self.handlers = {}
+
+	def get(self, hid: int):
+		"""
+		:return: The handler of this cell with the given ID, or None if there isn't any
+		"""
+		return self.handlers.get(hid, None)
+
+	def load_profile(self) -> bool:
+		return calibration_profile.load_profile(self.calibration, self.profile)
+
+	def save_profile(self):
+		calibration_profile.save_profile(self.calibration, self.profile)
+
+	def __str__(self):
+		return "cell {}".format(self.cell_id)
+
+
+# Cell ID => Cell, in configuration order
+cells: dict[int, Cell] = {}
+
+
+def add_cell(cell: Cell) -> Cell:
+	if cell.cell_id in cells:
+		raise ValueError("Cell {} is defined twice".format(cell.cell_id))
+	cells[cell.cell_id] = cell
+	return cell
+
+
+def get_cell(cell_id: int) -> Cell | None:
+	return cells.get(cell_id, None)
+
+
+def default_cell() -> Cell:
+	"""
+	:return: The first cell, created on first use if no cell was configured (single cell setups)
+	"""
+	if not cells:
+		add_cell(Cell())
+	return next(iter(cells.values()))
+
+
+def load_cells(path: str) -> list[Cell]:
+	"""
+	Create the cells described in a configuration file
+	:return: The cells, in the order of the file
+	"""
+	with open(path) as f:
+		config = json.load(f)
+	return [
+		add_cell(Cell(
+			int(entry["id"]), entry.get("source"), entry.get("port"), entry.get("mac"), entry.get("profile"),
+			int(entry.get("aruco_id", camera_utils.storage_aruco_id)),
+			tuple(entry.get("dimensions", camera_utils.storage_dimensions)),
+			tuple(entry.get("origin", camera_utils.camera_origin)),
+			parse_layout(entry.get("build"), camera_utils.build_aruco_id)
+		))
+		for entry in config
+	]
+
+
+def parse_layout(entry: dict | None, aruco_id: int) -> camera_utils.AreaLayout | None:
+	"""
+	:param entry: Area of a configuration file, its dimensions and origin are required
+	:param aruco_id: ID of the markers of the area when the entry doesn't give one
+	:return: The layout of the area, or None if there is no entry
+	"""
+	if entry is None:
+		return None
+	missing = [key for key in ("dimensions", "origin") if key not in entry]
+	if missing:
+		raise ValueError("Area {} has no {}".format(entry, " nor ".join(missing)))
+	return camera_utils.AreaLayout(
+		int(entry.get("aruco_id", aruco_id)), tuple(entry["dimensions"]), tuple(entry["origin"])
+	)
@@ -0,0 +1,103 @@
+import math
+from typing import NamedTuple
+
+# Layout of the city the building Dobot builds, as registered by CityMapHandler::Init on the Arduino
+# Coordinates are in mm, in R1' like those of BuildingSlot.h, and must be kept in sync with the Arduino code
+
+UNIT_X_SIZE = 25
+UNIT_Y_SIZE = 25
+UNIT_Z_SIZE = 20
+
+# Block types, same values as camera_utils.BlockType
+T_HOUSE = 0
+T_BUILDING = 1
+T_CAR = 2
+T_TREE = 3
+
+
+class BuildingSlot(NamedTuple):
+	"""
+	Slot to be built in the city, see BuildingSlot.h
+	"""
+	x: float
+	y: float
+	rot: float  # degrees
+	type: int  # T_* constant
+
+	def dimensions(self) -> tuple[int, int, int]:
+		"""
+		:return: Number of blocks along x, y and z
+		"""
+		if self.type == T_BUILDING:
+			return 1, 2, 3
+		if self.type == T_CAR:
+			return 1, 2, 1
+		return 1, 1, 2
+
+	def positions(self) -> list[tuple[float, float]]:
+		"""
+		Positions the blocks of a level are placed at, as computed by BuildingSlot::GetRealCurrentPosition
+		A block seen from above sits on one of them, whatever its level
+		:return: (x, y) of each position, in mm
+		"""
+		center = self.x + UNIT_X_SIZE / 2, self.y + UNIT_Y_SIZE
+		if self.dimensions()[1] == 1:
+			return [center]
+		# Structures 2 blocks wide alternate between the left and right block
+		rotation = math.radians(90 - self.rot)
+		dx, dy = UNIT_X_SIZE * math.cos(rotation) / 2, UNIT_Y_SIZE * math.sin(rotation) / 2
+		return [(center[0] - dx, center[1] + dy), (center[0] + dx, center[1] - dy)]
+
+
+# Same slots as CityMapHandler::Init, ordered by their distance to the origin of R1' like on the Arduino
+SLOTS = tuple(sorted((
+	BuildingSlot(206.5, 120, 0., T_TREE),
+	BuildingSlot(215.5, 187.5, -52.63, T_CAR),
+	BuildingSlot(137.25, 112.6, -30., T_CAR),
+	BuildingSlot(169.5, 51.2, -30., T_BUILDING),
+	BuildingSlot(156, 217, -45., T_BUILDING),
+	BuildingSlot(47.3, 10, -15., T_HOUSE),
+	BuildingSlot(218.7, 267, 30., T_HOUSE),
+	BuildingSlot(136, 288, 15., T_TREE),
+	BuildingSlot(190.7, 317.7, 0., T_TREE),
+	BuildingSlot(98.6, 25.2, -15., T_CAR),
+), key=lambda slot: int(math.hypot(slot.x, slot.y))))
+
+
+class BuildCheck(NamedTuple):
+	"""
+	Blocks seen in the build zone, checked against the slots of the city
+	"""
+	placed: tuple  # (slot index, position index) of each position a block of the right type was seen on
+	misplaced: tuple  # Blocks that aren't on a position of a slot of their type, as (x, y, rot, type) tuples
+
+	@property
+	def ok(self) -> bool:
+		return not self.misplaced
+
+
+def check_build(blocks, slots: tuple = SLOTS, tolerance: float = UNIT_X_SIZE / 2) -> BuildCheck:
+	"""
+	Match the blocks seen in the build zone with the positions of the slots
+	Slots are built one after the other, positions without any block are expected and not reported
+	:param blocks: (x, y, rot, type) of each block seen, in mm in R1'
+	:param tolerance: Distance from a position, in mm, a block on it may be seen at
+	"""
+	positions = [
+		(index, position, slot.type, x, y)
+		for index, slot in enumerate(slots)
+		for position, (x, y) in enumerate(slot.positions())
+	]
+	placed = set()
+	misplaced = []
+	for block in blocks:
+		x, y, _, block_type = block
+		distance, index, position, slot_type = min(
+			((math.hypot(px - x, py - y), index, position, slot_type) for index, position, slot_type, px, py in positions),
+			default=(math.inf, None, None, None)
+		)
+		if distance <= tolerance and slot_type == block_type:
+			placed.add((index, position))
+		else:
+			misplaced.append(tuple(block))
+	return BuildCheck(tuple(sorted(placed)), tuple(misplaced))
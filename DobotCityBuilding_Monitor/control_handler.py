@@ -0,0 +1,143 @@
+import json
+import socket
+import socketserver
+
+import cells
+from base_handler import *
+
+# Local control socket of the headless mode : one command per line, one JSON answer per line
+# Commands apply to the first cell, unless they start with "cell <id>" (for instance "cell 1 mode 2")
+# cells                       Status of every cell
+# status                      Link state, last processed frame and number of confirmed blocks
+# blocks                      Confirmed blocks, as [x, y, rot, type] lists
+# mode <0|1|2>                Idle, build or unbuild
+# calibrate / confirm         Request the Dobots calibration, then confirm it
+# reset                       Reset the Arduino and home the Dobots
+# resync                      Send every block to the Arduino again
+# redetect                    Detect the markers of the storage zone again
+# quit                        Stop the program
+
+HOST = "127.0.0.1"
+
+
+def send_command(command: str, port: int, timeout: float = 5.) -> dict:
+	"""
+	Send a command to the control socket of a running program
+	:return: The decoded answer
+	"""
+	with socket.create_connection((HOST, port), timeout=timeout) as sock:
+		sock.sendall(bytes(command.strip() + "\n", 'utf-8'))
+		answer = sock.makefile("r", encoding='utf-8').readline()
+	return json.loads(answer) if answer else {"ok": False, "error": "No answer"}
+
+
+class ControlHandler(BaseHandler):
+	"""
+	Serves the control socket, each connection is handled in its own thread
+	"""
+
+	PORT = 5005
+
+	server: socketserver.ThreadingTCPServer = None
+	# Whether the server got to listen, shutting it down otherwise would wait forever
+	serving = False
+	# Set once the quit command was received
+	quit_requested = False
+
+	def init(self):
+		handler = self
+
+		class RequestHandler(socketserver.StreamRequestHandler):
+			def handle(self):
+				for line in self.rfile:
+					command = line.decode('utf-8', errors='replace').strip()
+					if command:
+						self.wfile.write(bytes(json.dumps(handler.execute(command)) + "\n", 'utf-8'))
+
+		self.quit_requested = False
+		self.serving = False
+		self.server = socketserver.ThreadingTCPServer((HOST, self.PORT), RequestHandler, bind_and_activate=False)
+		self.server.allow_reuse_address = True
+		self.server.daemon_threads = True
+
+	def update(self):
+		try:
+			self.server.server_bind()
+			self.server.server_activate()
+		except OSError as e:
+			print("[Control] Unable to listen on port {} : {}".format(self.PORT, e))
+			return
+		print("[Control] Listening on {}:{}".format(HOST, self.PORT))
+		self.serving = True
+		self.server.serve_forever(poll_interval=0.5)
+
+	def stop(self):
+		self.running = False
+		if self.serving:
+			self.server.shutdown()
+		super().stop()
+
+	def stop_actions(self):
+		self.server.server_close()
+
+	def status(self, cell: Cell) -> dict:
+		bluetooth_h = cell.get(HandlerId.BLUETOOTH)
+		vision_h = cell.get(HandlerId.VISION)
+		result = vision_h.latest_result() if vision_h is not None else None
+		return {
+			"ok": True,
+			"cell": cell.cell_id,
+			"online": bluetooth_h is not None and bluetooth_h.online,
+			"frame": result.seq if result else None,
+			"area_found": result.area_found if result else False,
+			"blocks": result.count if result else 0,
+			"latency_ms": round((result.processed_at - result.timestamp) * 1000, 1) if result else None,
+			# Blocks of the build zone that aren't on a slot of their type, as [x, y, type], None if it wasn't found
+			"misplaced": [
+				[round(x, 1), round(y, 1), block_type] for x, y, _, block_type in result.build.misplaced
+			] if result and result.build else None,
+			"dropped": vision_h.dropped if vision_h is not None else 0,
+		}
+
+	def execute(self, command: str) -> dict:
+		"""
+		Run a command received on the control socket
+		:return: The answer, {"ok": False, "error": ...} if the command failed
+		"""
+		words = command.split()
+		cell = self.cell
+		try:
+			if words[0].lower() == "cell":
+				cell = cells.get_cell(int(words[1]))
+				if cell is None:
+					return {"ok": False, "error": "Unknown cell {}".format(words[1])}
+				words = words[2:]
+			bluetooth_h = cell.get(HandlerId.BLUETOOTH)
+			vision_h = cell.get(HandlerId.VISION)
+			result = vision_h.latest_result() if vision_h is not None else None
+			match words[0].lower():
+				case "status":
+					return self.status(cell)
+				case "cells":
+					return {"ok": True, "cells": [self.status(other) for other in cells.cells.values()]}
+				case "blocks":
+					return {"ok": True, "blocks": [list(block) for block in result.blocks] if result else []}
+				case "mode":
+					bluetooth_h.send_mode(int(words[1]))
+				case "calibrate":
+					bluetooth_h.send_calib_request()
+				case "confirm":
+					bluetooth_h.send_calib_confirmation()
+				case "reset":
+					bluetooth_h.send_reset()
+				case "resync":
+					bluetooth_h.resync_storage()
+				case "redetect":
+					cell.calibration.invalidate_storage_zone()
+				case "quit":
+					self.quit_requested = True
+				case _:
+					return {"ok": False, "error": "Unknown command {}".format(words[0])}
+		except (IndexError, ValueError, AttributeError) as e:
+			return {"ok": False, "error": "Invalid command {} : {}".format(command, e)}
+		return {"ok": True}
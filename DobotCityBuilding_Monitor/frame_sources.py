@@ -0,0 +1,246 @@
+import os
+import sys
+import time
+from abc import ABC, abstractmethod
+
+import cv2
+import numpy as np
+
+# Sources of frames for CameraFeedHandler and the offline batch : the live camera of the rig,
+# or a recording (video file or directory of images) replayed at its recorded speed or as fast as possible
+
+IMAGE_EXTENSIONS = (".png", ".jpg", ".jpeg", ".bmp", ".tif", ".tiff")
+
+
+class FrameSource(ABC):
+	"""
+	Provides frames one at a time
+	"""
+
+	# Whether a finite source has no frame left
+	exhausted = False
+
+	@abstractmethod
+	def read(self, image: np.ndarray = None) -> tuple[bool, np.ndarray | None]:
+		"""
+		:param image: Buffer to read the frame into, used if it has the right shape
+		:return: Whether a frame was read, and the frame
+		"""
+		pass
+
+	def delay(self, default: float) -> float:
+		"""
+		:param default: Capture delay of the caller, in seconds
+		:return: Time to wait before reading the next frame, in seconds
+		"""
+		return default
+
+	def reopen(self):
+		"""
+		Called after a failed read, to recover from a disconnection
+		"""
+		pass
+
+	def release(self):
+		pass
+
+	def __str__(self):
+		return type(self).__name__
+
+
+class CameraSource(FrameSource):
+	"""
+	Live camera
+	The frames the driver queued while the caller was busy are grabbed without being decoded,
+	only the newest one is retrieved. After a failure, the camera is opened again with an exponential backoff
+	"""
+
+	# Capture format asked to the driver, None keeps the driver's default, the values actually used are logged
+	BUFFER_SIZE = 1  # Frames queued by the driver (not supported by every backend)
+	RESOLUTION = 1280, 720
+	FPS = 30
+	FOURCC = "MJPG"  # Compressed format, the only way most USB cameras reach their nominal frame rate in HD
+	MAX_DRAIN = 5  # Maximum number of frames grabbed to reach the newest one
+	RECONNECT_DELAY = 0.5  # seconds, first delay between two attempts to open the camera again
+	MAX_RECONNECT_DELAY = 10.  # seconds, the delay doubles after each failed attempt up to this value
+
+	def __init__(self, index: int = 1, backend: int = None):
+		"""
+		:param index: Index of the camera
+		:param backend: OpenCV capture backend, DirectShow on Windows and the default one elsewhere
+		"""
+		self.index = index
+		self.backend = backend if backend is not None else (cv2.CAP_DSHOW if sys.platform == "win32" else cv2.CAP_ANY)
+		# seconds, a grab taking longer than this waited for a new frame rather than reading a queued one
+		self.fresh_grab = 0.5 / self.FPS
+		self.retry_delay = self.RECONNECT_DELAY
+		self.next_retry = 0.
+		# Whether the last read failed
+		self.failing = False
+		self.capture = cv2.VideoCapture(self.index, self.backend)
+		self.configure()
+
+	def configure(self):
+		"""
+		Ask the driver for the capture format, and log the one it actually uses
+		"""
+		if not self.capture.isOpened():
+			return
+		if self.FOURCC is not None:
+			self.capture.set(cv2.CAP_PROP_FOURCC, cv2.VideoWriter_fourcc(*self.FOURCC))
+		if self.RESOLUTION is not None:
+			self.capture.set(cv2.CAP_PROP_FRAME_WIDTH, self.RESOLUTION[0])
+			self.capture.set(cv2.CAP_PROP_FRAME_HEIGHT, self.RESOLUTION[1])
+		if self.FPS is not None:
+			self.capture.set(cv2.CAP_PROP_FPS, self.FPS)
+		if self.BUFFER_SIZE is not None:
+			self.capture.set(cv2.CAP_PROP_BUFFERSIZE, self.BUFFER_SIZE)
+
+		fps = self.capture.get(cv2.CAP_PROP_FPS)
+		if fps > 0:
+			self.fresh_grab = 0.5 / fps
+		fourcc = int(self.capture.get(cv2.CAP_PROP_FOURCC))
+		print("[Camera] Camera {} : {}x{} at {:.0f} fps, format {}, buffer of {} frames".format(
+			self.index, int(self.capture.get(cv2.CAP_PROP_FRAME_WIDTH)), int(self.capture.get(cv2.CAP_PROP_FRAME_HEIGHT)), fps,
+			"".join(chr((fourcc >> 8 * i) & 0xFF) for i in range(4)) if fourcc > 0 else "?",
+			int(self.capture.get(cv2.CAP_PROP_BUFFERSIZE))
+		))
+
+	def read(self, image: np.ndarray = None) -> tuple[bool, np.ndarray | None]:
+		if not self.capture.isOpened():
+			self.failing = True
+			return False, None
+		# Skip the queued frames, until a grab has to wait for the camera
+		grabbed = False
+		for _ in range(self.MAX_DRAIN):
+			start = time.perf_counter()
+			if not self.capture.grab():
+				break
+			grabbed = True
+			if time.perf_counter() - start > self.fresh_grab:
+				break
+		success, frame = self.capture.retrieve(image=image) if grabbed else (False, None)
+		self.failing = not success
+		if success:
+			self.retry_delay = self.RECONNECT_DELAY
+		return success, frame
+
+	def delay(self, default: float) -> float:
+		if self.failing:
+			# Wait for the next reconnection attempt instead of spinning on a missing camera
+			return max(default, self.next_retry - time.monotonic())
+		# The next grab waits for the camera on its own
+		return 0.
+
+	def reopen(self):
+		now = time.monotonic()
+		if now < self.next_retry:
+			return
+		print("[Camera] Opening camera {} again, next attempt in {:.1f}s".format(self.index, self.retry_delay))
+		self.next_retry = now + self.retry_delay
+		self.retry_delay = min(2 * self.retry_delay, self.MAX_RECONNECT_DELAY)
+		self.capture.release()
+		self.capture = cv2.VideoCapture(self.index, self.backend)
+		self.configure()
+
+	def release(self):
+		self.capture.release()
+
+	def __str__(self):
+		return "camera {}".format(self.index)
+
+
+class RecordingSource(FrameSource, ABC):
+	"""
+	Finite source, replayed at the speed it was recorded at or as fast as possible
+	"""
+
+	def __init__(self, fps: float, realtime: bool, loop: bool):
+		"""
+		:param fps: Frame rate of the recording
+		:param realtime: Replay at the recorded speed, otherwise frames are read as fast as they are asked for
+		:param loop: Start over at the end of the recording
+		"""
+		self.fps = fps
+		self.realtime = realtime
+		self.loop = loop
+		self.exhausted = False
+
+	def delay(self, default: float) -> float:
+		return 1 / self.fps if self.realtime else 0.
+
+
+class VideoFileSource(RecordingSource):
+	"""
+	Video file, its frame rate is read from the file
+	"""
+
+	def __init__(self, path: str, realtime: bool = True, loop: bool = False):
+		self.path = path
+		self.capture = cv2.VideoCapture(path)
+		fps = self.capture.get(cv2.CAP_PROP_FPS)
+		super().__init__(fps if fps > 0 else 20., realtime, loop)
+
+	def read(self, image: np.ndarray = None) -> tuple[bool, np.ndarray | None]:
+		if self.exhausted:
+			return False, None
+		success, frame = self.capture.read(image=image)
+		if not success and self.loop:
+			self.capture.set(cv2.CAP_PROP_POS_FRAMES, 0)
+			success, frame = self.capture.read(image=image)
+		if not success:
+			self.exhausted = True
+		return success, frame
+
+	def release(self):
+		self.capture.release()
+
+	def __str__(self):
+		return self.path
+
+
+class ImageDirectorySource(RecordingSource):
+	"""
+	Directory of images, read in the order of their names
+	"""
+
+	def __init__(self, path: str, fps: float = 20., realtime: bool = True, loop: bool = False):
+		super().__init__(fps, realtime, loop)
+		self.path = path
+		self.files = sorted(f for f in os.listdir(path) if f.lower().endswith(IMAGE_EXTENSIONS))
+		self.position = 0
+
+	def read(self, image: np.ndarray = None) -> tuple[bool, np.ndarray | None]:
+		if self.position >= len(self.files) and self.loop:
+			self.position = 0
+		if self.position >= len(self.files):
+			self.exhausted = True
+			return False, None
+		frame = cv2.imread(os.path.join(self.path, self.files[self.position]))
+		self.position += 1
+		if frame is None:
+			return False, None
+		if image is not None and image.shape == frame.shape:
+			np.copyto(image, frame)
+			return True, image
+		return True, frame
+
+	def __str__(self):
+		return self.path
+
+
+def open_source(spec: str | int | None = None, realtime: bool = True, loop: bool = False) -> FrameSource:
+	"""
+	:param spec: Camera index, video file or image directory, None for the camera of the rig
+	:param realtime: For recordings, whether to replay them at their recorded speed
+	:param loop: For recordings, whether to start over once they are over
+	"""
+	if spec is None:
+		return CameraSource()
+	if isinstance(spec, int) or str(spec).isdigit():
+		return CameraSource(int(spec))
+	if os.path.isdir(spec):
+		return ImageDirectorySource(spec, realtime=realtime, loop=loop)
+	if os.path.isfile(spec):
+		return VideoFileSource(spec, realtime=realtime, loop=loop)
+	raise ValueError("Unknown frame source : {}".format(spec))
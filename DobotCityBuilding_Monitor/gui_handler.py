@@ -0,0 +1,140 @@
+from tkinter import *
+from abc import ABC
+
+import cv2
+from PIL import Image as PILImage, ImageTk
+
+from base_handler import *
+
+# Handlers owning a tkinter window, kept apart from base_handler so that the headless mode never loads tkinter nor PIL
+
+
+class TkinterBaseHandler(BaseHandler, ABC):
+	"""
+	Extension of the BaseHandler class so that it adapts to the way
+	tkinter windows work
+	"""
+	window: Tk
+
+	def start(self):
+		self.running = True
+		self.update()
+
+	def stop(self):
+		self.running = False
+		self.stop_actions()
+
+	def stop_actions(self):
+		self.window.destroy()
+
+
+class FrameHoldingBaseHandler(TkinterBaseHandler, ABC):
+	"""
+	Extension to the TkinterBaseHandler class to take care of redondant stuff
+	regarding the display of the camera feed
+	"""
+
+	def get_camera_feed(self):
+		"""
+		Fetch the most recent camera capture from the camera feed thread of the cell
+		"""
+		feed_handler = self.cell.get(HandlerId.CAMERA_FEED)
+		if feed_handler is not None:
+			frame = feed_handler.latest_frame()
+			if frame is not None:
+				return frame.success, frame.image
+		return False, None
+
+	def get_new_frame(self):
+		"""
+		Fetch the most recent camera capture, only if it hasn't been returned by a previous call
+		:return: The new CapturedFrame, or None if no new frame was captured since last time
+		"""
+		feed_handler = self.cell.get(HandlerId.CAMERA_FEED)
+		if feed_handler is None:
+			return None
+		frame = feed_handler.wait_for_frame(self.last_frame_seq, timeout=0)
+		if frame is not None:
+			self.last_frame_seq = frame.seq
+		return frame
+
+	REFRESH_DELAY = 100  # ms, how often should we refresh the camera feed
+
+	img_frame: Frame
+	img_label: Label
+	window: Tk
+
+	window_bg = "#292929"
+
+	# Sequence number of the last frame fetched with get_new_frame
+	last_frame_seq = -1
+
+	# # # DISPLAY BUFFERS # # #
+	# Maximum size of the camera feed shown on screen
+	display_bounds = (0, 0)
+	# Resolution of the last displayed frame, and the size it is shown at
+	display_source = None
+	display_size = None
+	# Reused conversion buffers and Tk image
+	display_buffer = None
+	display_rgb = None
+	display_photo = None
+
+	def init(self):
+		"""
+		Instantiate the tkinter window as well as the frame shown on screen
+		that contains the camera feed
+		"""
+		self.window = Tk()
+		self.window.geometry("500x500")
+		self.window.attributes('-fullscreen', True)
+		self.window.configure(bg=self.window_bg)
+		sw, sh = self.window.winfo_screenwidth(), self.window.winfo_screenheight()
+
+		self.display_bounds = int(0.9 * sw), int(0.9 * sh)
+		self.img_frame = Frame(self.window, width=self.display_bounds[0], height=self.display_bounds[1])
+		self.img_frame.pack()
+		self.img_frame.place(relx=0.5, y=10, anchor='n')
+
+		self.img_label = Label(self.img_frame)
+		self.img_label.pack()
+
+		self.last_frame_seq = -1
+		self.display_source = self.display_size = None
+		self.display_buffer = self.display_rgb = self.display_photo = None
+
+	def save_result(self, result):
+		"""
+		Save the result as out/out.png file
+		Only meant for debugging purposes, use show_result to update the camera feed shown on screen
+		"""
+		cv2.imwrite("out/out.png", result)
+
+	def show_result(self, result):
+		"""
+		Update the camera feed shown on screen to display this new result
+		The BGR frame is converted in memory and downscaled to fit the camera feed frame,
+		and the same Tk image is reused as long as the displayed size doesn't change
+		"""
+		if result is None or result.ndim != 3:
+			return
+		h, w = result.shape[:2]
+		if self.display_source != (w, h):
+			# Compute the displayed size once per source resolution (never upscale the frame)
+			max_w, max_h = self.display_bounds
+			scale = min(1.0, max_w / w, max_h / h)
+			self.display_source = w, h
+			self.display_size = max(1, int(w * scale)), max(1, int(h * scale))
+
+		if self.display_size != (w, h):
+			self.display_buffer = cv2.resize(result, self.display_size, dst=self.display_buffer, interpolation=cv2.INTER_AREA)
+			result = self.display_buffer
+		self.display_rgb = cv2.cvtColor(result, cv2.COLOR_BGR2RGB, dst=self.display_rgb)
+		img = PILImage.frombuffer("RGB", self.display_size, self.display_rgb, "raw", "RGB", 0, 1)
+
+		if self.display_photo is None or (self.display_photo.width(), self.display_photo.height()) != self.display_size:
+			self.display_photo = ImageTk.PhotoImage(img)
+			self.img_label.config(image=self.display_photo)
+		else:
+			# Paste the new pixels into the Tk image that is already displayed
+			self.display_photo.paste(img)
@@ -0,0 +1,173 @@
+import argparse
+import random
+import statistics
+import time
+
+from arduino_emulator import ArduinoEmulator, PtyTransport, SocketTransport
+from async_bluetooth_handler import AsyncBluetoothHandler
+from base_handler import HandlerId
+from bluetooth_handler import BluetoothHandler
+from link_protocol import FORMAT_ASCII, FORMAT_BINARY
+
+# Measures the bluetooth link against an emulated Arduino, for each protocol variant :
+# commands processed per second, acknowledgment round trip times and storage synchronization time
+# Example : python link_benchmark.py --rounds 50 --latency 0.02 --loss 0.01
+
+# Protocol variants : name => (windowed, preferred format)
+VARIANTS = {
+	"stop-and-wait": (False, FORMAT_ASCII),
+	"windowed-ascii": (True, FORMAT_ASCII),
+	"windowed-binary": (True, FORMAT_BINARY),
+}
+
+CELL_SIZE = 30  # mm, compounds are spread on a grid so that they don't overlap
+GRID = (7, 5)  # Cells of the storage zone
+
+
+def generate_scenes(rounds: int, count: int, churn: float, rng: random.Random) -> list[list]:
+	"""
+	Generate successive detections of the storage zone, some compounds move, appear or disappear between two scenes
+	:param rounds: Number of scenes
+	:param count: Number of compounds in each scene
+	:param churn: Fraction of the compounds that change between two scenes
+	"""
+	cells = [(cx, cy) for cx in range(GRID[0]) for cy in range(GRID[1])]
+
+	def place(cell):
+		return [
+			round(cell[0] * CELL_SIZE + CELL_SIZE / 2 + rng.uniform(-8, 8), 2),
+			round(cell[1] * CELL_SIZE + CELL_SIZE / 2 + rng.uniform(-8, 8), 2),
+			round(rng.uniform(0, 90), 2),
+			rng.randrange(4)
+		]
+
+	occupied = rng.sample(cells, count)
+	scene = {cell: place(cell) for cell in occupied}
+	scenes = [list(scene.values())]
+	for _ in range(rounds - 1):
+		for cell in rng.sample(list(scene), max(1, round(count * churn))):
+			if rng.random() < 0.5:
+				# Move the compound within its cell
+				scene[cell] = place(cell)[:2] + scene[cell][2:]
+			else:
+				# Replace it by a compound somewhere else
+				del scene[cell]
+				free = [c for c in cells if c not in scene]
+				new_cell = rng.choice(free)
+				scene[new_cell] = place(new_cell)
+		scenes.append([list(c) for c in scene.values()])
+	return scenes
+
+
+def percentile(values: list, q: float) -> float:
+	if not values:
+		return float("nan")
+	values = sorted(values)
+	return values[min(len(values) - 1, round(q * (len(values) - 1)))]
+
+
+def wait_until(condition, timeout: float, step: float = 0.001) -> bool:
+	end = time.monotonic() + timeout
+	while not condition():
+		if time.monotonic() > end:
+			return False
+		time.sleep(step)
+	return True
+
+
+def run_variant(name: str, scenes: list[list], args) -> dict:
+	"""
+	Synchronize every scene with a fresh emulator, using one protocol variant
+	:return: The measures
+	"""
+	windowed, fmt = VARIANTS[name]
+	transport = PtyTransport() if args.transport == "pty" else SocketTransport()
+	emulator = ArduinoEmulator(
+		transport, baud=args.baud, latency=args.latency, loss=args.loss, corruption=args.corruption,
+		tick_interval=args.tick, windowed=not args.legacy_firmware, seed=args.seed
+	)
+	emulator.start()
+
+	handler = (AsyncBluetoothHandler if args.async_link else BluetoothHandler)(HandlerId.BLUETOOTH)
+	handler.port_url = emulator.url
+	handler.WINDOWED = windowed
+	handler.PREFERRED_FORMAT = fmt
+	handler.start()
+
+	result = {"variant": name, "synced": 0, "sync_times": [], "rtts": []}
+	try:
+		# Wait for the connection and the initial flush
+		if not wait_until(lambda: handler.online and not len(handler.outbound) and not handler.window.in_flight, 10):
+			print("[Benchmark] {} : unable to connect to the emulator".format(name))
+			return result
+
+		handler.window.rtt_samples.clear()
+		processed, frames, errors = emulator.bluetooth.processed, emulator.bluetooth.frames, emulator.bluetooth.errors
+		start = time.monotonic()
+		for scene in scenes:
+			sent_at = time.monotonic()
+			handler.send_blocks(scene)
+			if wait_until(lambda: emulator.holds(scene), args.timeout):
+				result["sync_times"].append(time.monotonic() - sent_at)
+				result["synced"] += 1
+		elapsed = time.monotonic() - start
+
+		result["elapsed"] = elapsed
+		result["commands_per_s"] = (emulator.bluetooth.processed - processed) / elapsed
+		result["frames_per_s"] = (emulator.bluetooth.frames - frames) / elapsed
+		result["errors"] = emulator.bluetooth.errors - errors
+		result["overflowed"] = emulator.overflowed
+		result["rtts"] = list(handler.window.rtt_samples)
+		result["protocol"] = "windowed" if handler.sequenced else "stop-and-wait"
+	finally:
+		handler.stop()
+		handler.disconnect()
+		emulator.stop()
+	return result
+
+
+def report(result: dict, scenes: int):
+	print("\n# # # {} # # #".format(result["variant"].upper()))
+	if "elapsed" not in result:
+		print("Failed")
+		return
+	sync, rtts = result["sync_times"], result["rtts"]
+	print("Negotiated protocol : {}".format(result["protocol"]))
+	print("Scenes synchronized : {} / {} in {:.2f}s".format(result["synced"], scenes, result["elapsed"]))
+	print("Throughput : {:.1f} commands/s, {:.1f} frames/s".format(result["commands_per_s"], result["frames_per_s"]))
+	print("Rejected packets : {}, overflowed bytes : {}".format(result["errors"], result["overflowed"]))
+	if rtts:
+		print("ACK round trip (ms) : p50={:.1f} p90={:.1f} p99={:.1f} max={:.1f} ({} samples)".format(
+			*(percentile(rtts, q) * 1000 for q in (0.5, 0.9, 0.99, 1)), len(rtts)
+		))
+	if sync:
+		print("Storage sync (ms) : mean={:.1f} p50={:.1f} p90={:.1f} max={:.1f}".format(
+			statistics.mean(sync) * 1000, *(percentile(sync, q) * 1000 for q in (0.5, 0.9, 1))
+		))
+
+
+def main():
+	parser = argparse.ArgumentParser(description="Benchmark the bluetooth link against an emulated Arduino")
+	parser.add_argument("--variant", choices=list(VARIANTS), action="append", help="Protocol variants to run (all by default)")
+	parser.add_argument("--rounds", type=int, default=30, help="Number of scenes to synchronize")
+	parser.add_argument("--compounds", type=int, default=12, help="Compounds in each scene")
+	parser.add_argument("--churn", type=float, default=0.25, help="Fraction of the compounds changing between scenes")
+	parser.add_argument("--baud", type=int, default=9600, help="Baud rate of the emulated module (0 to disable the throttling)")
+	parser.add_argument("--latency", type=float, default=0.01, help="One way latency of the link, in seconds")
+	parser.add_argument("--loss", type=float, default=0., help="Probability of losing a chunk of bytes")
+	parser.add_argument("--corruption", type=float, default=0., help="Probability of altering a chunk of bytes")
+	parser.add_argument("--tick", type=float, default=0.005, help="Duration of an Arduino loop iteration, in seconds")
+	parser.add_argument("--timeout", type=float, default=10., help="Time allowed to synchronize a scene, in seconds")
+	parser.add_argument("--transport", choices=("socket", "pty"), default="socket")
+	parser.add_argument("--legacy-firmware", action="store_true", help="Emulate a firmware without the windowed protocol")
+	parser.add_argument("--async-link", action="store_true", help="Drive the link with AsyncBluetoothHandler")
+	parser.add_argument("--seed", type=int, default=0)
+	args = parser.parse_args()
+
+	scenes = generate_scenes(args.rounds, args.compounds, args.churn, random.Random(args.seed))
+	for name in args.variant or VARIANTS:
+		report(run_variant(name, scenes, args), len(scenes))
+
+
+if __name__ == "__main__":
+	main()
@@ -0,0 +1,412 @@
+import re
+import struct
+import time
+from collections import deque
+from typing import NamedTuple
+
+from storage_sync import StorageOp
+
+# Packet Format (see BluetoothHandler.h) :
+# AA - X - AA
+# Header - Payload - Footer
+# The payload is made of hexadecimal characters : command ID, parameters, then a checksum digit
+
+CMD_REMOVE_BLOCK = 0x3
+CMD_UPDATE_BLOCK = 0x4
+CMD_SEQUENCED = 0x7  # Sequence number (2 bytes) followed by any other payload
+CMD_SEQ_ACK = 0x8  # Next expected sequence number (2 bytes), bitmap of the packets received after it (2 bytes)
+CMD_SEQ_RESET = 0x9  # Restart the sequence numbers from 0
+CMD_NEGOTIATE = 0xA  # Wire format (1 byte) to use from now on, also restarts the sequence numbers
+CMD_STATE = 0xB  # ASCII only, answered with the boot id (2 bytes), compounds in storage (1 byte) and mode (4 bits)
+CMD_ACK = 0xF
+
+FORMAT_ASCII = 0
+FORMAT_BINARY = 1
+
+# Binary Frame Format (see BluetoothHandler.h) :
+# A5 - Length - Seq - Command ID - Data - CRC16
+# Length counts the Seq, Command ID and Data bytes, the CRC16 (CCITT) covers the Length up to the end of the Data
+BINARY_SYNC = 0xA5
+BINARY_MAX_FRAME = 64  # The whole frame must fit in the Arduino's software serial buffer
+BINARY_MAX_DATA = BINARY_MAX_FRAME - 6
+COMPOUND_SIZE = 7  # id (1 byte), x (2 bytes), y (2 bytes), rotation and type (2 bytes)
+ROT_STEPS = 40  # Rotation steps per degree in the binary format (12 bits for 0-90 degrees)
+
+SEQ_MODULO = 256  # Sequence numbers are sent as two hexadecimal characters
+SEQ_WINDOW = 8  # Receive window of the Arduino (SEQ_WINDOW in BluetoothHandler.h)
+
+ACK_VALID = "AAF15AA"
+ACK_INVALID = "AAF04AA"
+
+# Frames sent by the Arduino : uppercase header and footer around at least a command ID and a checksum
+FRAME_PATTERN = re.compile("AA([0-9a-fA-F][0-9a-f]*?[0-9])AA")
+
+
+def ascii_checksum(body: str) -> int:
+	"""
+	Sum of all the bits of the hexadecimal characters in the payload (command ID included), mod 10
+	"""
+	return sum(bin(int(letter, base=16)).count("1") for letter in body) % 10
+
+
+def ascii_packet(body: str) -> str:
+	"""
+	Wrap a payload with its checksum, header and footer
+	Payload characters must be lowercase so that they can't be mistaken for the AA footer
+	"""
+	return "AA{}{}AA".format(body, ascii_checksum(body))
+
+
+def sequenced_packet(seq: int, buffer: str) -> str:
+	"""
+	Wrap an existing packet into a sequenced packet
+	:param seq: Sequence number of the packet
+	:param buffer: Packet with its header, checksum and footer
+	"""
+	return ascii_packet("{:x}{:02x}{}".format(CMD_SEQUENCED, seq, buffer[2:-3].lower()))
+
+
+def crc16(data: bytes) -> int:
+	"""
+	CRC-16/CCITT-FALSE (polynomial 0x1021, initial value 0xFFFF)
+	"""
+	crc = 0xFFFF
+	for byte in data:
+		crc ^= byte << 8
+		for _ in range(8):
+			crc = ((crc << 1) ^ 0x1021 if crc & 0x8000 else crc << 1) & 0xFFFF
+	return crc
+
+
+def binary_frame(seq: int, cmd: int, data: bytes = b"") -> bytes:
+	"""
+	Build a binary frame
+	"""
+	body = bytes((len(data) + 2, seq, cmd)) + data
+	return bytes((BINARY_SYNC,)) + body + struct.pack(">H", crc16(body))
+
+
+def pack_compound(cid: int, compound: tuple) -> bytes:
+	"""
+	Pack a compound as fixed-point values : x and y in hundredths of a millimeter,
+	rotation in 1/ROT_STEPS degrees on 12 bits followed by the type on 4 bits
+	"""
+	x, y, rot, t = compound
+	rot = round((rot % 90) * ROT_STEPS) % (90 * ROT_STEPS)
+	return struct.pack(">BHHH", cid, round(x * 100), round(y * 100), (rot << 4) | (int(t) & 0xF))
+
+
+def seq_distance(a: int, b: int) -> int:
+	"""
+	How many sequence numbers separate b from a, in the circular sequence space
+	"""
+	return (b - a) % SEQ_MODULO
+
+
+class OutgoingPacket(NamedTuple):
+	"""
+	Packet waiting to be sent to the Arduino
+	"""
+	buffer: str  # ASCII packet, with its header, checksum and footer
+	# Storage operation carried by this packet, confirmed to the StorageSync once acknowledged
+	op: StorageOp | None = None
+	# Whether the Arduino forgets every compound when processing this packet
+	resets_storage: bool = False
+
+
+class Frame(NamedTuple):
+	"""
+	Frame received from the Arduino
+	"""
+	pid: int
+	body: str  # Payload without the command ID and the checksum, as hexadecimal characters
+	valid: bool  # Whether the checksum is correct
+
+
+class ArduinoState(NamedTuple):
+	"""
+	Answer to a CMD_STATE packet
+	"""
+	boot_id: int  # Drawn at random when the Arduino starts, a new one means the Arduino lost its memory
+	compounds: int  # Compounds in storage
+	mode: int
+
+	@staticmethod
+	def parse(body: str) -> "ArduinoState | None":
+		if len(body) != 7:
+			return None
+		return ArduinoState(int(body[0:4], base=16), int(body[4:6], base=16), int(body[6], base=16))
+
+
+class FrameParser:
+	"""
+	Extracts the frames sent by the Arduino out of the received stream
+	"""
+
+	MAX_BUFFER = 256  # Characters kept while waiting for the end of a frame
+
+	def __init__(self):
+		self.buffer = ""
+
+	def feed(self, data: bytes) -> list[Frame]:
+		"""
+		Add received bytes to the buffer
+		:return: Every complete frame found in the buffer
+		"""
+		self.buffer += data.decode("ascii", errors="replace")
+		frames, end = [], 0
+		for match in FRAME_PATTERN.finditer(self.buffer):
+			payload = match.group(1)
+			frames.append(Frame(
+				int(payload[0], base=16), payload[1:-1], ascii_checksum(payload[:-1]) == int(payload[-1])
+			))
+			end = match.end()
+		self.buffer = self.buffer[end:][-self.MAX_BUFFER:]
+		return frames
+
+	def clear(self):
+		self.buffer = ""
+
+
+class BinaryFrameParser:
+	"""
+	Extracts the binary frames sent by the Arduino out of the received stream
+	"""
+
+	def __init__(self):
+		self.buffer = bytearray()
+
+	def feed(self, data: bytes) -> list[Frame]:
+		"""
+		Add received bytes to the buffer
+		:return: Every complete frame found in the buffer, frames with an invalid CRC are skipped
+		"""
+		self.buffer += data
+		frames = []
+		while True:
+			start = self.buffer.find(BINARY_SYNC)
+			if start < 0:
+				self.buffer.clear()
+				break
+			del self.buffer[:start]
+			if len(self.buffer) < 2:
+				break
+			length = self.buffer[1]
+			if not 2 <= length <= BINARY_MAX_FRAME - 4:
+				del self.buffer[:1]  # Not an actual frame start
+				continue
+			if len(self.buffer) < length + 4:
+				break
+			body = bytes(self.buffer[1:length + 2])
+			if struct.unpack(">H", self.buffer[length + 2:length + 4])[0] != crc16(body):
+				del self.buffer[:1]
+				continue
+			frames.append(Frame(body[2], body[3:].hex(), True))
+			del self.buffer[:length + 4]
+		return frames
+
+	def clear(self):
+		self.buffer.clear()
+
+
+class AsciiCodec:
+	"""
+	Sequenced ASCII packets, one packet per frame
+	"""
+	fmt = FORMAT_ASCII
+
+	@staticmethod
+	def batch_size(packets: list[OutgoingPacket]) -> int:
+		"""
+		:return: How many of the first packets go in the next frame
+		"""
+		return 1
+
+	@staticmethod
+	def encode(seq: int, packets: list[OutgoingPacket]) -> bytes:
+		return bytes(sequenced_packet(seq, packets[0].buffer), 'utf-8')
+
+	@staticmethod
+	def parser():
+		return FrameParser()
+
+
+class BinaryCodec:
+	"""
+	Binary frames, consecutive storage operations of the same kind are batched in a single frame
+	"""
+	fmt = FORMAT_BINARY
+
+	@staticmethod
+	def batch_size(packets: list[OutgoingPacket]) -> int:
+		op = packets[0].op
+		if op is None:
+			return 1
+		removal = op.compound is None
+		limit = BINARY_MAX_DATA // (1 if removal else COMPOUND_SIZE)
+		count = 1
+		while count < min(limit, len(packets)):
+			nxt = packets[count].op
+			if nxt is None or (nxt.compound is None) != removal:
+				break
+			count += 1
+		return count
+
+	@staticmethod
+	def encode(seq: int, packets: list[OutgoingPacket]) -> bytes:
+		op = packets[0].op
+		if op is None:
+			# Control packets keep their command ID, hexadecimal parameters are packed as bytes
+			params = packets[0].buffer[3:-3]
+			data = bytes.fromhex(params.zfill(len(params) + len(params) % 2))
+			return binary_frame(seq, int(packets[0].buffer[2], base=16), data)
+		if op.compound is None:
+			return binary_frame(seq, CMD_REMOVE_BLOCK, bytes(pk.op.cid for pk in packets))
+		return binary_frame(seq, CMD_UPDATE_BLOCK, b"".join(pack_compound(pk.op.cid, pk.op.compound) for pk in packets))
+
+	@staticmethod
+	def parser():
+		return BinaryFrameParser()
+
+
+CODECS = {FORMAT_ASCII: AsciiCodec, FORMAT_BINARY: BinaryCodec}
+
+
+class InFlightPacket:
+	"""
+	Sequenced frame that was sent but not acknowledged yet
+	"""
+
+	def __init__(self, seq: int, packets: list, frame: bytes):
+		self.seq = seq
+		self.packets = packets
+		self.frame = frame
+		self.sent_at = 0.
+		self.transmissions = 0
+
+
+class SenderWindow:
+	"""
+	Sending side of the windowed protocol
+	Several sequenced packets can be in flight at once, acknowledgments are cumulative and selective
+	so that only missing packets get retransmitted
+	"""
+
+	MIN_RTO = 0.15  # seconds, lower bound of the retransmission timeout
+	MAX_RTO = 3.  # seconds, upper bound of the retransmission timeout
+	MAX_TRANSMISSIONS = 5  # The link is considered broken after that many attempts for a single packet
+	RTT_SAMPLES = 1024  # Round trip times kept for statistics
+
+	def __init__(self, size: int = 4, max_bytes: int = 64):
+		"""
+		:param size: Maximum number of packets in flight, can't be larger than the Arduino receive window
+		:param max_bytes: Maximum number of bytes in flight, so that the Arduino serial buffer doesn't overflow
+		"""
+		self.size = min(size, SEQ_WINDOW)
+		self.max_bytes = max_bytes
+		self.next_seq = 0
+		self.in_flight: dict[int, InFlightPacket] = {}
+		# Smoothed round trip time and its variation (None until the first measure)
+		self.srtt = None
+		self.rttvar = 0.
+		self.rtt_samples = deque(maxlen=self.RTT_SAMPLES)
+		# Called with every round trip time measured, in seconds
+		self.on_rtt = None
+
+	def reset(self) -> list:
+		"""
+		Forget every packet in flight and start the sequence numbers over
+		:return: The packets that were in flight, in sending order
+		"""
+		packets = [pk for entry in self.in_flight.values() for pk in entry.packets]
+		self.in_flight.clear()
+		self.next_seq = 0
+		return packets
+
+	def bytes_in_flight(self) -> int:
+		return sum(len(p.frame) for p in self.in_flight.values())
+
+	def can_send(self, frame_length: int) -> bool:
+		"""
+		:param frame_length: Length of the frame to send
+		"""
+		if not self.in_flight:
+			return True  # Always allow one frame, however large
+		return len(self.in_flight) < self.size and self.bytes_in_flight() + frame_length <= self.max_bytes
+
+	def register(self, packets: list, codec) -> InFlightPacket:
+		"""
+		Assign the next sequence number to a frame
+		:param packets: Packets carried by the frame, handed back once it is acknowledged
+		:param codec: Codec used to build the frame
+		"""
+		entry = InFlightPacket(self.next_seq, packets, codec.encode(self.next_seq, packets))
+		self.in_flight[entry.seq] = entry
+		self.next_seq = (self.next_seq + 1) % SEQ_MODULO
+		return entry
+
+	def sent(self, entry: InFlightPacket, now: float = None):
+		"""
+		Called every time a packet is written to the serial port
+		"""
+		entry.sent_at = time.monotonic() if now is None else now
+		entry.transmissions += 1
+
+	def on_ack(self, body: str, now: float = None) -> list:
+		"""
+		Process a selective acknowledgment frame
+		:param body: CMD_SEQ_ACK parameters
+		:return: The packets that were acknowledged by this frame, in sending order
+		"""
+		if len(body) != 4:
+			return []
+		now = time.monotonic() if now is None else now
+		cumulative, bitmap = int(body[:2], base=16), int(body[2:], base=16)
+
+		acked = []
+		for seq, entry in list(self.in_flight.items()):
+			dist = seq_distance(seq, cumulative)
+			ahead = seq_distance(cumulative, seq)
+			if 0 < dist <= SEQ_MODULO // 2 or (0 < ahead < SEQ_WINDOW and (bitmap >> (ahead - 1)) & 1):
+				del self.in_flight[seq]
+				acked.extend(entry.packets)
+				if entry.transmissions == 1:
+					# Karn's algorithm : only measure the round trip of packets that weren't retransmitted
+					self.measure_rtt(now - entry.sent_at)
+		return acked
+
+	def measure_rtt(self, rtt: float):
+		self.rtt_samples.append(rtt)
+		if self.on_rtt is not None:
+			self.on_rtt(rtt)
+		if self.srtt is None:
+			self.srtt, self.rttvar = rtt, rtt / 2
+		else:
+			self.rttvar = 0.75 * self.rttvar + 0.25 * abs(self.srtt - rtt)
+			self.srtt = 0.875 * self.srtt + 0.125 * rtt
+
+	def rto(self) -> float:
+		"""
+		:return: Time after which an unacknowledged packet is sent again
+		"""
+		if self.srtt is None:
+			return self.MAX_RTO
+		return min(self.MAX_RTO, max(self.MIN_RTO, self.srtt + 4 * self.rttvar))
+
+	def due(self, now: float = None, fast: bool = False) -> list[InFlightPacket]:
+		"""
+		:param fast: Retransmit the oldest packet right away (the Arduino reported a corrupted packet)
+		:return: The packets that need to be retransmitted, oldest first
+		"""
+		now = time.monotonic() if now is None else now
+		entries = list(self.in_flight.values())
+		if fast and entries:
+			return entries[:1]
+		rto = self.rto()
+		return [e for e in entries if now - e.sent_at >= rto]
+
+	def broken(self) -> bool:
+		"""
+		:return: Whether a packet was sent too many times without being acknowledged
+		"""
+		return any(e.transmissions >= self.MAX_TRANSMISSIONS for e in self.in_flight.values())
@@ -1,61 +1,154 @@
-from tkinter import Tk
+import argparse
+import json
+import math
+import time
 
+import async_bluetooth_handler
 import bluetooth_handler
-import camera_utils
-import monitor_handler
+import calibration_profile
+import camera_feed_handler
+import cells
+import control_handler
+import metrics_handler
+import vision_pool
+import vision_worker
 from base_handler import HandlerId
 
-import camera_calibration_handler
-import camera_feed_handler
+# The windows are only imported when they are opened, the headless mode never loads tkinter nor PIL
 
+# Camera index, video file or image directory to take the frames from, None for the camera of the rig
+CAMERA_SOURCE = None
+# Number of processes running the vision pipeline, 0 to run it in a thread of this process
+# Frames are then captured in shared memory, so that the processes can read them without copies
+VISION_PROCESSES = 0
 
-MonitorHandler: monitor_handler.MonitorHandler
-CalibrationHandler: camera_calibration_handler.CameraCalibrationHandler
+MonitorHandler = None
+CalibrationHandler = None
+# Build cells driven by this process, the windows show the first one
+Cells = []
 
 
 def StartCameraCalibration():
 	global CalibrationHandler
-	CalibrationHandler = camera_calibration_handler.CameraCalibrationHandler(HandlerId.CALIBRATION)
+	import camera_calibration_handler
+	CalibrationHandler = camera_calibration_handler.CameraCalibrationHandler(HandlerId.CALIBRATION, Cells[0])
 	CalibrationHandler.start()
 	CalibrationHandler.window.mainloop()
 
 
 def StartMonitor():
 	global MonitorHandler
-	MonitorHandler = monitor_handler.MonitorHandler(HandlerId.MONITOR)
+	import monitor_handler
+	monitor_handler.MonitorHandler.SHOW_METRICS = args.overlay
+	MonitorHandler = monitor_handler.MonitorHandler(HandlerId.MONITOR, Cells[0])
 	MonitorHandler.start()
 	MonitorHandler.window.mainloop()
 
 
-# Init ArucoCrop library
-camera_utils.init_aruco_crop()
+def RunWindows():
+	# Every cell is processed by its vision worker, the windows only show the first one
+	# Launch the camera calibration window
+	StartCameraCalibration()
+
+	# Main loop to jump between windows
+	while True:
+		StartMonitor()
+		if MonitorHandler.exit_to_calibration:
+			MonitorHandler.exit_to_calibration = False
+			StartCameraCalibration()
+		else:
+			break
+
+
+def RunHeadless():
+	"""
+	Process the frames and drive the Arduino without any window, until the quit command is received
+	"""
+	control = control_handler.ControlHandler(HandlerId.CONTROL, Cells[0])
+	control.start()
+	try:
+		while not control.quit_requested:
+			time.sleep(0.5)
+	except KeyboardInterrupt:
+		pass
+	control.stop()
+
 
-# Start a Camera Feed
-CameraFeed = camera_feed_handler.CameraFeedHandler(HandlerId.CAMERA_FEED)
-CameraFeed.start()
+def parse_args():
+	parser = argparse.ArgumentParser(description="Monitor the storage zone and drive the Dobots through the Arduino")
+	parser.add_argument("--headless", action="store_true", help="Run without any window, controlled through the control socket")
+	parser.add_argument("--cells", metavar="FILE", help="Configuration of the build cells to drive, see cells.py")
+	parser.add_argument("--profile", default=calibration_profile.DEFAULT_PATH, help="Calibration profile to load and save")
+	parser.add_argument("--source", default=CAMERA_SOURCE, help="Camera index, video file or image directory")
+	parser.add_argument("--processes", type=int, default=VISION_PROCESSES, help="Processes running the vision pipeline")
+	parser.add_argument("--control-port", type=int, default=control_handler.ControlHandler.PORT, help="Port of the control socket")
+	parser.add_argument("--metrics-file", help="File to write the metrics to, in the Prometheus text format")
+	parser.add_argument("--metrics-port", type=int, help="Port to serve the metrics on, at http://127.0.0.1:<port>/metrics")
+	parser.add_argument("--overlay", action="store_true", help="Show the duration of each processing stage in the monitor window")
+	parser.add_argument("--async-link", action="store_true", help="Drive the bluetooth link from an event loop instead of a thread of its own")
+	parser.add_argument("--send", metavar="COMMAND", help="Send a command to a headless monitor already running, and print its answer")
+	return parser.parse_args()
 
-# Try to establish a bluetooth connection
-BluetoothHandler = bluetooth_handler.BluetoothHandler(HandlerId.BLUETOOTH)
-BluetoothHandler.start()
 
-# Launch the camera calibration window
-StartCameraCalibration()
+# Worker processes of the vision pipeline import this module, only the main process runs the program
+if __name__ == "__main__":
+	args = parse_args()
+	control_handler.ControlHandler.PORT = args.control_port
+	if args.send:
+		print(json.dumps(control_handler.send_command(args.send, args.control_port)))
+		raise SystemExit
 
-# Main loop to jump between windows
-while True:
-	StartMonitor()
-	if MonitorHandler.exit_to_calibration:
-		MonitorHandler.exit_to_calibration = False
-		StartCameraCalibration()
+	# --profile and --source are the defaults of the cells that don't name their own
+	calibration_profile.DEFAULT_PATH = args.profile
+	camera_feed_handler.CameraFeedHandler.SOURCE = args.source
+	Cells = cells.load_cells(args.cells) if args.cells is not None else [cells.add_cell(cells.Cell(0))]
+	for cell in Cells:
+		cell.load_profile()
+	if args.processes > 0:
+		# Every cell keeps its share of the processes busy, the processes themselves are shared by the cells
+		in_flight = max(1, math.ceil(args.processes / len(Cells)))
+		camera_feed_handler.CameraFeedHandler.SHARED_MEMORY = True
+		camera_feed_handler.CameraFeedHandler.RING_SIZE = max(camera_feed_handler.CameraFeedHandler.RING_SIZE, in_flight + 2)
+		vision_worker.VisionWorkerHandler.PROCESSES = in_flight
+		if len(Cells) > 1:
+			vision_worker.VisionWorkerHandler.SHARED_POOL = vision_pool.create_pool(args.processes)
+
+	# Export the metrics if asked to
+	Metrics = None
+	if args.metrics_file is not None or args.metrics_port is not None:
+		metrics_handler.MetricsHandler.PATH = args.metrics_file
+		metrics_handler.MetricsHandler.PORT = args.metrics_port
+		Metrics = metrics_handler.MetricsHandler(HandlerId.METRICS)
+		Metrics.start()
+
+	for cell in Cells:
+		# Start a Camera Feed
+		camera_feed_handler.CameraFeedHandler(HandlerId.CAMERA_FEED, cell).start()
+		# Process its frames in the background, for as long as the program runs
+		vision_worker.VisionWorkerHandler(HandlerId.VISION, cell).start()
+
+		# Try to establish a bluetooth connection
+		if args.async_link:
+			async_bluetooth_handler.AsyncBluetoothHandler(HandlerId.BLUETOOTH, cell).start()
+		else:
+			bluetooth_handler.BluetoothHandler(HandlerId.BLUETOOTH, cell).start()
+
+	if args.headless:
+		RunHeadless()
 	else:
-		break
-
-if BluetoothHandler.online:
-	# Go Idle
-	# It doesn't matter if the bluetooth module can't be reached
-	# because after 5 seconds of inactivity, the arduino will stop on its own
-	BluetoothHandler.send_mode(0)
-# Stop other threads
-BluetoothHandler.send_mode(0)
-BluetoothHandler.stop()
-CameraFeed.stop()
+		RunWindows()
+
+	for cell in Cells:
+		cell.get(HandlerId.VISION).stop()
+		BluetoothHandler = cell.get(HandlerId.BLUETOOTH)
+		# Go Idle
+		# It doesn't matter if the bluetooth module can't be reached
+		# because after 5 seconds of inactivity, the arduino will stop on its own
+		BluetoothHandler.send_mode(0)
+		# Stop other threads
+		BluetoothHandler.stop()
+		cell.get(HandlerId.CAMERA_FEED).stop()
+	if vision_worker.VisionWorkerHandler.SHARED_POOL is not None:
+		vision_worker.VisionWorkerHandler.SHARED_POOL.terminate()
+	if Metrics is not None:
+		Metrics.stop()
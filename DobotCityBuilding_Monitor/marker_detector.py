@@ -0,0 +1,75 @@
+import cv2
+import numpy as np
+
+
+class MarkerDetector:
+	"""
+	Aruco marker detection, run on a downscaled level of an image pyramid
+	Corners found on the downscaled image are then refined in small regions of the full resolution image
+	The dictionary and the detection parameters are built once
+	"""
+
+	DETECT_WIDTH = 640  # px, the image is halved as long as it stays at least this wide
+	SUBPIX_CRITERIA = (cv2.TERM_CRITERIA_EPS + cv2.TERM_CRITERIA_MAX_ITER, 30, 0.01)
+
+	def __init__(self, dictionary_id: int):
+		"""
+		:param dictionary_id: Predefined Aruco dictionary, such as cv2.aruco.DICT_4X4_50
+		"""
+		if hasattr(cv2.aruco, "ArucoDetector"):
+			self.dictionary = cv2.aruco.getPredefinedDictionary(dictionary_id)
+			self.parameters = cv2.aruco.DetectorParameters()
+			self.detector = cv2.aruco.ArucoDetector(self.dictionary, self.parameters)
+		else:
+			# OpenCV < 4.7
+			self.dictionary = cv2.aruco.Dictionary_get(dictionary_id)
+			self.parameters = cv2.aruco.DetectorParameters_create()
+			self.detector = None
+
+	def levels(self, width: int) -> int:
+		"""
+		:return: Number of times an image this wide is halved before the detection
+		"""
+		levels = 0
+		while width // 2 >= self.DETECT_WIDTH:
+			width //= 2
+			levels += 1
+		return levels
+
+	def detect(self, image: np.ndarray) -> tuple[tuple, np.ndarray | None]:
+		"""
+		:param image: BGR or grey image
+		:return: Corners and IDs of the detected markers, in the format of cv2.aruco.detectMarkers
+		"""
+		levels = self.levels(image.shape[1])
+		# Converting first is cheaper, the pyramid then only has a single channel to blur
+		grey = cv2.cvtColor(image, cv2.COLOR_BGR2GRAY) if image.ndim == 3 else image
+		small = grey
+		for _ in range(levels):
+			small = cv2.pyrDown(small)
+
+		if self.detector is not None:
+			corners, ids, _ = self.detector.detectMarkers(small)
+		else:
+			corners, ids, _ = cv2.aruco.detectMarkers(small, self.dictionary, parameters=self.parameters)
+		if levels == 0 or ids is None:
+			return corners, ids
+
+		scale = 2 ** levels
+		return tuple(self.refine(grey, marker * scale, scale) for marker in corners), ids
+
+	def refine(self, grey: np.ndarray, marker: np.ndarray, scale: int) -> np.ndarray:
+		"""
+		Refine the corners of a marker in the full resolution image, only the region around the marker is read
+		:param grey: Full resolution grey image
+		:param marker: (1, 4, 2) corners, scaled up to the full resolution
+		:param scale: Downscale factor the corners were found at
+		:return: The refined corners
+		"""
+		window = scale + 2
+		x0, y0 = np.maximum(np.floor(marker[0].min(axis=0)).astype(int) - window - 1, 0)
+		x1, y1 = np.ceil(marker[0].max(axis=0)).astype(int) + window + 2
+		roi = grey[y0:y1, x0:x1]
+		points = (marker.reshape(4, 1, 2) - (x0, y0)).astype(np.float32)
+		cv2.cornerSubPix(roi, points, (window, window), (-1, -1), self.SUBPIX_CRITERIA)
+		return (points + (x0, y0)).reshape(1, 4, 2)
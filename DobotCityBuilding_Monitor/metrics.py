@@ -0,0 +1,227 @@
+import bisect
+import time
+from threading import Lock
+
+import numpy as np
+
+# Lightweight metrics of the hot paths, exported in the Prometheus text format by MetricsHandler
+# Recording a sample only costs a bisection and a few additions under a lock, nothing is allocated
+
+# Upper bounds of the histogram buckets, in seconds
+DEFAULT_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1., 2.5)
+
+
+def format_labels(labels: dict) -> str:
+	if not labels:
+		return ""
+	return "{" + ",".join('{}="{}"'.format(key, value) for key, value in sorted(labels.items())) + "}"
+
+
+class Counter:
+	"""
+	Value that only ever increases
+	"""
+
+	TYPE = "counter"
+
+	def __init__(self, name: str, help_text: str, labels: dict):
+		self.name = name
+		self.help = help_text
+		self.labels = labels
+		self.value = 0
+		self.lock = Lock()
+
+	def inc(self, amount: int = 1):
+		with self.lock:
+			self.value += amount
+
+	def lines(self) -> list[str]:
+		return ["{}{} {}".format(self.name, format_labels(self.labels), self.value)]
+
+
+class Gauge:
+	"""
+	Value that goes up and down, either set or read from a function when exported
+	"""
+
+	TYPE = "gauge"
+
+	def __init__(self, name: str, help_text: str, labels: dict, read=None):
+		"""
+		:param read: Called without arguments when exported, None if the value is set
+		"""
+		self.name = name
+		self.help = help_text
+		self.labels = labels
+		self.read = read
+		self.value = 0
+
+	def set(self, value: float):
+		self.value = value
+
+	def get(self) -> float:
+		if self.read is None:
+			return self.value
+		try:
+			return self.read()
+		except Exception:
+			return float("nan")
+
+	def lines(self) -> list[str]:
+		return ["{}{} {}".format(self.name, format_labels(self.labels), self.get())]
+
+
+class Histogram:
+	"""
+	Durations counted in fixed buckets since the start of the program
+	The last RECENT samples are also kept in a ring buffer, to compute the percentiles of the recent activity
+	"""
+
+	TYPE = "histogram"
+	RECENT = 512
+
+	def __init__(self, name: str, help_text: str, labels: dict, buckets: tuple = DEFAULT_BUCKETS):
+		self.name = name
+		self.help = help_text
+		self.labels = labels
+		self.bounds = tuple(buckets)
+		# Samples in each bucket, the last one is +Inf
+		self.buckets = [0] * (len(self.bounds) + 1)
+		self.sum = 0.
+		self.count = 0
+		self.recent = np.zeros(self.RECENT)
+		self.lock = Lock()
+
+	def observe(self, seconds: float):
+		index = bisect.bisect_left(self.bounds, seconds)
+		with self.lock:
+			self.buckets[index] += 1
+			self.recent[self.count % self.RECENT] = seconds
+			self.sum += seconds
+			self.count += 1
+
+	def time(self):
+		"""
+		:return: Context manager observing the time spent in its block
+		"""
+		return Timer(self)
+
+	def percentile(self, q: float) -> float | None:
+		"""
+		:param q: Percentile, between 0 and 100
+		:return: The percentile of the recent samples, in seconds, or None if nothing was observed
+		"""
+		with self.lock:
+			samples = self.recent[:min(self.count, self.RECENT)].copy()
+		if len(samples) == 0:
+			return None
+		return float(np.percentile(samples, q))
+
+	def lines(self) -> list[str]:
+		with self.lock:
+			buckets, total, count = list(self.buckets), self.sum, self.count
+		lines = []
+		cumulated = 0
+		for bound, samples in zip(self.bounds + ("+Inf",), buckets):
+			cumulated += samples
+			lines.append("{}_bucket{} {}".format(self.name, format_labels(dict(self.labels, le=bound)), cumulated))
+		lines.append("{}_sum{} {}".format(self.name, format_labels(self.labels), total))
+		lines.append("{}_count{} {}".format(self.name, format_labels(self.labels), count))
+		return lines
+
+
+class Timer:
+	def __init__(self, histogram: Histogram):
+		self.histogram = histogram
+		self.start = 0.
+
+	def __enter__(self):
+		self.start = time.perf_counter()
+		return self
+
+	def __exit__(self, *args):
+		self.histogram.observe(time.perf_counter() - self.start)
+
+
+# (name, labels) => metric, every metric of this process
+registry = {}
+registry_lock = Lock()
+
+
+def get_metric(cls, name: str, help_text: str, labels: dict, **kwargs):
+	key = name, tuple(sorted(labels.items()))
+	with registry_lock:
+		metric = registry.get(key)
+		if metric is None:
+			metric = registry[key] = cls(name, help_text, labels, **kwargs)
+	return metric
+
+
+def counter(name: str, help_text: str = "", **labels) -> Counter:
+	"""
+	:return: The counter of this name and labels, created on first use
+	"""
+	return get_metric(Counter, name, help_text, labels)
+
+
+def gauge(name: str, help_text: str = "", read=None, **labels) -> Gauge:
+	"""
+	:param read: Function giving the value when exported, replaces the one of an existing gauge
+	:return: The gauge of this name and labels, created on first use
+	"""
+	metric = get_metric(Gauge, name, help_text, labels)
+	if read is not None:
+		metric.read = read
+	return metric
+
+
+def histogram(name: str, help_text: str = "", **labels) -> Histogram:
+	"""
+	:return: The histogram of this name and labels, created on first use
+	"""
+	return get_metric(Histogram, name, help_text, labels)
+
+
+def histograms(name: str, **labels) -> list[Histogram]:
+	"""
+	:param labels: Labels the histograms must have, the other ones can have any value
+	:return: Every histogram of this name with these labels, in creation order
+	"""
+	with registry_lock:
+		return [
+			metric for (metric_name, _), metric in registry.items()
+			if metric_name == name and isinstance(metric, Histogram) and labels.items() <= metric.labels.items()
+		]
+
+
+def render() -> str:
+	"""
+	:return: Every metric, in the Prometheus text exposition format
+	"""
+	with registry_lock:
+		metrics = list(registry.values())
+	lines = []
+	described = set()
+	for metric in sorted(metrics, key=lambda m: m.name):
+		if metric.name not in described:
+			described.add(metric.name)
+			if metric.help:
+				lines.append("# HELP {} {}".format(metric.name, metric.help))
+			lines.append("# TYPE {} {}".format(metric.name, metric.TYPE))
+		lines.extend(metric.lines())
+	return "\n".join(lines) + "\n"
+
+
+def summary(name: str, label: str = None, title: str = "", **labels) -> str:
+	"""
+	One line per histogram of a name, with the median and 95th percentile of its recent samples, in ms
+	:param label: Label telling the histograms apart, shown at the start of their line
+	:param title: Shown instead when there is no such label
+	:param labels: Only summarize the histograms with these labels
+	"""
+	lines = []
+	for metric in histograms(name, **labels):
+		p50, p95 = metric.percentile(50), metric.percentile(95)
+		if p50 is not None:
+			lines.append("{:<10} {:7.2f} {:7.2f}".format(metric.labels.get(label, title), p50 * 1000, p95 * 1000))
+	return "\n".join(lines)
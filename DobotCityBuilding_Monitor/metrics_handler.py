@@ -0,0 +1,77 @@
+import os
+import time
+from http.server import BaseHTTPRequestHandler, HTTPServer
+
+import metrics
+from base_handler import *
+
+# Export of the metrics : written to a file in the Prometheus text format (for instance for the textfile
+# collector of node_exporter), and/or served on http://127.0.0.1:<PORT>/metrics
+
+
+class MetricsHandler(BaseHandler):
+	"""
+	Exports the metrics of this process every EXPORT_INTERVAL seconds, and serves them on demand
+	"""
+
+	EXPORT_INTERVAL = 5.  # seconds, how often the file is written
+	# File to write the metrics to, None to disable
+	PATH = None
+	# Port of the HTTP endpoint on localhost, None to disable
+	PORT = None
+
+	server: HTTPServer = None
+	last_export = 0.
+
+	def init(self):
+		class RequestHandler(BaseHTTPRequestHandler):
+			def do_GET(self):
+				if self.path not in ("/", "/metrics"):
+					self.send_error(404)
+					return
+				body = bytes(metrics.render(), 'utf-8')
+				self.send_response(200)
+				self.send_header("Content-Type", "text/plain; version=0.0.4")
+				self.send_header("Content-Length", str(len(body)))
+				self.end_headers()
+				self.wfile.write(body)
+
+			def log_message(self, *args):
+				pass
+
+		self.server = None
+		self.last_export = 0.
+		if self.PORT is not None:
+			try:
+				self.server = HTTPServer(("127.0.0.1", self.PORT), RequestHandler)
+				self.server.timeout = 0.5
+				print("[Metrics] Serving on http://127.0.0.1:{}/metrics".format(self.PORT))
+			except OSError as e:
+				print("[Metrics] Unable to listen on port {} : {}".format(self.PORT, e))
+
+	def update(self):
+		while self.running:
+			if self.PATH is not None and time.monotonic() - self.last_export >= self.EXPORT_INTERVAL:
+				self.export(self.PATH)
+			if self.server is not None:
+				self.server.handle_request()
+			else:
+				time.sleep(0.5)
+
+	def export(self, path: str):
+		"""
+		Write the metrics to a file, replaced at once so that readers never see it half written
+		"""
+		self.last_export = time.monotonic()
+		try:
+			with open(path + ".tmp", "w") as f:
+				f.write(metrics.render())
+			os.replace(path + ".tmp", path)
+		except OSError as e:
+			print("[Metrics] Unable to write {} : {}".format(path, e))
+
+	def stop_actions(self):
+		if self.PATH is not None:
+			self.export(self.PATH)
+		if self.server is not None:
+			self.server.server_close()
@@ -1,12 +1,12 @@
+import time
 from tkinter import *
 from PIL import Image as PilImage, ImageTk
 
-import ArucoCrop.CV2_ArucoCrop
-
 import bluetooth_handler
-import camera_utils
-from base_handler import *
+import metrics
+from gui_handler import *
 from camera_feed_handler import CameraFeedHandler
+from vision_worker import VisionResult, VisionWorkerHandler
 
 
 class MonitorHandler(FrameHoldingBaseHandler):
@@ -37,11 +37,23 @@ class MonitorHandler(FrameHoldingBaseHandler):
 	info_text: Label
 	info_embed = "[INFO]\n\n{}"
 
+	# Show the median and 95th percentile of the duration of each stage over the camera feed
+	SHOW_METRICS = False
+	METRICS_REFRESH = 1.  # seconds
+	metrics_text: Label = None
+	last_metrics_refresh = 0.
+
 	# # # Handlers # # #
 	bluetooth_h: bluetooth_handler.BluetoothHandler
+	vision_h: VisionWorkerHandler
+
+	# Last result published by the vision worker, set on its thread and rendered on the next update
+	latest_result: VisionResult = None
+	# Sequence number of the frame of the last displayed result
+	last_result_seq = -1
 
-	def __init__(self, hid: int):
-		super().__init__(hid)
+	def __init__(self, hid: int, cell: Cell = None):
+		super().__init__(hid, cell)
 
 	def init(self):
 		"""
@@ -49,14 +61,16 @@ class MonitorHandler(FrameHoldingBaseHandler):
 		"""
 		super().init()
 
-		# 1 second between each image processing,
-		# Can be taken down if some kind of result filtering is added
-		# and detected blocks are only transmitted once every x seconds
-		# Otherwise it will result in an overflow of the communication
-		self.REFRESH_DELAY = 1000
+		# Frames are processed by the vision worker, the window only renders its results
+		self.REFRESH_DELAY = CameraFeedHandler.CAPTURE_DELAY
+		self.last_result_seq = -1
 
-		# Retrieve a reference to the Bluetooth handler
-		self.bluetooth_h = BaseHandler.handlers[HandlerId.BLUETOOTH]
+		# Retrieve a reference to the Bluetooth handler of the cell
+		self.bluetooth_h = self.cell.get(HandlerId.BLUETOOTH)
+		# Render the results of the vision worker of the cell while this window is open
+		self.vision_h = self.cell.get(HandlerId.VISION)
+		self.latest_result = self.vision_h.latest_result()
+		self.vision_h.results.subscribe(self.result_published)
 
 		# Retrieve Metrics
 		screen_width = self.window.winfo_screenwidth()
@@ -79,6 +93,12 @@ class MonitorHandler(FrameHoldingBaseHandler):
 		self.set_info("Aucune information à afficher actuellement", "#000000")
 		self.info_text.place(relx=0.5, rely=0.6, anchor='n')
 
+		self.metrics_text = None
+		self.last_metrics_refresh = 0.
+		if self.SHOW_METRICS:
+			self.metrics_text = Label(self.window, font=('Courier', 10), justify=LEFT, anchor=NW, bg=self.window_bg)
+			self.metrics_text.place(relx=0.99, rely=0.01, anchor=NE)
+
 		# Create bluetooth error frame
 		self.conn_err_frame = Frame(self.window, width=0.8*screen_width, height=0.6*screen_height, bg="#d5c9a0")
 
@@ -131,30 +151,31 @@ class MonitorHandler(FrameHoldingBaseHandler):
 					continue
 				self.btnImages[i][j] = ImageTk.PhotoImage(img.resize((self.btn_width, int(self.btn_width * img.height/img.width))))
 
+	def result_published(self, result: VisionResult):
+		"""
+		Called on the vision thread with every new result
+		"""
+		self.latest_result = result
+
 	def update(self):
 		if self.running:
-			# Camera Feed
-			success, feed = self.get_camera_feed()
-			if feed is not None:
-				if success:
-					# Capture successful, process the last frame with ArucoCrop and camera_utils.process_storage
-					ArucoCrop.CV2_ArucoCrop.process_frame(feed)
-					# Send results over bluetooth
-					BaseHandler.handlers[HandlerId.BLUETOOTH].send_blocks(camera_utils.compounds)
-					result = camera_utils.last_result
-					if result is None:
-						result = feed
-					if not camera_utils.last_success:
-						self.set_info("Erreur lors de la détection de la zone de stockage...", "#aa0000")
-					else:
-						self.set_info("Détection de {} cubes lors de la dernière capture...".format(camera_utils.last_count), "#00aa00")
-					camera_utils.last_success = False
-				else:
-					# Clear the Arduino memory of the last detected compounds
-					BaseHandler.handlers[HandlerId.BLUETOOTH].send_blocks([])
-					result = feed
-
-				self.save_result(result)
+			# Last vision result
+			result = self.latest_result
+			if result is not None and result.seq != self.last_result_seq:
+				self.last_result_seq = result.seq
+				if result.success and not result.area_found:
+					self.set_info("Erreur lors de la détection de la zone de stockage...", "#aa0000")
+				elif result.build is not None and result.build.misplaced:
+					self.set_info("{} cubes mal placés dans la ville !".format(len(result.build.misplaced)), "#cc6600")
+				elif result.success:
+					self.set_info("Détection de {} cubes lors de la dernière capture... ({} ms)".format(
+						result.count, round((result.processed_at - result.timestamp) * 1000)
+					), "#00aa00")
+				self.show_result(result.image)
+
+			if self.metrics_text is not None and time.monotonic() - self.last_metrics_refresh >= self.METRICS_REFRESH:
+				self.last_metrics_refresh = time.monotonic()
+				self.show_metrics()
 
 			# Display Bluetooth Status
 			if self.bluetooth_h.online:
@@ -166,6 +187,16 @@ class MonitorHandler(FrameHoldingBaseHandler):
 
 		self.window.after(self.REFRESH_DELAY, self.update)
 
+	def show_metrics(self):
+		sections = [
+			metrics.summary("camera_capture_seconds", title="capture"),
+			metrics.summary("vision_stage_seconds", "stage"),
+			metrics.summary("vision_latency_seconds", title="latency"),
+			metrics.summary("link_stage_seconds", "stage", cell=self.cell.cell_id),
+		]
+		text = "\n".join(section for section in sections if section)
+		self.metrics_text.config(text="{:<10} {:>7} {:>7} ms\n{}".format("", "p50", "p95", text))
+
 	def enable_buttons(self):
 		for bid, btn in enumerate(self.btnInstances):
 			if bid != self.B_QUIT:
@@ -229,5 +260,6 @@ class MonitorHandler(FrameHoldingBaseHandler):
 		self.info_text.config(text=self.info_embed.format(text), fg=fg)
 
 	def stop_actions(self):
+		self.vision_h.results.unsubscribe(self.result_published)
 		super().stop_actions()
 		self.bluetooth_h.send_mode(0)
@@ -0,0 +1,117 @@
+import argparse
+import multiprocessing
+import os
+import time
+
+import numpy as np
+
+import camera_utils
+from block_tracker import BlockTracker
+from frame_sources import open_source
+
+# Runs the detection pipeline over recordings (video files or image directories) as fast as possible,
+# one recording per worker process, and writes the detections of each recording in a columnar .npz file :
+# - one row per frame : frame, area_found, detected, confirmed, locate_ms, process_ms
+# - one row per detected compound : compound_frame, x, y, rot, type
+# Example : python offline_batch.py recordings/run1.mp4 recordings/run2 --out detections --canny 40 120
+
+
+def process_recording(path: str, output: str, canny: tuple[int, int]) -> dict:
+	"""
+	Run the detection on every frame of a recording
+	:param path: Video file or image directory
+	:param output: .npz file to write the detections to
+	:param canny: Canny thresholds
+	:return: Summary of the run
+	"""
+	# Worker processes are reused from one recording to the next, each recording has its storage zone detected again
+	calibration = camera_utils.Calibration()
+	calibration.shadow_size, calibration.shadow_intensity = canny
+	source = open_source(path, realtime=False)
+	context = camera_utils.PipelineContext()
+	tracker = BlockTracker()
+
+	frames = {"frame": [], "area_found": [], "detected": [], "confirmed": [], "locate_ms": [], "process_ms": []}
+	compounds = {"compound_frame": [], "x": [], "y": [], "rot": [], "type": []}
+	start = time.perf_counter()
+	index = -1
+	image = None
+	while not source.exhausted:
+		success, image = source.read(image)
+		index += 1
+		if not success:
+			continue
+		detection = camera_utils.detect_storage(image, calibration, context)
+		if detection.area_found:
+			tracker.update(detection.compounds)
+		timings = dict(detection.timings)
+		frames["frame"].append(index)
+		frames["area_found"].append(detection.area_found)
+		frames["detected"].append(len(detection.compounds))
+		frames["confirmed"].append(len(tracker.blocks()))
+		locate = sum(timings.get(stage, 0.) for stage in camera_utils.LOCATE_STAGES)
+		frames["locate_ms"].append(locate * 1000)
+		frames["process_ms"].append((sum(timings.values()) - locate) * 1000)
+		for x, y, rot, block_type in detection.compounds:
+			compounds["compound_frame"].append(index)
+			compounds["x"].append(x)
+			compounds["y"].append(y)
+			compounds["rot"].append(rot)
+			compounds["type"].append(block_type)
+	elapsed = time.perf_counter() - start
+	source.release()
+
+	np.savez_compressed(
+		output,
+		frame=np.array(frames["frame"], np.int32),
+		area_found=np.array(frames["area_found"], bool),
+		detected=np.array(frames["detected"], np.int16),
+		confirmed=np.array(frames["confirmed"], np.int16),
+		locate_ms=np.array(frames["locate_ms"], np.float32),
+		process_ms=np.array(frames["process_ms"], np.float32),
+		compound_frame=np.array(compounds["compound_frame"], np.int32),
+		x=np.array(compounds["x"], np.float32),
+		y=np.array(compounds["y"], np.float32),
+		rot=np.array(compounds["rot"], np.float32),
+		type=np.array(compounds["type"], np.int8),
+	)
+	return {
+		"path": path, "output": output, "frames": len(frames["frame"]), "found": int(sum(frames["area_found"])),
+		"detections": len(compounds["x"]), "elapsed": elapsed
+	}
+
+
+def run_batch(args: tuple) -> dict:
+	return process_recording(*args)
+
+
+def main():
+	parser = argparse.ArgumentParser(description="Run the detection on recordings, in parallel, and save the detections")
+	parser.add_argument("recordings", nargs="+", help="Video files or image directories")
+	parser.add_argument("--out", default="detections", help="Directory to write the .npz files to")
+	parser.add_argument("--processes", type=int, default=os.cpu_count(), help="Number of worker processes")
+	parser.add_argument("--canny", type=int, nargs=2, default=(1, 1),
+						help="Canny thresholds (shadow size and intensity)")
+	args = parser.parse_args()
+
+	os.makedirs(args.out, exist_ok=True)
+	jobs = []
+	for i, path in enumerate(args.recordings):
+		name = os.path.splitext(os.path.basename(os.path.normpath(path)))[0]
+		jobs.append((path, os.path.join(args.out, "{:03d}_{}.npz".format(i, name)), tuple(args.canny)))
+
+	start = time.perf_counter()
+	frames = 0
+	with multiprocessing.get_context("spawn").Pool(max(1, min(args.processes, len(jobs)))) as pool:
+		for summary in pool.imap_unordered(run_batch, jobs):
+			frames += summary["frames"]
+			print("[Batch] {} : {} frames ({} with the zone found), {} detections in {:.1f}s ({:.1f} frames/s) => {}".format(
+				summary["path"], summary["frames"], summary["found"], summary["detections"], summary["elapsed"],
+				summary["frames"] / summary["elapsed"] if summary["elapsed"] else 0, summary["output"]
+			))
+	elapsed = time.perf_counter() - start
+	print("[Batch] {} recordings, {} frames in {:.1f}s ({:.1f} frames/s)".format(len(jobs), frames, elapsed, frames / elapsed))
+
+
+if __name__ == "__main__":
+	main()
@@ -0,0 +1,117 @@
+import enum
+from collections import deque
+from threading import Condition
+
+
+class Priority(enum.IntEnum):
+	"""
+	Lower values are sent first
+	"""
+	CONTROL = 0  # Reset, mode and calibration commands
+	PRESENCE = 1  # Presence checks
+	STORAGE = 2  # Detected compounds
+
+
+class OutboundQueue:
+	"""
+	Bounded, thread-safe queue of items waiting to be sent over bluetooth
+	Items with a coalescing key replace the unsent item queued with the same key
+	"""
+
+	MAX_ITEMS = 32  # Per priority, the oldest item is dropped once the limit is reached
+
+	def __init__(self):
+		self.condition = Condition()
+		self.queues = {priority: deque() for priority in Priority}
+		# Coalescing key => (priority, item) currently queued
+		self.keyed = {}
+		# Set by wake, ends the current or next wait even if there is nothing to send
+		self.woken = False
+
+	def put(self, item, priority: Priority, key: str = None):
+		"""
+		Queue an item, and wake the sender up
+		:param item: Item to send
+		:param priority: Items of a lower priority are only sent once every item of higher priority was
+		:param key: Coalescing key, an unsent item queued with the same key is dropped in favor of this one
+		"""
+		with self.condition:
+			if key is not None and key in self.keyed:
+				old_priority, old_item = self.keyed.pop(key)
+				self.remove(old_priority, old_item)
+			queue = self.queues[priority]
+			if len(queue) >= self.MAX_ITEMS:
+				print("[Bluetooth] Outbound queue full, dropping {}".format(queue[0][0]))
+				self.forget(queue.popleft()[1])
+			queue.append((item, key))
+			if key is not None:
+				self.keyed[key] = priority, item
+			self.condition.notify_all()
+
+	def push_front(self, items: list, priority: Priority):
+		"""
+		Put back items that couldn't be sent, they keep their place ahead of the queue
+		"""
+		with self.condition:
+			self.queues[priority].extendleft((item, None) for item in reversed(items))
+			self.condition.notify_all()
+
+	def pop(self, max_priority: Priority = Priority.STORAGE):
+		"""
+		:param max_priority: Lowest priority to consider
+		:return: The next item to send, or None if there isn't any
+		"""
+		with self.condition:
+			for priority in Priority:
+				if priority > max_priority:
+					break
+				if self.queues[priority]:
+					item, key = self.queues[priority].popleft()
+					self.forget(key)
+					return item
+		return None
+
+	def wait(self, timeout: float = None) -> bool:
+		"""
+		Sleep until an item is queued, wake is called, or the timeout expires
+		:return: Whether there is an item to send
+		"""
+		with self.condition:
+			self.condition.wait_for(lambda: self.woken or len(self) > 0, timeout)
+			self.woken = False
+			return len(self) > 0
+
+	def wake(self):
+		"""
+		Wake the sender up even if there is nothing to send (for instance to stop it)
+		"""
+		with self.condition:
+			self.woken = True
+			self.condition.notify_all()
+
+	def has(self, key: str) -> bool:
+		"""
+		:return: Whether an item with this coalescing key is queued
+		"""
+		with self.condition:
+			return key in self.keyed
+
+	def clear(self, priority: Priority):
+		with self.condition:
+			for item, key in self.queues[priority]:
+				self.forget(key)
+			self.queues[priority].clear()
+
+	def remove(self, priority: Priority, item):
+		queue = self.queues[priority]
+		for i, (queued, _) in enumerate(queue):
+			if queued is item:
+				del queue[i]
+				return
+
+	def forget(self, key: str | None):
+		if key is not None:
+			self.keyed.pop(key, None)
+
+	def __len__(self):
+		return sum(len(queue) for queue in self.queues.values())
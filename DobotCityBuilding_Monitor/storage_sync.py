@@ -0,0 +1,112 @@
+import math
+from typing import NamedTuple
+
+
+class StorageOp(NamedTuple):
+	"""
+	A single change to apply to the Arduino's compound storage
+	"""
+	generation: int  # StorageSync generation the operation was computed in
+	cid: int  # Stable compound id
+	compound: tuple | None  # (x, y, rot, type) to set, None to remove the compound
+
+
+class StorageSync:
+	"""
+	Keeps track of the compounds the Arduino has acknowledged,
+	so that only added, removed and moved blocks need to be sent over bluetooth
+	"""
+
+	MATCH_DISTANCE = 10  # mm, a detection this close to a known compound of the same type is the same block
+	MOVE_TOLERANCE = 1.5  # mm, smaller moves are considered detection noise
+	ROT_TOLERANCE = 2  # degrees, smaller rotations are considered detection noise
+	MAX_COMPOUNDS = 28  # Storage capacity of the Arduino (COMPOUND_COUNT in CityMapHandler.h)
+	MAX_IDS = 255  # Ids are sent as two hexadecimal characters, 0xFF is COMPOUND_NO_ID on the Arduino
+
+	def __init__(self):
+		# Compounds the Arduino acknowledged, by id
+		self.acked = {}
+		# Compounds the Arduino will hold once every queued operation is acknowledged, by id
+		self.expected = {}
+		# Incremented every time the Arduino memory is flushed, so that late acks of older operations are ignored
+		self.generation = 0
+
+	def reset(self):
+		"""
+		Forget everything about the Arduino storage (it is expected to be flushed right after)
+		"""
+		self.acked.clear()
+		self.expected.clear()
+		self.generation += 1
+
+	def diff(self, compounds) -> list[StorageOp]:
+		"""
+		Compute the operations needed for the Arduino storage to match the detected compounds
+		The returned operations are considered queued: following calls are computed against them
+		:param compounds: Detected compounds, as [x, y, rot, type] lists
+		:return: Operations to send, removals first so that ids and slots are freed before additions
+		"""
+		detected = [(float(c[0]), float(c[1]), float(c[2]) % 90, int(c[3])) for c in compounds]
+
+		# Greedily match each detection with the closest known compound of the same type
+		pairs = []
+		for cid, known in self.expected.items():
+			for i, data in enumerate(detected):
+				if data[3] != known[3]:
+					continue
+				dist = math.hypot(data[0] - known[0], data[1] - known[1])
+				if dist < self.MATCH_DISTANCE:
+					pairs.append((dist, cid, i))
+		pairs.sort()
+
+		matches = {}
+		matched = set()
+		for dist, cid, i in pairs:
+			if cid not in matches and i not in matched:
+				matches[cid] = i
+				matched.add(i)
+
+		removals, updates = [], []
+		for cid, known in list(self.expected.items()):
+			if cid not in matches:
+				removals.append(StorageOp(self.generation, cid, None))
+				del self.expected[cid]
+			elif self.has_moved(known, detected[matches[cid]]):
+				self.expected[cid] = detected[matches[cid]]
+				updates.append(StorageOp(self.generation, cid, self.expected[cid]))
+
+		for i, data in enumerate(detected):
+			if i in matched or len(self.expected) >= self.MAX_COMPOUNDS:
+				continue
+			cid = self.free_id()
+			self.expected[cid] = data
+			updates.append(StorageOp(self.generation, cid, data))
+
+		return removals + updates
+
+	def acknowledge(self, op: StorageOp):
+		"""
+		Called once the Arduino acknowledged an operation
+		"""
+		if op.generation != self.generation:
+			return
+		if op.compound is None:
+			self.acked.pop(op.cid, None)
+		else:
+			self.acked[op.cid] = op.compound
+
+	def free_id(self) -> int:
+		"""
+		:return: The smallest id that isn't used by any known compound, never COMPOUND_NO_ID (0xFF)
+		"""
+		for cid in range(self.MAX_IDS):
+			if cid not in self.expected and cid not in self.acked:
+				return cid
+		raise OverflowError("No compound id left")
+
+	def has_moved(self, known: tuple, detected: tuple) -> bool:
+		rot_diff = abs(known[2] - detected[2]) % 90
+		return (
+			math.hypot(known[0] - detected[0], known[1] - detected[1]) > self.MOVE_TOLERANCE
+			or min(rot_diff, 90 - rot_diff) > self.ROT_TOLERANCE
+		)
@@ -0,0 +1,165 @@
+import time
+
+import cv2
+import numpy as np
+
+from marker_detector import MarkerDetector
+
+# Geometry of the warped zone :
+# - it spans the inner corners of the four markers, those closest to the center of the zone
+# - the corners are ordered clockwise from the top left one of the frame, and the first side is made the longest :
+#   a zone seen in landscape keeps its top left corner, a zone seen in portrait starts at its top right corner
+#   (a zone turned upside down in the frame is read from the opposite corner, the camera is expected to stay put)
+# - the warped image has PX_PER_MM pixels per mm, its columns run along dimensions[0] and its rows along dimensions[1]
+# process_storage converts a pixel (cX, cY) of the warped image to the coordinates of the storage Dobot (R0) with
+# x = origin[0] + cY / PX_PER_MM and y = origin[1] - cX / PX_PER_MM, as it did with the crop of ArucoCrop :
+# the x axis of R0 runs down the warped image, and its y axis from right to left
+
+
+def order_corners(points: np.ndarray) -> np.ndarray:
+	"""
+	Order four points clockwise, starting from the top left one
+	The first side is made the longest one, so that the zone is always seen in landscape
+	:param points: (4, 2) array
+	:return: The ordered points, as a (4, 2) float32 array
+	"""
+	center = points.mean(axis=0)
+	points = points[np.argsort(np.arctan2(points[:, 1] - center[1], points[:, 0] - center[0]))]
+	points = np.roll(points, -int(np.argmin(points.sum(axis=1))), axis=0)
+	if np.linalg.norm(points[1] - points[0]) < np.linalg.norm(points[2] - points[1]):
+		points = np.roll(points, -1, axis=0)
+	return points.astype(np.float32)
+
+
+class StorageZone:
+	"""
+	Zone delimited by four Aruco markers sharing the same ID, warped into a plain image
+	The camera and the zone are bolted down : the transform found by a full marker detection is kept
+	and reused on the following frames, until the markers don't look the same anymore where they were found
+	Zones watched by the same camera are located together by an AreaRegistry, from a single marker detection
+	"""
+
+	MARKER_COUNT = 4
+	PX_PER_MM = 3  # Resolution of the warped image
+	REDETECT_INTERVAL = 5.  # seconds, the markers are detected again at least this often
+	DRIFT_MARGIN = 4  # px, margin around the markers compared by the drift check
+	DRIFT_THRESHOLD = 30  # Mean grey level difference above which a marker is considered to have moved
+
+	def __init__(self, detector: MarkerDetector, aruco_id: int, dimensions: tuple[float, float]):
+		"""
+		:param detector: Detector of the markers
+		:param aruco_id: ID of the markers in the corners of the zone
+		:param dimensions: Dimensions of the zone between the inner corners of the markers, in mm
+		"""
+		self.detector = detector
+		self.aruco_id = aruco_id
+		self.dimensions = dimensions
+		self.size = round(dimensions[0] * self.PX_PER_MM), round(dimensions[1] * self.PX_PER_MM)
+		# Inner corners of the markers in the frame, clockwise from the top left one
+		self.corners = None
+		# Frame to warped image perspective transform, None when the markers have to be detected
+		self.transform = None
+		# (x0, y0, x1, y1, grey patch) around each marker, as it was when the markers were detected
+		self.references = []
+		# Grey conversion of the frame, reused by every detection
+		self.grey = None
+		self.detected_at = 0.
+		# Number of full detections and of frames warped with a cached transform
+		self.detections = 0
+		self.reuses = 0
+		# seconds, time spent checking or detecting the markers during the last crop
+		self.locate_time = 0.
+
+	def invalidate(self):
+		"""
+		Detect the markers again on the next frame
+		"""
+		self.transform = None
+
+	def shape(self) -> tuple[int, int, int]:
+		"""
+		:return: Shape of the warped zone
+		"""
+		return self.size[1], self.size[0], 3
+
+	def crop(self, image: np.ndarray, output: np.ndarray = None) -> np.ndarray | None:
+		"""
+		:param image: BGR frame
+		:param output: Buffer to warp the zone into, of the shape given by shape()
+		:return: The warped zone, or None if it couldn't be found
+		"""
+		start = time.perf_counter()
+		found = self.reuse(image) or self.detect(image)
+		self.locate_time = time.perf_counter() - start
+		return self.warp(image, output) if found else None
+
+	def warp(self, image: np.ndarray, output: np.ndarray = None) -> np.ndarray:
+		"""
+		Warp the zone with the current transform, it must have been located on this frame
+		"""
+		return cv2.warpPerspective(image, self.transform, self.size, dst=output)
+
+	def reuse(self, image: np.ndarray) -> bool:
+		"""
+		:return: Whether the cached transform still holds for this frame, the markers don't have to be detected
+		"""
+		if (
+			self.transform is not None
+			and time.monotonic() - self.detected_at < self.REDETECT_INTERVAL
+			and not self.has_drifted(image)
+		):
+			self.reuses += 1
+			return True
+		return False
+
+	def detect(self, image: np.ndarray) -> bool:
+		"""
+		Run a full marker detection, and compute the transform from it
+		:return: Whether the four markers were found
+		"""
+		grey = self.grey = cv2.cvtColor(image, cv2.COLOR_BGR2GRAY, dst=self.grey)
+		(_corners, _ids) = self.detector.detect(grey)
+		return self.locate(_corners, _ids, grey)
+
+	def locate(self, _corners: tuple, _ids: np.ndarray | None, grey: np.ndarray) -> bool:
+		"""
+		Compute the transform from the markers detected in a frame, they may be shared with other zones
+		:param _corners: Corners of the detected markers, in the format of cv2.aruco.detectMarkers
+		:param _ids: IDs of the detected markers
+		:param grey: Grey conversion of the frame, the patches of the drift check are taken from it
+		:return: Whether the four markers of this zone were found
+		"""
+		self.invalidate()
+		self.detections += 1
+		if _ids is None:
+			return False
+		markers = [corners.reshape(4, 2) for corners, marker_id in zip(_corners, _ids.flatten()) if marker_id == self.aruco_id]
+		if len(markers) != self.MARKER_COUNT:
+			return False
+
+		# The zone lies between the markers, keep the corner of each marker closest to its center
+		center = np.mean([marker.mean(axis=0) for marker in markers], axis=0)
+		inner = np.array([marker[np.argmin(np.linalg.norm(marker - center, axis=1))] for marker in markers])
+		self.corners = order_corners(inner)
+
+		w, h = self.size
+		target = np.array([[0, 0], [w - 1, 0], [w - 1, h - 1], [0, h - 1]], np.float32)
+		self.transform = cv2.getPerspectiveTransform(self.corners, target)
+		self.detected_at = time.monotonic()
+
+		self.references = []
+		for marker in markers:
+			x0, y0 = np.maximum(np.floor(marker.min(axis=0)).astype(int) - self.DRIFT_MARGIN, 0)
+			x1, y1 = np.ceil(marker.max(axis=0)).astype(int) + self.DRIFT_MARGIN + 1
+			self.references.append((x0, y0, x1, y1, grey[y0:y1, x0:x1].copy()))
+		return True
+
+	def has_drifted(self, image: np.ndarray) -> bool:
+		"""
+		Cheap check of the cached transform : the patches around the markers are compared with those of the detection
+		"""
+		for x0, y0, x1, y1, reference in self.references:
+			patch = cv2.cvtColor(image[y0:y1, x0:x1], cv2.COLOR_BGR2GRAY)
+			if patch.shape != reference.shape or cv2.absdiff(patch, reference).mean() > self.DRIFT_THRESHOLD:
+				return True
+		return False
@@ -0,0 +1,7 @@
+import os
+import sys
+
+# The modules of the monitor import each other by name and load their resources relative to its directory
+MONITOR_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, MONITOR_DIR)
+os.chdir(MONITOR_DIR)
@@ -0,0 +1,71 @@
+import cv2
+import numpy as np
+import pytest
+
+from camera_utils import BlockType, box_mean_colors, palette, type_from_color, types_from_colors
+
+
+def masked_mean(image: np.ndarray, box) -> tuple[int, np.ndarray]:
+	"""
+	Pixel count and mean color of a box, computed with one mask per box
+	"""
+	mask = np.zeros(image.shape[:2], np.uint8)
+	cv2.fillPoly(mask, [cv2.boxPoints(box).astype(np.int32)], 255)
+	return cv2.countNonZero(mask), np.array(cv2.mean(image, mask=mask)[:3])
+
+
+@pytest.fixture
+def image() -> np.ndarray:
+	return np.random.default_rng(0).integers(0, 256, (120, 160, 3), np.uint8)
+
+
+def test_matches_one_mask_per_box(image):
+	boxes = [((30, 30), (20, 20), 0), ((80, 60), (24, 18), 30), ((130, 90), (20, 22), 75)]
+	counts, colors = box_mean_colors(image, boxes)
+	for box, count, color in zip(boxes, counts, colors):
+		expected_count, expected_color = masked_mean(image, box)
+		assert count == expected_count
+		assert color == pytest.approx(expected_color)
+
+
+def test_reused_label_buffer(image):
+	boxes = [((30, 30), (20, 20), 0), ((80, 60), (24, 18), 30)]
+	labels = np.full(image.shape[:2], 7, np.uint16)
+	counts, colors = box_mean_colors(image, boxes, labels)
+	expected_counts, expected_colors = box_mean_colors(image, boxes)
+	assert np.array_equal(counts, expected_counts)
+	assert colors == pytest.approx(expected_colors)
+
+
+def test_overlapping_pixels_belong_to_the_last_box():
+	image = np.zeros((60, 60, 3), np.uint8)
+	image[:, 30:] = 200
+	counts, colors = box_mean_colors(image, [((30, 30), (40, 20), 0), ((45, 30), (10, 20), 0)])
+	# The second box, fully on the bright half, takes its pixels from the first one
+	assert colors[1] == pytest.approx((200, 200, 200))
+	assert counts[0] + counts[1] == masked_mean(image, ((30, 30), (40, 20), 0))[0]
+
+
+def test_boxes_outside_of_the_image():
+	image = np.full((40, 40, 3), 50, np.uint8)
+	counts, colors = box_mean_colors(image, [((-30, -30), (10, 10), 0), ((20, 20), (10, 10), 0)])
+	assert counts[0] == 0
+	assert colors[1] == pytest.approx((50, 50, 50))
+	counts, colors = box_mean_colors(image, [((100, 100), (10, 10), 0)])
+	assert counts.tolist() == [0] and colors.shape == (1, 3)
+
+
+def test_no_boxes(image):
+	counts, colors = box_mean_colors(image, [])
+	assert counts.shape == (0,) and colors.shape == (0, 3)
+
+
+def test_palette_colors_give_their_type():
+	colors = np.array(list(palette.values()), np.float64)
+	assert types_from_colors(colors).tolist() == list(palette.keys())
+
+
+def test_closest_palette_color_wins():
+	colors = [(30, 40, 180), (20, 160, 150), (200, 40, 30), (40, 200, 60)]
+	assert types_from_colors(colors).tolist() == [BlockType.House, BlockType.Building, BlockType.Car, BlockType.Tree]
+	assert type_from_color((200, 40, 30, 0)) == BlockType.Car
@@ -0,0 +1,94 @@
+import pytest
+
+from block_tracker import BlockTracker, rotation_delta
+
+
+def feed(tracker: BlockTracker, detections: list, frames: int) -> list[bool]:
+	"""
+	:return: Whether each frame changed the confirmed blocks
+	"""
+	return [tracker.update(detections) for _ in range(frames)]
+
+
+def test_rotation_delta_wraps_every_quarter_turn():
+	assert rotation_delta(10, 20) == 10
+	assert rotation_delta(85, 5) == 10
+	assert rotation_delta(5, 85) == -10
+	assert rotation_delta(0, 90) == 0
+
+
+def test_block_is_confirmed_after_a_few_frames():
+	tracker = BlockTracker()
+	changes = feed(tracker, [[100, 50, 10, 2]], BlockTracker.CONFIRM_FRAMES)
+	assert changes == [False] * (BlockTracker.CONFIRM_FRAMES - 1) + [True]
+	assert tracker.blocks() == [[100, 50, 10, 2]]
+	assert not tracker.update([[100, 50, 10, 2]])
+
+
+def test_flickering_detection_is_never_reported():
+	tracker = BlockTracker()
+	for _ in range(10):
+		assert not tracker.update([[100, 50, 0, 1]])
+		assert not tracker.update([])
+	assert tracker.blocks() == []
+
+
+def test_confirmed_block_survives_short_gaps():
+	tracker = BlockTracker()
+	feed(tracker, [[100, 50, 0, 1]], BlockTracker.CONFIRM_FRAMES)
+	assert feed(tracker, [], BlockTracker.DROP_FRAMES - 1) == [False] * (BlockTracker.DROP_FRAMES - 1)
+	assert not tracker.update([[100, 50, 0, 1]])
+	assert len(tracker.blocks()) == 1
+
+
+def test_missing_block_is_dropped():
+	tracker = BlockTracker()
+	feed(tracker, [[100, 50, 0, 1]], BlockTracker.CONFIRM_FRAMES)
+	changes = feed(tracker, [], BlockTracker.DROP_FRAMES)
+	assert changes == [False] * (BlockTracker.DROP_FRAMES - 1) + [True]
+	assert tracker.blocks() == []
+
+
+def test_position_is_smoothed_and_small_moves_ignored():
+	tracker = BlockTracker()
+	feed(tracker, [[100, 50, 0, 1]], BlockTracker.CONFIRM_FRAMES)
+	assert not tracker.update([[101, 50, 0, 1]])
+	assert tracker.blocks()[0][0] == pytest.approx(100 + BlockTracker.SMOOTHING)
+	# The smoothed position eventually moves past the tolerance
+	assert any(feed(tracker, [[105, 50, 0, 1]], 5))
+	assert tracker.blocks()[0][0] > 103
+
+
+def test_rotation_is_smoothed_across_the_wrap():
+	tracker = BlockTracker()
+	feed(tracker, [[100, 50, 88, 1]], BlockTracker.CONFIRM_FRAMES)
+	tracker.update([[100, 50, 8, 1]])
+	assert tracker.blocks()[0][2] == pytest.approx((88 + BlockTracker.SMOOTHING * 10) % 90)
+
+
+def test_type_is_voted():
+	tracker = BlockTracker()
+	feed(tracker, [[100, 50, 0, 1]], BlockTracker.CONFIRM_FRAMES)
+	# A single misclassified frame doesn't change the type
+	assert not tracker.update([[100, 50, 0, 3]])
+	assert tracker.blocks()[0][3] == 1
+	changes = feed(tracker, [[100, 50, 0, 3]], 3)
+	assert changes == [False, True, False]
+	assert tracker.blocks()[0][3] == 3
+
+
+def test_detections_go_to_the_closest_block():
+	tracker = BlockTracker()
+	feed(tracker, [[100, 50, 0, 1], [110, 50, 0, 2]], BlockTracker.CONFIRM_FRAMES)
+	tracker.update([[111, 50, 0, 2], [101, 50, 0, 1]])
+	assert [block[3] for block in tracker.blocks()] == [1, 2]
+	assert tracker.blocks()[0][0] == pytest.approx(100 + BlockTracker.SMOOTHING)
+
+
+def test_distant_detection_is_a_new_block():
+	tracker = BlockTracker()
+	feed(tracker, [[100, 50, 0, 1]], BlockTracker.CONFIRM_FRAMES)
+	far = 100 + BlockTracker.MATCH_DISTANCE + 1
+	changes = feed(tracker, [[far, 50, 0, 1]], BlockTracker.CONFIRM_FRAMES)
+	assert changes[-1]
+	assert [block[0] for block in tracker.blocks()] == [100, far]
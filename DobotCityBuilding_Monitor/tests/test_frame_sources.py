@@ -0,0 +1,97 @@
+import cv2
+import numpy as np
+import pytest
+
+from frame_sources import ImageDirectorySource, VideoFileSource, open_source
+
+
+def shade(frame: np.ndarray) -> int:
+	return int(frame[0, 0, 0])
+
+
+@pytest.fixture
+def image_directory(tmp_path):
+	"""
+	Three frames of increasing shade, written out of order, and a file that isn't an image
+	"""
+	for name, value in (("frame_2.png", 100), ("frame_0.png", 0), ("frame_1.png", 50)):
+		cv2.imwrite(str(tmp_path / name), np.full((48, 64, 3), value, np.uint8))
+	(tmp_path / "notes.txt").write_text("not a frame")
+	return tmp_path
+
+
+@pytest.fixture
+def video_file(tmp_path):
+	"""
+	Five frames of increasing shade at 12 fps
+	"""
+	path = str(tmp_path / "recording.avi")
+	writer = cv2.VideoWriter(path, cv2.VideoWriter_fourcc(*"MJPG"), 12, (64, 48))
+	if not writer.isOpened():
+		pytest.skip("No video encoder available")
+	for i in range(5):
+		writer.write(np.full((48, 64, 3), i * 50, np.uint8))
+	writer.release()
+	return path
+
+
+def test_images_are_read_in_name_order(image_directory):
+	source = ImageDirectorySource(str(image_directory), realtime=False)
+	assert source.files == ["frame_0.png", "frame_1.png", "frame_2.png"]
+	assert [shade(source.read()[1]) for _ in range(3)] == [0, 50, 100]
+	assert not source.exhausted
+	assert source.read() == (False, None)
+	assert source.exhausted
+
+
+def test_images_fill_the_given_buffer(image_directory):
+	source = ImageDirectorySource(str(image_directory))
+	buffer = np.empty((48, 64, 3), np.uint8)
+	success, frame = source.read(buffer)
+	assert success and frame is buffer
+	# A buffer of another shape is ignored
+	success, frame = source.read(np.empty((10, 10, 3), np.uint8))
+	assert success and frame.shape == (48, 64, 3) and shade(frame) == 50
+
+
+def test_images_loop(image_directory):
+	source = ImageDirectorySource(str(image_directory), loop=True)
+	assert [shade(source.read()[1]) for _ in range(7)] == [0, 50, 100, 0, 50, 100, 0]
+	assert not source.exhausted
+
+
+def test_video_is_read_until_its_end(video_file):
+	source = VideoFileSource(video_file, realtime=False)
+	assert source.fps == 12
+	shades = [shade(source.read()[1]) for _ in range(5)]
+	# Shades only move a little through the compression
+	assert shades == pytest.approx([0, 50, 100, 150, 200], abs=5)
+	assert source.read()[0] is False and source.exhausted
+	# Nothing is read once exhausted
+	assert source.read() == (False, None)
+	source.release()
+
+
+def test_video_loops(video_file):
+	source = VideoFileSource(video_file, loop=True)
+	shades = [shade(source.read()[1]) for _ in range(7)]
+	assert shades == pytest.approx([0, 50, 100, 150, 200, 0, 50], abs=5)
+	assert not source.exhausted
+	source.release()
+
+
+def test_replay_speed(image_directory, video_file):
+	assert ImageDirectorySource(str(image_directory), fps=25).delay(1.) == pytest.approx(1 / 25)
+	assert ImageDirectorySource(str(image_directory), realtime=False).delay(1.) == 0
+	assert VideoFileSource(video_file).delay(1.) == pytest.approx(1 / 12)
+	assert VideoFileSource(video_file, realtime=False).delay(1.) == 0
+
+
+def test_open_source(image_directory, video_file):
+	source = open_source(str(image_directory), realtime=False, loop=True)
+	assert isinstance(source, ImageDirectorySource) and not source.realtime and source.loop
+	source = open_source(video_file)
+	assert isinstance(source, VideoFileSource) and source.realtime and not source.loop
+	source.release()
+	with pytest.raises(ValueError):
+		open_source(str(image_directory / "missing.avi"))
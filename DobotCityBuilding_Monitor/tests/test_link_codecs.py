@@ -0,0 +1,113 @@
+import struct
+
+from link_protocol import (
+	BINARY_MAX_DATA, BINARY_SYNC, BinaryCodec, BinaryFrameParser, CMD_REMOVE_BLOCK, CMD_SEQ_ACK, CMD_UPDATE_BLOCK,
+	COMPOUND_SIZE, FrameParser, OutgoingPacket, ROT_STEPS, ascii_checksum, ascii_packet, binary_frame, crc16,
+	pack_compound
+)
+from storage_sync import StorageOp
+
+
+def update(cid: int, compound: tuple = (100., 200., 45., 1)) -> OutgoingPacket:
+	return OutgoingPacket("", StorageOp(0, cid, compound))
+
+
+def removal(cid: int) -> OutgoingPacket:
+	return OutgoingPacket("", StorageOp(0, cid, None))
+
+
+def test_crc16_ccitt_false_check_value():
+	assert crc16(b"123456789") == 0x29B1
+	assert crc16(b"") == 0xFFFF
+
+
+def test_ascii_checksum_counts_the_bits_mod_10():
+	# 4 : 1 bit, f : 4 bits, 7 : 3 bits, f : 4 bits
+	assert ascii_checksum("4f7f") == 2
+	assert ascii_packet("21") == "AA212AA"
+
+
+def test_ascii_parser_splits_frames_and_checks_them():
+	parser = FrameParser()
+	assert parser.feed(b"noiseAAF1") == []
+	corrupted = ascii_packet("8010f").replace("010f", "011f")
+	frames = parser.feed(bytes("5AA" + ascii_packet("8010f") + corrupted, "ascii"))
+	assert [(frame.pid, frame.body, frame.valid) for frame in frames] == [
+		(0xF, "1", True), (CMD_SEQ_ACK, "010f", True), (CMD_SEQ_ACK, "011f", False)
+	]
+	assert parser.buffer == ""
+
+
+def test_binary_frame_layout():
+	frame = binary_frame(7, CMD_REMOVE_BLOCK, b"\x01\x02")
+	assert frame[:5] == bytes((BINARY_SYNC, 4, 7, CMD_REMOVE_BLOCK, 1))
+	assert struct.unpack(">H", frame[-2:])[0] == crc16(frame[1:-2])
+
+
+def test_pack_compound_fixed_point():
+	cid, x, y, rot_type = struct.unpack(">BHHH", pack_compound(3, (123.456, 7.891, 135.5, 2)))
+	assert (cid, x, y) == (3, 12346, 789)
+	assert (rot_type >> 4, rot_type & 0xF) == (round(45.5 * ROT_STEPS), 2)
+	# 90 degrees is the same as 0 for a square block
+	assert struct.unpack(">BHHH", pack_compound(0, (0, 0, 90, 1)))[3] >> 4 == 0
+
+
+def test_binary_parser_round_trip():
+	frames = [binary_frame(1, CMD_SEQ_ACK, b"\x02\x00"), binary_frame(2, 0xF, b"\x01")]
+	parsed = BinaryFrameParser().feed(b"".join(frames))
+	assert [(frame.pid, frame.body, frame.valid) for frame in parsed] == [(CMD_SEQ_ACK, "0200", True), (0xF, "01", True)]
+
+
+def test_binary_parser_waits_for_split_frames():
+	parser = BinaryFrameParser()
+	frame = binary_frame(1, CMD_SEQ_ACK, b"\x02\x00")
+	for byte in frame[:-1]:
+		assert parser.feed(bytes((byte,))) == []
+	assert [frame.body for frame in parser.feed(frame[-1:])] == ["0200"]
+
+
+def test_binary_parser_resyncs_after_garbage_and_corruption():
+	parser = BinaryFrameParser()
+	good = binary_frame(4, CMD_SEQ_ACK, b"\x05\x00")
+	corrupted = bytearray(binary_frame(3, CMD_SEQ_ACK, b"\x04\x00"))
+	corrupted[4] ^= 0xFF
+	# Garbage, a sync byte with an impossible length, a frame with a bad CRC, then a valid frame
+	stream = b"\x00\x13" + bytes((BINARY_SYNC, 0xFF)) + bytes(corrupted) + good
+	assert [frame.body for frame in parser.feed(stream)] == ["0500"]
+	assert len(parser.buffer) == 0
+
+
+def test_binary_parser_finds_a_frame_inside_a_false_start():
+	parser = BinaryFrameParser()
+	good = binary_frame(1, CMD_SEQ_ACK, b"\x01\x00")
+	# A sync byte whose length covers the real frame, the CRC fails and the parser moves on by one byte
+	assert [frame.body for frame in parser.feed(bytes((BINARY_SYNC, 4)) + good)] == ["0100"]
+
+
+def test_batches_group_operations_of_the_same_kind():
+	packets = [update(0), update(1), removal(2), removal(3), update(4)]
+	assert BinaryCodec.batch_size(packets) == 2
+	assert BinaryCodec.batch_size(packets[2:]) == 2
+	assert BinaryCodec.batch_size([OutgoingPacket("AA212AA"), update(0)]) == 1
+
+
+def test_batches_fit_in_a_frame():
+	updates = [update(i) for i in range(20)]
+	assert BinaryCodec.batch_size(updates) == BINARY_MAX_DATA // COMPOUND_SIZE
+	frame = BinaryCodec.encode(0, updates[:BinaryCodec.batch_size(updates)])
+	assert len(frame) <= BINARY_MAX_DATA + 6
+	removals = [removal(i) for i in range(100)]
+	assert BinaryCodec.batch_size(removals) == BINARY_MAX_DATA
+
+
+def test_binary_encoding_of_each_packet_kind():
+	(frame,) = BinaryFrameParser().feed(BinaryCodec.encode(5, [update(1, (10., 20., 0., 3)), update(2)]))
+	assert frame.pid == CMD_UPDATE_BLOCK
+	assert bytes.fromhex(frame.body) == pack_compound(1, (10., 20., 0., 3)) + pack_compound(2, (100., 200., 45., 1))
+	(frame,) = BinaryFrameParser().feed(BinaryCodec.encode(6, [removal(7), removal(9)]))
+	assert (frame.pid, frame.body) == (CMD_REMOVE_BLOCK, "0709")
+	# Control packets keep their command ID, their hexadecimal parameters become bytes
+	(frame,) = BinaryFrameParser().feed(BinaryCodec.encode(7, [OutgoingPacket("AA212AA")]))
+	assert (frame.pid, frame.body) == (0x2, "01")
+	(frame,) = BinaryFrameParser().feed(BinaryCodec.encode(8, [OutgoingPacket("AA52AA")]))
+	assert (frame.pid, frame.body) == (0x5, "")
@@ -0,0 +1,97 @@
+import cv2
+import numpy as np
+import pytest
+
+from marker_detector import MarkerDetector
+
+DICTIONARY = cv2.aruco.DICT_4X4_50
+
+
+def marker_image(dictionary) -> np.ndarray:
+	"""
+	Marker 10 on a white margin, its outer corners are at 20 and 140 px
+	"""
+	if hasattr(cv2.aruco, "generateImageMarker"):
+		marker = cv2.aruco.generateImageMarker(dictionary, 10, 120)
+	else:
+		marker = cv2.aruco.drawMarker(dictionary, 10, 120)
+	return cv2.copyMakeBorder(marker, 20, 20, 20, 20, cv2.BORDER_CONSTANT, value=255)
+
+
+def scene(size: tuple[int, int], corners) -> np.ndarray:
+	"""
+	:param size: (width, height) of the image
+	:param corners: Sub-pixel corners of the marker in the image, clockwise from the top left
+	:return: A white grey image with the marker warped onto the given corners
+	"""
+	detector = MarkerDetector(DICTIONARY)
+	source = np.float32([[20, 20], [140, 20], [140, 140], [20, 140]]) - 0.5
+	transform = cv2.getPerspectiveTransform(source, np.float32(corners))
+	image = np.full(size[::-1], 255, np.uint8)
+	cv2.warpPerspective(marker_image(detector.dictionary), transform, size, image, cv2.INTER_LINEAR, cv2.BORDER_TRANSPARENT)
+	return image
+
+
+def detect_level(detector: MarkerDetector, image: np.ndarray):
+	"""
+	:return: Corners and IDs of the markers found by OpenCV on this image only, without refinement
+	"""
+	if detector.detector is not None:
+		return detector.detector.detectMarkers(image)[:2]
+	return cv2.aruco.detectMarkers(image, detector.dictionary, parameters=detector.parameters)[:2]
+
+
+CORNERS = [[1000.3, 600.7], [1230.6, 640.2], [1190.1, 870.8], [960.4, 830.5]]
+
+
+def test_levels():
+	detector = MarkerDetector(DICTIONARY)
+	assert detector.levels(640) == 0
+	assert detector.levels(1279) == 0
+	assert detector.levels(1280) == 1
+	assert detector.levels(1920) == 1
+	assert detector.levels(2560) == 2
+
+
+def test_refined_corners_are_sub_pixel():
+	image = scene((2560, 1440), CORNERS)
+	detector = MarkerDetector(DICTIONARY)
+	corners, ids = detector.detect(image)
+	assert ids.ravel().tolist() == [10]
+	error = np.abs(corners[0][0] - CORNERS)
+	assert error.max() < 0.5
+
+	# The corners of the downscaled level alone are several pixels off
+	small = cv2.pyrDown(cv2.pyrDown(image))
+	unrefined, _ = detect_level(detector, small)
+	assert np.abs(unrefined[0][0] * 4 - CORNERS).max() > error.max()
+
+
+def test_colour_and_grey_images_agree():
+	image = scene((2560, 1440), CORNERS)
+	detector = MarkerDetector(DICTIONARY)
+	grey_corners, _ = detector.detect(image)
+	colour_corners, _ = detector.detect(cv2.cvtColor(image, cv2.COLOR_GRAY2BGR))
+	assert colour_corners[0] == pytest.approx(grey_corners[0], abs=1e-3)
+
+
+def test_marker_close_to_the_border():
+	expected = [[14.2, 12.6], [250.4, 14.1], [248.9, 251.3], [12.8, 249.7]]
+	corners, ids = MarkerDetector(DICTIONARY).detect(scene((1920, 1080), expected))
+	assert ids.ravel().tolist() == [10]
+	assert np.abs(corners[0][0] - expected).max() < 0.5
+
+
+def test_small_images_are_not_downscaled():
+	corners = np.array(CORNERS) / 4
+	image = scene((640, 360), corners)
+	detector = MarkerDetector(DICTIONARY)
+	found, ids = detector.detect(image)
+	expected, expected_ids = detect_level(detector, image)
+	assert ids.tolist() == expected_ids.tolist()
+	assert np.array_equal(found[0], expected[0])
+
+
+def test_no_marker():
+	corners, ids = MarkerDetector(DICTIONARY).detect(np.full((1440, 2560), 255, np.uint8))
+	assert ids is None and len(corners) == 0
@@ -0,0 +1,125 @@
+import threading
+import time
+
+from outbound_queue import OutboundQueue, Priority
+
+
+def drain(queue: OutboundQueue) -> list:
+	items = []
+	while (item := queue.pop()) is not None:
+		items.append(item)
+	return items
+
+
+def later(delay: float, action):
+	thread = threading.Timer(delay, action)
+	thread.start()
+	return thread
+
+
+def test_higher_priorities_go_first():
+	queue = OutboundQueue()
+	queue.put("storage", Priority.STORAGE)
+	queue.put("presence", Priority.PRESENCE)
+	queue.put("control 1", Priority.CONTROL)
+	queue.put("control 2", Priority.CONTROL)
+	assert drain(queue) == ["control 1", "control 2", "presence", "storage"]
+
+
+def test_pop_stops_at_the_given_priority():
+	queue = OutboundQueue()
+	queue.put("storage", Priority.STORAGE)
+	assert queue.pop(Priority.PRESENCE) is None
+	assert queue.pop(Priority.STORAGE) == "storage"
+
+
+def test_items_with_the_same_key_are_coalesced():
+	queue = OutboundQueue()
+	queue.put("scene 1", Priority.STORAGE, key="storage")
+	queue.put("mode", Priority.CONTROL)
+	queue.put("scene 2", Priority.STORAGE, key="storage")
+	assert len(queue) == 2
+	assert queue.has("storage")
+	assert drain(queue) == ["mode", "scene 2"]
+	assert not queue.has("storage")
+
+
+def test_coalescing_across_priorities():
+	queue = OutboundQueue()
+	queue.put("idle", Priority.STORAGE, key="mode")
+	queue.put("build", Priority.CONTROL, key="mode")
+	assert drain(queue) == ["build"]
+
+
+def test_popped_items_are_not_coalesced():
+	queue = OutboundQueue()
+	queue.put("scene 1", Priority.STORAGE, key="storage")
+	assert queue.pop() == "scene 1"
+	queue.put("scene 2", Priority.STORAGE, key="storage")
+	assert drain(queue) == ["scene 2"]
+
+
+def test_full_queue_drops_its_oldest_item():
+	queue = OutboundQueue()
+	queue.put("keyed", Priority.CONTROL, key="first")
+	for i in range(OutboundQueue.MAX_ITEMS):
+		queue.put(i, Priority.CONTROL)
+	assert len(queue) == OutboundQueue.MAX_ITEMS
+	assert not queue.has("first")
+	assert drain(queue) == list(range(OutboundQueue.MAX_ITEMS))
+
+
+def test_push_front_keeps_the_order_of_the_items():
+	queue = OutboundQueue()
+	queue.put("next", Priority.CONTROL)
+	queue.push_front(["a", "b"], Priority.CONTROL)
+	assert drain(queue) == ["a", "b", "next"]
+
+
+def test_clear_forgets_the_keys():
+	queue = OutboundQueue()
+	queue.put("scene", Priority.STORAGE, key="storage")
+	queue.put("mode", Priority.CONTROL)
+	queue.clear(Priority.STORAGE)
+	assert not queue.has("storage")
+	assert drain(queue) == ["mode"]
+
+
+def test_wait_returns_once_an_item_is_queued():
+	queue = OutboundQueue()
+	timer = later(0.05, lambda: queue.put("mode", Priority.CONTROL))
+	start = time.monotonic()
+	assert queue.wait(5.)
+	assert time.monotonic() - start < 2.
+	timer.join()
+
+
+def test_wait_times_out_on_an_empty_queue():
+	queue = OutboundQueue()
+	start = time.monotonic()
+	assert not queue.wait(0.05)
+	assert time.monotonic() - start >= 0.05
+
+
+def test_wait_does_not_block_when_items_are_queued():
+	queue = OutboundQueue()
+	queue.put("mode", Priority.CONTROL)
+	assert queue.wait(5.)
+
+
+def test_wake_ends_a_wait_on_an_empty_queue():
+	queue = OutboundQueue()
+	timer = later(0.05, queue.wake)
+	start = time.monotonic()
+	assert not queue.wait(5.)
+	assert time.monotonic() - start < 2.
+	timer.join()
+
+
+def test_wake_before_wait_ends_the_next_wait_only():
+	queue = OutboundQueue()
+	queue.wake()
+	start = time.monotonic()
+	assert not queue.wait(5.)
+	assert time.monotonic() - start < 2.
+	assert not queue.wait(0.05)
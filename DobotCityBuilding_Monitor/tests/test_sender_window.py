@@ -0,0 +1,156 @@
+import time
+
+import pytest
+import serial
+
+import metrics
+from bluetooth_handler import BluetoothHandler
+from link_protocol import (
+	ACK_VALID, AsciiCodec, CMD_SEQUENCED, FrameParser, OutgoingPacket, SEQ_MODULO, SenderWindow, seq_distance,
+	sequenced_packet
+)
+from storage_sync import StorageOp
+
+
+def ack_body(cumulative: int, bitmap: int = 0) -> str:
+	"""
+	CMD_SEQ_ACK parameters : next expected sequence number, then the packets received after it
+	"""
+	return "{:02x}{:02x}".format(cumulative, bitmap)
+
+
+def send(window: SenderWindow, count: int, now: float = 0.) -> list:
+	entries = []
+	for i in range(count):
+		entry = window.register([OutgoingPacket(ACK_VALID, StorageOp(0, i, None))], AsciiCodec)
+		window.sent(entry, now)
+		entries.append(entry)
+	return entries
+
+
+def test_sequenced_packet_wraps_the_payload():
+	frame = FrameParser().feed(bytes(sequenced_packet(0x2a, "AA41234AA"), "ascii"))[0]
+	assert frame.valid
+	assert frame.pid == CMD_SEQUENCED
+	assert frame.body == "2a4123"
+
+
+def test_seq_distance_wraps_around():
+	assert seq_distance(250, 2) == 8
+	assert seq_distance(2, 250) == SEQ_MODULO - 8
+
+
+def test_sequence_numbers_wrap_around():
+	window = SenderWindow()
+	window.next_seq = SEQ_MODULO - 1
+	first, second = send(window, 2)
+	assert (first.seq, second.seq) == (SEQ_MODULO - 1, 0)
+	# Both acknowledged by a cumulative ack past the wrap
+	assert [pk.op.cid for pk in window.on_ack(ack_body(1))] == [0, 1]
+	assert not window.in_flight
+
+
+def test_window_limits_packets_and_bytes():
+	window = SenderWindow(size=2, max_bytes=30)
+	assert window.can_send(100)  # A single frame is always allowed
+	send(window, 1)
+	assert window.bytes_in_flight() == len(sequenced_packet(0, ACK_VALID))
+	assert not window.can_send(30 - window.bytes_in_flight() + 1)
+	assert window.can_send(30 - window.bytes_in_flight())
+	send(window, 1)
+	assert not window.can_send(1)
+
+
+def test_cumulative_ack():
+	window = SenderWindow()
+	send(window, 3)
+	assert [pk.op.cid for pk in window.on_ack(ack_body(2))] == [0, 1]
+	assert list(window.in_flight) == [2]
+
+
+def test_selective_ack_only_leaves_the_missing_packets():
+	window = SenderWindow()
+	send(window, 4)
+	# 0 received, 1 lost, 2 and 3 received : bits 0 and 1 stand for 1 + 1 and 1 + 2
+	acked = window.on_ack(ack_body(1, 0b11))
+	assert [pk.op.cid for pk in acked] == [0, 2, 3]
+	assert list(window.in_flight) == [1]
+
+
+def test_stale_and_malformed_acks_are_ignored():
+	window = SenderWindow()
+	send(window, 2)
+	assert window.on_ack(ack_body(0)) == []
+	assert window.on_ack("12") == []
+	assert len(window.in_flight) == 2
+
+
+def test_rto_follows_the_smoothed_round_trip():
+	window = SenderWindow()
+	assert window.rto() == SenderWindow.MAX_RTO
+	window.measure_rtt(0.2)
+	assert (window.srtt, window.rttvar) == (0.2, 0.1)
+	assert window.rto() == pytest.approx(0.6)
+	for _ in range(50):
+		window.measure_rtt(0.01)
+	assert window.rto() == SenderWindow.MIN_RTO
+	window.measure_rtt(100)
+	assert window.rto() == SenderWindow.MAX_RTO
+
+
+def test_karn_only_measures_packets_sent_once():
+	window = SenderWindow()
+	samples = []
+	window.on_rtt = samples.append
+	first, second = send(window, 2, now=10.)
+	window.sent(second, 11.)
+	window.on_ack(ack_body(2), now=11.5)
+	assert samples == [pytest.approx(1.5)]
+	assert window.srtt == pytest.approx(1.5)
+
+
+def test_due_packets():
+	window = SenderWindow()
+	window.measure_rtt(0.1)
+	first, second = send(window, 2, now=10.)
+	window.sent(second, 10.5)
+	rto = window.rto()
+	assert window.due(now=10. + rto / 2) == []
+	assert window.due(now=10. + rto) == [first]
+	# A corrupted packet reported by the Arduino : the oldest one goes again right away
+	assert window.due(now=10., fast=True) == [first]
+
+
+def test_broken_after_max_transmissions():
+	window = SenderWindow()
+	(entry,) = send(window, 1)
+	for _ in range(SenderWindow.MAX_TRANSMISSIONS - 2):
+		window.sent(entry)
+	assert not window.broken()
+	window.sent(entry)
+	assert window.broken()
+
+
+def test_reset_hands_back_the_packets_in_flight():
+	window = SenderWindow()
+	send(window, 3)
+	assert [pk.op.cid for pk in window.reset()] == [0, 1, 2]
+	assert not window.in_flight
+	assert window.next_seq == 0
+
+
+def test_handler_gives_up_on_a_broken_link():
+	handler = BluetoothHandler.__new__(BluetoothHandler)
+	handler.window = SenderWindow()
+	handler.retransmits = metrics.Counter("link_retransmits_total", "", {})
+	handler.fast_retransmit = False
+	handler.waiting_since = time.monotonic()
+	handler.dead_timeout = lambda: 60.
+	written = []
+	handler.write = written.append
+	(entry,) = send(handler.window, 1)
+	with pytest.raises(serial.serialutil.SerialTimeoutException):
+		for _ in range(SenderWindow.MAX_TRANSMISSIONS):
+			entry.sent_at = -SenderWindow.MAX_RTO
+			handler.retransmit()
+	assert len(written) == SenderWindow.MAX_TRANSMISSIONS - 1
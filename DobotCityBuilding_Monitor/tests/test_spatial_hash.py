@@ -0,0 +1,67 @@
+import math
+import random
+
+from camera_utils import SpatialHash
+
+
+def brute_force(candidates: list, distance: float) -> list:
+	"""
+	Same selection as SpatialHash, comparing each candidate to every kept one
+	"""
+	kept = []
+	for x, y, score, payload in candidates:
+		near = [other for other in kept if math.hypot(other[0] - x, other[1] - y) < distance]
+		if any(other[2] >= score for other in near):
+			continue
+		kept = [other for other in kept if other not in near] + [(x, y, score, payload)]
+	return sorted(item[3] for item in kept)
+
+
+def test_better_candidate_replaces_a_close_one():
+	grid = SpatialHash(10)
+	assert grid.insert(5, 5, 1, "first")
+	assert grid.insert(8, 9, 2, "second")
+	assert grid.values() == ["second"]
+
+
+def test_worse_or_equal_candidate_is_rejected():
+	grid = SpatialHash(10)
+	assert grid.insert(5, 5, 2, "first")
+	assert not grid.insert(8, 9, 1, "worse")
+	assert not grid.insert(5, 6, 2, "equal")
+	assert grid.values() == ["first"]
+
+
+def test_distant_candidates_are_kept():
+	grid = SpatialHash(10)
+	assert grid.insert(0, 0, 1, "a")
+	assert grid.insert(10, 0, 2, "b")  # Exactly cell_size apart
+	assert grid.insert(0, 15, 3, "c")
+	assert grid.values() == ["a", "b", "c"]
+
+
+def test_neighbours_across_cell_boundaries():
+	grid = SpatialHash(10)
+	grid.insert(9.5, 9.5, 1, "corner")
+	assert grid.neighbours(10.5, 10.5) == [0]
+	assert grid.neighbours(-0.1, 9.5) == [0]
+	assert grid.neighbours(19.6, 9.5) == []
+	assert not grid.insert(12, 14, 0, "beaten")
+
+
+def test_values_follow_the_insertion_order():
+	grid = SpatialHash(10)
+	for i, payload in enumerate(("a", "b", "c")):
+		grid.insert(i * 20, 0, 1, payload)
+	grid.insert(21, 2, 5, "d")
+	assert grid.values() == ["a", "c", "d"]
+
+
+def test_matches_the_pairwise_selection():
+	rng = random.Random(3)
+	for _ in range(20):
+		candidates = [(rng.uniform(-50, 50), rng.uniform(-50, 50), rng.random(), i) for i in range(60)]
+		grid = SpatialHash(10)
+		for candidate in candidates:
+			grid.insert(*candidate)
+		assert sorted(grid.values()) == brute_force(candidates, 10)
@@ -0,0 +1,97 @@
+import pytest
+
+from storage_sync import StorageOp, StorageSync
+
+
+def apply(sync: StorageSync, ops: list[StorageOp]):
+	"""
+	Acknowledge every operation, as the Arduino would
+	"""
+	for op in ops:
+		sync.acknowledge(op)
+
+
+def test_new_compounds_get_the_smallest_free_ids():
+	sync = StorageSync()
+	ops = sync.diff([[10, 10, 0, 0], [50, 10, 0, 1]])
+	assert [(op.cid, op.compound) for op in ops] == [(0, (10., 10., 0., 0)), (1, (50., 10., 0., 1))]
+
+
+def test_unchanged_scene_sends_nothing():
+	sync = StorageSync()
+	apply(sync, sync.diff([[10, 10, 0, 0], [50, 10, 0, 1]]))
+	assert sync.diff([[10, 10, 0, 0], [50, 10, 0, 1]]) == []
+
+
+def test_noise_is_ignored():
+	sync = StorageSync()
+	apply(sync, sync.diff([[10, 10, 0, 0]]))
+	assert sync.diff([[10.5, 9.5, 1, 0]]) == []
+	# Rotations are compared modulo 90 degrees
+	assert sync.diff([[10, 10, 89, 0]]) == []
+
+
+def test_moved_compound_keeps_its_id():
+	sync = StorageSync()
+	apply(sync, sync.diff([[10, 10, 0, 0], [50, 10, 0, 1]]))
+	ops = sync.diff([[10, 10, 0, 0], [55, 12, 0, 1]])
+	assert [(op.cid, op.compound) for op in ops] == [(1, (55., 12., 0., 1))]
+
+
+def test_matching_requires_the_same_type():
+	sync = StorageSync()
+	apply(sync, sync.diff([[10, 10, 0, 0]]))
+	ops = sync.diff([[10, 10, 0, 2]])
+	# The house is removed first, the car can't take its id before the removal is acknowledged
+	assert [(op.cid, op.compound) for op in ops] == [(0, None), (1, (10., 10., 0., 2))]
+
+
+def test_closest_detection_is_matched():
+	sync = StorageSync()
+	apply(sync, sync.diff([[10, 10, 0, 0]]))
+	ops = sync.diff([[16, 10, 0, 0], [12, 10, 0, 0]])
+	assert [(op.cid, op.compound) for op in ops] == [(0, (12., 10., 0., 0)), (1, (16., 10., 0., 0))]
+
+
+def test_removed_ids_are_reused():
+	sync = StorageSync()
+	apply(sync, sync.diff([[10, 10, 0, 0], [50, 10, 0, 1], [90, 10, 0, 2]]))
+	ops = sync.diff([[10, 10, 0, 0], [90, 10, 0, 2]])
+	assert ops == [StorageOp(sync.generation, 1, None)]
+	apply(sync, ops)
+	ops = sync.diff([[10, 10, 0, 0], [90, 10, 0, 2], [130, 10, 0, 3]])
+	assert [op.cid for op in ops] == [1]
+
+
+def test_unacknowledged_removal_keeps_its_id():
+	sync = StorageSync()
+	apply(sync, sync.diff([[10, 10, 0, 0], [50, 10, 0, 1]]))
+	sync.diff([[10, 10, 0, 0]])
+	# The removal of id 1 wasn't acknowledged yet, the Arduino might still hold it
+	ops = sync.diff([[10, 10, 0, 0], [90, 10, 0, 2]])
+	assert [op.cid for op in ops] == [2]
+
+
+def test_capacity_is_respected():
+	sync = StorageSync()
+	compounds = [[10 + 20 * i, 10, 0, 0] for i in range(StorageSync.MAX_COMPOUNDS + 5)]
+	assert len(sync.diff(compounds)) == StorageSync.MAX_COMPOUNDS
+
+
+def test_ids_never_reach_compound_no_id():
+	sync = StorageSync()
+	sync.acked = {cid: (0., 0., 0., 0) for cid in range(StorageSync.MAX_IDS - 1)}
+	assert sync.free_id() == 254
+	sync.acked[254] = (0., 0., 0., 0)
+	# 255 is COMPOUND_NO_ID on the Arduino
+	with pytest.raises(OverflowError):
+		sync.free_id()
+
+
+def test_reset_ignores_late_acknowledgments():
+	sync = StorageSync()
+	ops = sync.diff([[10, 10, 0, 0]])
+	sync.reset()
+	apply(sync, ops)
+	assert sync.acked == {}
+	assert sync.diff([[10, 10, 0, 0]])[0].generation == sync.generation
@@ -0,0 +1,92 @@
+import cv2
+import numpy as np
+import pytest
+
+import camera_utils
+from storage_zone import order_corners
+
+SCALE = 3  # px per mm of the synthetic table
+MARGIN = 40  # mm of table around the inner corners of the markers
+MARKER = 30  # mm, side of the markers
+BLOCKS = [(60, 40, camera_utils.BlockType.House), (200, 70, camera_utils.BlockType.Car)]  # mm from the top left inner corner
+
+
+def table() -> np.ndarray:
+	"""
+	Storage zone seen from above in landscape, with its four markers and the BLOCKS
+	"""
+	width, height = camera_utils.storage_dimensions
+	image = np.full(((height + 2 * MARGIN) * SCALE, (width + 2 * MARGIN) * SCALE, 3), 225, np.uint8)
+	dictionary = camera_utils.marker_detector.dictionary
+	if hasattr(cv2.aruco, "generateImageMarker"):
+		marker = cv2.aruco.generateImageMarker(dictionary, camera_utils.storage_aruco_id, MARKER * SCALE)
+	else:
+		marker = cv2.aruco.drawMarker(dictionary, camera_utils.storage_aruco_id, MARKER * SCALE)
+	marker = cv2.cvtColor(marker, cv2.COLOR_GRAY2BGR)
+	for x, y in ((-MARKER, -MARKER), (width, -MARKER), (width, height), (-MARKER, height)):
+		x, y = (MARGIN + x) * SCALE, (MARGIN + y) * SCALE
+		image[y:y + marker.shape[0], x:x + marker.shape[1]] = marker
+	for u, v, block_type in BLOCKS:
+		points = cv2.boxPoints((((MARGIN + u) * SCALE, (MARGIN + v) * SCALE), (20 * SCALE, 20 * SCALE), 0))
+		cv2.fillPoly(image, [points.astype(np.int32)], camera_utils.palette[block_type])
+		cv2.polylines(image, [points.astype(np.int32)], True, (40, 40, 40), 2)
+	return image
+
+
+def detect(image: np.ndarray) -> list:
+	"""
+	:return: (x, y, type) of the compounds found in the frame, sorted by type
+	"""
+	calibration = camera_utils.Calibration()
+	calibration.shadow_size, calibration.shadow_intensity = 50, 150
+	detection = camera_utils.detect_storage(image, calibration, camera_utils.PipelineContext())
+	assert detection.area_found
+	return sorted(((x, y, int(t)) for x, y, _, t in detection.compounds), key=lambda compound: compound[2])
+
+
+def expected(flipped: bool = False) -> list:
+	"""
+	:param flipped: Whether the zone is read from its bottom right corner
+	:return: (x, y, type) of the BLOCKS in R0, x = origin_x + rows and y = origin_y - columns of the warped zone in mm
+	"""
+	width, height = camera_utils.storage_dimensions
+	origin = camera_utils.storage_layout.origin
+	blocks = [(width - u, height - v, t) if flipped else (u, v, t) for u, v, t in BLOCKS]
+	return sorted(((origin[0] + v, origin[1] - u, int(t)) for u, v, t in blocks), key=lambda compound: compound[2])
+
+
+def assert_positions(found: list, wanted: list):
+	assert [t for _, _, t in found] == [t for _, _, t in wanted]
+	for (x, y, _), (wanted_x, wanted_y, _) in zip(found, wanted):
+		assert (x, y) == pytest.approx((wanted_x, wanted_y), abs=2)
+
+
+def test_order_corners():
+	landscape = np.array([[300, 120], [10, 15], [310, 10], [5, 110]], np.float32)
+	assert order_corners(landscape).tolist() == [[10, 15], [310, 10], [300, 120], [5, 110]]
+	# A portrait zone starts from its top right corner, so that its longest side comes first
+	portrait = landscape[:, ::-1]
+	assert order_corners(portrait).tolist() == [[110, 5], [120, 300], [10, 310], [15, 10]]
+
+
+def test_landscape_zone():
+	assert_positions(detect(table()), expected())
+
+
+def test_portrait_zone():
+	assert_positions(detect(cv2.rotate(table(), cv2.ROTATE_90_CLOCKWISE)), expected())
+
+
+def test_zone_seen_in_perspective():
+	image = table()
+	height, width = image.shape[:2]
+	source = np.float32([[0, 0], [width, 0], [width, height], [0, height]])
+	tilted = np.float32([[30, 20], [width - 10, 0], [width, height], [0, height - 25]])
+	frame = cv2.warpPerspective(image, cv2.getPerspectiveTransform(source, tilted), (width, height), borderValue=(225, 225, 225))
+	found = detect(frame)
+	# Positions are measured in the plane of the markers, the perspective is undone
+	assert_positions(found, expected())
+
+
+def test_upside_down_zone_is_read_from_the_opposite_corner():
+	assert_positions(detect(cv2.rotate(table(), cv2.ROTATE_180)), expected(flipped=True))
@@ -0,0 +1,332 @@
+import argparse
+import json
+import math
+import os
+import random
+import time
+
+import cv2
+import numpy as np
+
+import camera_utils
+from base_handler import HandlerId
+from bluetooth_handler import BluetoothHandler
+from link_benchmark import percentile
+from link_protocol import AsciiCodec, BinaryCodec
+
+# Measures the cost of each stage of the vision pipeline and the accuracy of the detection,
+# on a corpus of storage zone frames whose blocks are known
+# Example : python vision_benchmark.py --frames 10 --json after.json --baseline before.json
+
+# # # SYNTHETIC CORPUS # # #
+# Layouts : name => (number of blocks, noisy lighting)
+LAYOUTS = {
+	"empty": (0, False),
+	"sparse": (6, False),
+	"full": (28, False),
+	"noisy": (12, True),
+}
+FRAME_SIZE = 1280, 720
+RENDER_SCALE = 4  # px/mm of the rendered zone, before it is projected in the frame
+MARGIN = 45  # mm around the zone in the rendered scene
+MARKER_SIZE = 30  # mm
+BLOCK_SIZE = 20  # mm
+FULL_GRID = 7, 4  # Cells of the full layout
+MATCH_DISTANCE = 8  # mm, a detection this close to a block is considered to be that block
+
+
+def zone_to_robot(zx: float, zy: float) -> tuple[float, float]:
+	"""
+	Convert a position in the storage zone (mm from its top left corner) to the coordinates sent to the Arduino
+	"""
+	return camera_utils.camera_origin[0] + zy, camera_utils.camera_origin[1] - zx
+
+
+def place_blocks(count: int, rng: random.Random) -> list[tuple]:
+	"""
+	:return: (zx, zy, rot, type) of non overlapping blocks in the storage zone
+	"""
+	w, h = camera_utils.storage_dimensions
+	if count == FULL_GRID[0] * FULL_GRID[1]:
+		cw, ch = w / FULL_GRID[0], h / FULL_GRID[1]
+		return [
+			(cw * (i + 0.5) + rng.uniform(-1, 1), ch * (j + 0.5) + rng.uniform(-1, 1), rng.uniform(-8, 8), rng.randrange(4))
+			for i in range(FULL_GRID[0]) for j in range(FULL_GRID[1])
+		]
+	blocks = []
+	while len(blocks) < count:
+		zx, zy = rng.uniform(16, w - 16), rng.uniform(16, h - 16)
+		if all(math.hypot(zx - b[0], zy - b[1]) > 32 for b in blocks):
+			blocks.append((zx, zy, rng.uniform(0, 90), rng.randrange(4)))
+	return blocks
+
+
+def render_frame(blocks: list[tuple], noisy: bool, rng: random.Random) -> np.ndarray:
+	"""
+	Draw the storage zone, its markers and its blocks seen from above, and project it in a camera frame
+	"""
+	w, h = camera_utils.storage_dimensions
+	s = RENDER_SCALE
+	plain = np.full((round((h + 2 * MARGIN) * s), round((w + 2 * MARGIN) * s), 3), 225, np.uint8)
+
+	# Markers outside of each corner, their inner corner on the corner of the zone
+	generate = getattr(cv2.aruco, "generateImageMarker", None) or cv2.aruco.drawMarker
+	marker = cv2.cvtColor(generate(camera_utils.marker_detector.dictionary, 10, MARKER_SIZE * s), cv2.COLOR_GRAY2BGR)
+	for mx, my in ((MARGIN - MARKER_SIZE, MARGIN - MARKER_SIZE), (MARGIN + w, MARGIN - MARKER_SIZE),
+				   (MARGIN + w, MARGIN + h), (MARGIN - MARKER_SIZE, MARGIN + h)):
+		x, y = round(mx * s), round(my * s)
+		plain[y:y + marker.shape[0], x:x + marker.shape[1]] = marker
+
+	for zx, zy, rot, block_type in blocks:
+		corners = cv2.boxPoints(((
+			(MARGIN + zx) * s, (MARGIN + zy) * s), (BLOCK_SIZE * s, BLOCK_SIZE * s), rot
+		)).astype(np.int32)
+		cv2.fillPoly(plain, [corners], camera_utils.palette[block_type])
+		cv2.polylines(plain, [corners], True, (40, 40, 40), 2)
+
+	# Seen by a camera slightly tilted over the zone
+	fw, fh = FRAME_SIZE
+	ph, pw = plain.shape[:2]
+	jitter = lambda: rng.uniform(-0.015, 0.015)
+	source = np.float32([[0, 0], [pw, 0], [pw, ph], [0, ph]])
+	target = np.float32([
+		[fw * (0.08 + jitter()), fh * (0.18 + jitter())], [fw * (0.92 + jitter()), fh * (0.2 + jitter())],
+		[fw * (0.9 + jitter()), fh * (0.8 + jitter())], [fw * (0.1 + jitter()), fh * (0.82 + jitter())]
+	])
+	frame = cv2.warpPerspective(
+		plain, cv2.getPerspectiveTransform(source, target), FRAME_SIZE, flags=cv2.INTER_AREA, borderValue=(70, 70, 70)
+	)
+
+	if noisy:
+		# Uneven lighting, sensor noise and a slightly out of focus lens
+		gx = np.linspace(rng.uniform(0.55, 0.8), rng.uniform(1.05, 1.25), fw, dtype=np.float32)
+		gy = np.linspace(rng.uniform(0.85, 1), rng.uniform(1, 1.15), fh, dtype=np.float32)
+		light = (gy[:, None] * gx[None, :])[:, :, None]
+		noise = np.random.default_rng(rng.randrange(1 << 32)).normal(0, 6, frame.shape).astype(np.float32)
+		frame = np.clip(frame * light + noise, 0, 255).astype(np.uint8)
+		frame = cv2.GaussianBlur(frame, (3, 3), 0)
+	return frame
+
+
+def generate_corpus(frames: int, rng: random.Random) -> list[dict]:
+	"""
+	:param frames: Number of frames of each layout
+	:return: The corpus entries : layout name, frame and blocks as sent to the Arduino (x, y, type)
+	"""
+	corpus = []
+	for name, (count, noisy) in LAYOUTS.items():
+		for _ in range(frames):
+			blocks = place_blocks(count, rng)
+			corpus.append({
+				"layout": name,
+				"frame": render_frame(blocks, noisy, rng),
+				"blocks": [[*zone_to_robot(zx, zy), block_type] for zx, zy, rot, block_type in blocks]
+			})
+	return corpus
+
+
+def save_corpus(corpus: list[dict], directory: str):
+	"""
+	Write the frames as PNG files, and their blocks in corpus.json
+	"""
+	os.makedirs(directory, exist_ok=True)
+	index = []
+	for i, entry in enumerate(corpus):
+		file = "{}_{:03d}.png".format(entry["layout"], i)
+		cv2.imwrite(os.path.join(directory, file), entry["frame"])
+		index.append({"file": file, "layout": entry["layout"], "blocks": entry["blocks"]})
+	with open(os.path.join(directory, "corpus.json"), "w") as f:
+		json.dump(index, f, indent=1)
+
+
+def load_corpus(directory: str) -> list[dict]:
+	"""
+	Read a corpus written by save_corpus, recorded frames can be added to it by hand
+	"""
+	with open(os.path.join(directory, "corpus.json")) as f:
+		index = json.load(f)
+	corpus = []
+	for entry in index:
+		frame = cv2.imread(os.path.join(directory, entry["file"]))
+		if frame is None:
+			print("[Benchmark] Unable to read {}".format(entry["file"]))
+			continue
+		corpus.append({"layout": entry["layout"], "frame": frame, "blocks": entry["blocks"]})
+	return corpus
+
+
+# # # MEASURES # # #
+def match(detected, truth: list) -> tuple[int, int, list[float]]:
+	"""
+	Greedily pair the detected compounds with the closest blocks
+	:return: Number of pairs, number of pairs of the right type, and the position error of each pair
+	"""
+	pairs = sorted(
+		(math.hypot(d[0] - t[0], d[1] - t[1]), di, ti)
+		for di, d in enumerate(detected) for ti, t in enumerate(truth)
+		if math.hypot(d[0] - t[0], d[1] - t[1]) < MATCH_DISTANCE
+	)
+	used_d, used_t, typed, errors = set(), set(), 0, []
+	for dist, di, ti in pairs:
+		if di not in used_d and ti not in used_t:
+			used_d.add(di)
+			used_t.add(ti)
+			typed += int(detected[di][3]) == int(truth[ti][2])
+			errors.append(dist)
+	return len(errors), typed, errors
+
+
+def timed(samples: dict, stage: str, function, *args):
+	start = time.perf_counter()
+	result = function(*args)
+	samples.setdefault(stage, []).append(time.perf_counter() - start)
+	return result
+
+
+def encode_storage(handler: BluetoothHandler, compounds: list, codec) -> int:
+	"""
+	Encode the frames that send the compounds to an Arduino that doesn't know any of them
+	:return: Number of bytes to send
+	"""
+	handler.storage.reset()
+	packets = handler.storage_packets(compounds)
+	size, seq = 0, 0
+	while packets:
+		count = codec.batch_size(packets)
+		size += len(codec.encode(seq, packets[:count]))
+		del packets[:count]
+		seq += 1
+	return size
+
+
+def run(corpus: list[dict], repeat: int, args) -> dict:
+	"""
+	Run every stage on every frame of the corpus
+	:return: Timing samples of each stage, and accuracy counters of each layout
+	"""
+	calibration = camera_utils.Calibration()
+	calibration.shadow_size, calibration.shadow_intensity = args.canny
+	context = camera_utils.PipelineContext()
+	zone = calibration.storage_zone
+	handler = BluetoothHandler(HandlerId.BLUETOOTH)
+	samples = {}
+	accuracy = {}
+
+	for entry in corpus:
+		frame, truth = entry["frame"], entry["blocks"]
+		stats = accuracy.setdefault(entry["layout"], {"frames": 0, "found": 0, "truth": 0, "detected": 0, "matched": 0, "typed": 0, "errors": []})
+		stats["frames"] += 1
+		stats["truth"] += len(truth)
+
+		# Whole pipeline, with a marker detection then with the cached transform
+		zone.invalidate()
+		detection = timed(samples, "detect_storage (detection)", camera_utils.detect_storage, frame, calibration, context)
+		for _ in range(repeat):
+			detection = timed(samples, "detect_storage (cached)", camera_utils.detect_storage, frame, calibration, context)
+		if not detection.area_found:
+			continue
+		stats["found"] += 1
+		stats["detected"] += len(detection.compounds)
+		matched, typed, errors = match(detection.compounds, truth)
+		stats["matched"] += matched
+		stats["typed"] += typed
+		stats["errors"] += errors
+
+		# Single stages
+		warped = np.empty(zone.shape(), np.uint8)
+		scratch = np.empty_like(warped)
+		boxes = [
+			((calibration.storage.origin[1] - y) * zone.PX_PER_MM, (x - calibration.storage.origin[0]) * zone.PX_PER_MM)
+			for x, y, _ in truth
+		]
+		boxes = [(center, (BLOCK_SIZE * zone.PX_PER_MM, BLOCK_SIZE * zone.PX_PER_MM), 0) for center in boxes]
+		for _ in range(repeat):
+			timed(samples, "detect_markers", zone.detector.detect, frame)
+			timed(samples, "crop (cached)", zone.crop, frame, warped)
+			timed(samples, "canny_find_contours", camera_utils.canny_find_contours, warped, *args.canny, context)
+			np.copyto(scratch, warped)
+			timed(samples, "process_storage", camera_utils.process_storage, scratch, calibration, context)
+			timed(samples, "block colors", lambda: camera_utils.types_from_colors(camera_utils.box_mean_colors(warped, boxes, context.labels)[1]))
+			timed(samples, "calib_show_contours", camera_utils.calib_show_contours, frame.copy(), *args.canny)
+			timed(samples, "send_blocks encoding (ascii)", encode_storage, handler, detection.compounds, AsciiCodec)
+			timed(samples, "send_blocks encoding (binary)", encode_storage, handler, detection.compounds, BinaryCodec)
+
+	for stats in accuracy.values():
+		errors = stats.pop("errors")
+		stats["precision"] = stats["matched"] / stats["detected"] if stats["detected"] else float("nan")
+		stats["recall"] = stats["matched"] / stats["truth"] if stats["truth"] else float("nan")
+		stats["type_accuracy"] = stats["typed"] / stats["matched"] if stats["matched"] else float("nan")
+		stats["position_error"] = sum(errors) / len(errors) if errors else float("nan")
+	stages = {
+		stage: {"p50": percentile(values, 0.5), "p90": percentile(values, 0.9), "p99": percentile(values, 0.99), "max": max(values)}
+		for stage, values in samples.items()
+	}
+	return {"stages": stages, "accuracy": accuracy}
+
+
+def report(results: dict, baseline: dict = None):
+	"""
+	Print the measures, next to those of a previous run if given
+	"""
+	def delta(current: float, previous: float | None) -> str:
+		if previous is None or not previous or math.isnan(previous):
+			return ""
+		return " ({:+.0f}%)".format((current - previous) / previous * 100)
+
+	stages = results["stages"]
+	base_stages = baseline["stages"] if baseline else {}
+	print("\n# # # STAGES (ms) # # #")
+	for stage, q in stages.items():
+		base = base_stages.get(stage, {})
+		print("{:<32} p50={:7.2f}{} p90={:7.2f} p99={:7.2f} max={:7.2f}".format(
+			stage, q["p50"] * 1000, delta(q["p50"], base.get("p50")), q["p90"] * 1000, q["p99"] * 1000, q["max"] * 1000
+		))
+	cached = stages.get("detect_storage (cached)")
+	if cached:
+		print("Throughput : {:.1f} frames/s with a cached transform (p50)".format(1 / cached["p50"]))
+
+	base_accuracy = baseline["accuracy"] if baseline else {}
+	print("\n# # # ACCURACY # # #")
+	for layout, stats in results["accuracy"].items():
+		base = base_accuracy.get(layout, {})
+		print("{:<8} zone found {}/{} ; {} blocks, {} detected ; precision={:.3f}{} recall={:.3f}{} type={:.3f} error={:.2f}mm".format(
+			layout, stats["found"], stats["frames"], stats["truth"], stats["detected"],
+			stats["precision"], delta(stats["precision"], base.get("precision")),
+			stats["recall"], delta(stats["recall"], base.get("recall")),
+			stats["type_accuracy"], stats["position_error"]
+		))
+
+
+def main():
+	parser = argparse.ArgumentParser(description="Benchmark the vision pipeline on a corpus of storage zone frames")
+	parser.add_argument("--corpus", help="Directory of a corpus to load instead of generating one")
+	parser.add_argument("--save-corpus", help="Directory to write the generated corpus to")
+	parser.add_argument("--frames", type=int, default=5, help="Frames generated for each layout")
+	parser.add_argument("--repeat", type=int, default=3, help="Times each stage is run on each frame")
+	parser.add_argument("--canny", type=int, nargs=2, default=(50, 150), help="Canny thresholds (shadow size and intensity)")
+	parser.add_argument("--json", help="File to write the measures to")
+	parser.add_argument("--baseline", help="Measures of a previous run (--json) to compare with")
+	parser.add_argument("--seed", type=int, default=0)
+	args = parser.parse_args()
+
+	if args.corpus:
+		corpus = load_corpus(args.corpus)
+	else:
+		corpus = generate_corpus(args.frames, random.Random(args.seed))
+		if args.save_corpus:
+			save_corpus(corpus, args.save_corpus)
+	print("[Benchmark] {} frames".format(len(corpus)))
+
+	results = run(corpus, args.repeat, args)
+	baseline = None
+	if args.baseline:
+		with open(args.baseline) as f:
+			baseline = json.load(f)
+	report(results, baseline)
+	if args.json:
+		with open(args.json, "w") as f:
+			json.dump(results, f, indent=1)
+
+
+if __name__ == "__main__":
+	main()
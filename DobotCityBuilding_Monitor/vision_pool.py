@@ -0,0 +1,173 @@
+import multiprocessing
+from collections import deque
+from multiprocessing import shared_memory
+from multiprocessing.pool import AsyncResult
+
+import numpy as np
+
+import camera_utils
+
+# # # WORKER PROCESS SIDE # # #
+# Shared memory blocks attached by this worker process, by name
+attached = {}
+# Cell ID => copy of the calibration of the cell, whose storage zone keeps its transform from one frame to the next
+calibrations = {}
+
+
+def attach(name: str) -> shared_memory.SharedMemory:
+	"""
+	Attach a shared memory block created by the main process, once per worker process
+	The block stays registered to the main process' resource tracker, which is shared with its worker processes
+	"""
+	block = attached.get(name)
+	if block is None:
+		block = attached[name] = shared_memory.SharedMemory(name=name)
+	return block
+
+
+def worker_calibration(cell_id: int, parameters: camera_utils.DetectionParameters) -> camera_utils.Calibration:
+	"""
+	:return: The calibration of a cell in this worker process, updated with the parameters of the main process
+	"""
+	calibration = calibrations.get(cell_id)
+	if calibration is None or not calibration.matches(parameters):
+		calibration = calibrations[cell_id] = camera_utils.Calibration(parameters.storage, parameters.build)
+	calibration.apply(parameters)
+	return calibration
+
+
+def process_shared(
+		frame_name: str, shape: tuple, result_name: str, cell_id: int, parameters: camera_utils.DetectionParameters
+) -> camera_utils.StorageDetection:
+	"""
+	Run the storage detection on a frame held in shared memory
+	:param frame_name: Shared memory block holding the frame
+	:param shape: Shape of the frame
+	:param result_name: Shared memory block the annotated storage zone is written to
+	:param cell_id: Cell the frame comes from, the workers are shared by every cell
+	:param parameters: Detection parameters of the cell in the main process
+	:return: The detection, its image being replaced by its shape when it was written to the result block
+	"""
+	calibration = worker_calibration(cell_id, parameters)
+	# The frame is only read, its slot stays leased until the result is collected
+	image = np.ndarray(shape, np.uint8, buffer=attach(frame_name).buf)
+	# The storage zone is warped and annotated straight in the result buffer
+	block = attach(result_name)
+	zone_shape = calibration.storage_zone.shape()
+	output = np.ndarray(zone_shape, np.uint8, buffer=block.buf) if np.prod(zone_shape) <= block.size else None
+	detection = camera_utils.detect_storage(image, calibration, output=output)
+	if detection.image is None or output is None:
+		return detection._replace(image=None)
+	return detection._replace(image=detection.image.shape)
+
+
+# # # MAIN PROCESS SIDE # # #
+def create_pool(processes: int) -> multiprocessing.pool.Pool:
+	"""
+	Start worker processes, they can be shared by the VisionPool of several cells
+	"""
+	return multiprocessing.get_context("spawn").Pool(processes)
+
+
+class VisionPool:
+	"""
+	Runs the storage detection on a pool of worker processes
+	Workers read the frames straight from the camera's shared buffers and write the annotated storage zone
+	in a shared buffer of their own, so that no pixel goes through a pipe
+	Results are handed back in capture order
+	"""
+
+	def __init__(
+			self, processes: int, feed_handler, context: camera_utils.PipelineContext, cell,
+			pool: multiprocessing.pool.Pool = None
+	):
+		"""
+		:param processes: Number of worker processes, or of frames processed at once by a shared pool
+		:param feed_handler: CameraFeedHandler, with SHARED_MEMORY enabled
+		:param context: Buffers used to process the frames that can't be shared
+		:param cell: Cell the frames come from
+		:param pool: Worker processes shared with other cells, None to start processes of its own
+		"""
+		self.processes = processes
+		self.feed_handler = feed_handler
+		self.context = context
+		self.cell = cell
+		self.shared_pool = pool is not None
+		self.pool = pool if pool is not None else create_pool(processes)
+		# One result buffer per camera slot, a slot being leased until its result is collected
+		self.results = [
+			shared_memory.SharedMemory(create=True, size=feed_handler.SHARED_FRAME_BYTES)
+			for _ in range(feed_handler.RING_SIZE)
+		]
+		# (frame, AsyncResult or outcome) in capture order
+		self.pending = deque()
+
+	def has_capacity(self) -> bool:
+		return len(self.pending) < self.processes
+
+	def submit(self, frame):
+		"""
+		Queue a frame leased from the camera feed, the lease is released once its result is collected
+		"""
+		if not frame.success:
+			self.pending.append((frame, camera_utils.StorageDetection(False, (), None, ())))
+		elif self.feed_handler.is_shared(frame):
+			self.pending.append((frame, self.pool.apply_async(process_shared, (
+				self.feed_handler.shared[frame.slot].name, frame.image.shape, self.results[frame.slot].name,
+				self.cell.cell_id, self.cell.calibration.parameters()
+			))))
+		else:
+			# The frame didn't fit in shared memory, process it here
+			self.pending.append((frame, camera_utils.detect_storage(frame.image, self.cell.calibration, self.context)))
+
+	def collect(self, timeout: float) -> list[tuple]:
+		"""
+		Wait for the oldest frame to be processed
+		:param timeout: Maximum time to wait for, in seconds
+		:return: (frame, detection) for each frame processed, in capture order
+		The image of the detections is always set, to the frame itself when the storage zone wasn't found
+		"""
+		collected = []
+		while self.pending:
+			frame, job = self.pending[0]
+			if isinstance(job, AsyncResult):
+				if not job.ready():
+					if collected:
+						break
+					job.wait(timeout)
+					if not job.ready():
+						break
+				try:
+					detection = job.get()
+				except Exception as e:
+					print("[Vision] Failed to process frame {} : {}".format(frame.seq, e))
+					detection = camera_utils.StorageDetection(False, (), None, ())
+				# Copy the result out of the shared buffers before they are reused
+				if detection.image is not None:
+					shape = detection.image
+					detection = detection._replace(image=np.ndarray(shape, np.uint8, buffer=self.results[frame.slot].buf).copy())
+			else:
+				detection = job
+			if detection.image is None:
+				detection = detection._replace(image=frame.image.copy())
+			self.pending.popleft()
+			self.feed_handler.release_frame(frame)
+			collected.append((frame, detection))
+		return collected
+
+	def close(self):
+		if self.shared_pool:
+			# The other cells keep using the workers, wait for them to be done with the shared buffers
+			for _, job in self.pending:
+				if isinstance(job, AsyncResult):
+					job.wait()
+		else:
+			self.pool.terminate()
+			self.pool.join()
+		for frame, _ in self.pending:
+			self.feed_handler.release_frame(frame)
+		self.pending.clear()
+		for block in self.results:
+			block.close()
+			block.unlink()
+		self.results = []
@@ -0,0 +1,215 @@
+import multiprocessing.pool
+import time
+from typing import NamedTuple
+
+import numpy as np
+
+import camera_utils
+import city_map
+import metrics
+from base_handler import *
+from block_tracker import BlockTracker
+from vision_pool import VisionPool
+
+
+# Time spent in each stage of the detection, and from the capture of a frame to the end of its processing
+stage_seconds = {
+	stage: metrics.histogram("vision_stage_seconds", "Time spent in each stage of the detection", stage=stage)
+	for stage in camera_utils.STAGES
+}
+latency_seconds = metrics.histogram("vision_latency_seconds", "Time from the capture of a frame to the end of its processing")
+
+
+class VisionResult(NamedTuple):
+	"""
+	Outcome of the processing of one frame, never modified once built
+	"""
+	seq: int  # Sequence number of the processed frame
+	timestamp: float  # time.monotonic() at which the frame was captured
+	processed_at: float  # time.monotonic() at which the processing completed
+	success: bool  # Whether the capture succeeded
+	area_found: bool  # Whether the storage zone was detected
+	compounds: np.ndarray  # Compounds detected in this frame, as a read-only (N, 4) array of x, y, rot, type
+	blocks: tuple  # Confirmed blocks after this frame, as (x, y, rot, type) tuples
+	changed: bool  # Whether the confirmed blocks changed enough to be sent again
+	image: np.ndarray  # Read-only image to display, in an array of its own
+	timings: tuple  # (stage, seconds) for each processing stage that ran
+	build: city_map.BuildCheck | None  # Verification of the build zone in this frame, None if it wasn't found
+
+	@property
+	def count(self) -> int:
+		return len(self.blocks)
+
+
+class ResultBoard:
+	"""
+	Holds the latest VisionResult, replaced with a single reference swap : readers never need a lock
+	Subscribers are called with every new result, on the publishing thread
+	"""
+
+	def __init__(self):
+		self.latest: VisionResult | None = None
+		# Replaced rather than modified, so that publishing can iterate over it without a lock
+		self.subscribers = ()
+
+	def subscribe(self, callback):
+		"""
+		:param callback: Called with every new VisionResult, it should return quickly
+		"""
+		self.subscribers = self.subscribers + (callback,)
+
+	def unsubscribe(self, callback):
+		self.subscribers = tuple(sub for sub in self.subscribers if sub != callback)
+
+	def publish(self, result: VisionResult):
+		self.latest = result
+		for callback in self.subscribers:
+			try:
+				callback(result)
+			except Exception as e:
+				print("[Vision] Result subscriber failed : {}".format(e))
+
+
+class VisionWorkerHandler(BaseHandler):
+	"""
+	Processes the camera frames outside of the tkinter main loop
+	The newest frame is always the one processed, frames captured in the meantime are dropped
+	"""
+
+	FRAME_TIMEOUT = 0.5  # seconds, how long to wait for a new frame before checking whether the thread should stop
+	COLLECT_TIMEOUT = 0.005  # seconds, how long to wait for a worker process before looking for a new frame
+	# Worker processes running the detection, 0 to run it in this thread
+	# Requires CameraFeedHandler.SHARED_MEMORY, and a ring of at least PROCESSES + 2 frames
+	PROCESSES = 0
+	# Worker processes shared by the cells, each cell then keeps up to PROCESSES frames in them
+	# None for each cell to start PROCESSES processes of its own
+	SHARED_POOL: multiprocessing.pool.Pool = None
+
+	# Filters the detected blocks across frames, only confirmed changes are sent over bluetooth
+	tracker: BlockTracker
+	# Buffers of the processing, reused from one frame to the next
+	context: camera_utils.PipelineContext
+	# Sequence number of the last processed frame
+	last_frame_seq = -1
+	# Frames that were captured while another one was being processed, and never processed
+	dropped = 0
+	dropped_frames: metrics.Counter
+	processed_frames: metrics.Counter
+	misplaced_blocks: metrics.Gauge
+
+	# # # OUTPUT DATA # # #
+	results: ResultBoard
+
+	def init(self):
+		self.tracker = BlockTracker()
+		self.context = camera_utils.PipelineContext()
+		self.last_frame_seq = -1
+		self.dropped = 0
+		cell_id = self.cell.cell_id
+		self.dropped_frames = metrics.counter("vision_dropped_frames_total", "Captured frames that were never processed", cell=cell_id)
+		self.processed_frames = metrics.counter("vision_processed_frames_total", "Processed frames", cell=cell_id)
+		self.misplaced_blocks = metrics.gauge("build_misplaced_blocks", "Blocks of the build zone that aren't on a slot of their type", cell=cell_id)
+		self.results = ResultBoard()
+		self.results.subscribe(self.send_changes)
+
+	def update(self):
+		feed_handler = None
+		while self.running and feed_handler is None:
+			feed_handler = self.cell.get(HandlerId.CAMERA_FEED)
+			if feed_handler is None:
+				time.sleep(self.FRAME_TIMEOUT)
+		if self.PROCESSES > 0:
+			return self.update_pool(feed_handler)
+
+		while self.running:
+			frame = feed_handler.lease_frame(self.last_frame_seq, timeout=self.FRAME_TIMEOUT)
+			if frame is None:
+				continue
+			# The frame is processed in place, the capture doesn't touch its buffer until it is released
+			try:
+				self.frame_taken(frame)
+				if frame.success:
+					detection = camera_utils.detect_storage(frame.image, self.cell.calibration, self.context)
+				else:
+					detection = camera_utils.StorageDetection(False, (), None, ())
+				if detection.image is None:
+					# Nothing to annotate, show the frame itself
+					detection = detection._replace(image=frame.image.copy())
+			finally:
+				feed_handler.release_frame(frame)
+			self.results.publish(self.conclude(frame, detection))
+
+	def update_pool(self, feed_handler):
+		"""
+		Dispatch the frames to worker processes, and handle their results in capture order
+		"""
+		pool = VisionPool(self.PROCESSES, feed_handler, self.context, self.cell, self.SHARED_POOL)
+		metrics.gauge(
+			"vision_pool_pending", "Frames submitted to the worker processes and not collected yet", lambda: len(pool.pending),
+			cell=self.cell.cell_id
+		)
+		try:
+			while self.running:
+				# Keep every process busy with the newest frames
+				while pool.has_capacity():
+					frame = feed_handler.lease_frame(self.last_frame_seq, timeout=0 if pool.pending else self.FRAME_TIMEOUT)
+					if frame is None:
+						break
+					self.frame_taken(frame)
+					pool.submit(frame)
+				for frame, detection in pool.collect(self.COLLECT_TIMEOUT):
+					self.results.publish(self.conclude(frame, detection))
+		finally:
+			pool.close()
+
+	def frame_taken(self, frame):
+		if self.last_frame_seq >= 0:
+			self.dropped += frame.seq - self.last_frame_seq - 1
+			self.dropped_frames.inc(frame.seq - self.last_frame_seq - 1)
+		self.last_frame_seq = frame.seq
+
+	def conclude(self, frame, detection: camera_utils.StorageDetection) -> VisionResult:
+		"""
+		Filter the blocks detected in a frame
+		Must be called in capture order
+		:param detection: Outcome of the storage processing, its image must not be modified afterwards
+		"""
+		if frame.success:
+			changed = detection.area_found and self.tracker.update(detection.compounds)
+		else:
+			# Blocks that can't be seen anymore are removed from the Arduino memory once the tracker drops them
+			changed = self.tracker.update([])
+
+		compounds = np.array(detection.compounds, np.float64).reshape(-1, 4)
+		compounds.flags.writeable = False
+		image = detection.image.view()
+		image.flags.writeable = False
+		result = VisionResult(
+			frame.seq, frame.timestamp, time.monotonic(), frame.success, detection.area_found,
+			compounds, tuple(map(tuple, self.tracker.blocks())), changed, image, detection.timings, detection.build
+		)
+		if detection.build is not None:
+			self.misplaced_blocks.set(len(detection.build.misplaced))
+		for stage, seconds in detection.timings:
+			stage_seconds[stage].observe(seconds)
+		latency_seconds.observe(result.processed_at - result.timestamp)
+		self.processed_frames.inc()
+		return result
+
+	def send_changes(self, result: VisionResult):
+		"""
+		Send the confirmed blocks over bluetooth when they changed
+		"""
+		if result.changed:
+			bluetooth_h = self.cell.get(HandlerId.BLUETOOTH)
+			if bluetooth_h is not None:
+				bluetooth_h.send_blocks(result.blocks)
+
+	def latest_result(self) -> VisionResult | None:
+		"""
+		:return: The result of the last processed frame, or None if no frame was processed yet
+		"""
+		return self.results.latest
+
+	def stop_actions(self):
+		pass